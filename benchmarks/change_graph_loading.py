@@ -0,0 +1,78 @@
+"""
+Measures loading a change graphs store for the miner, see storage.loader.
+The CPU time of the main process bounds the loading time once there are enough worker processes to feed it
+
+Run: python3 -m benchmarks.change_graph_loading [--repeat N] [--graphs N] [--blocks N] [--copies N]
+                                                [--compression none|zlib|lzma] [--processes N [N ...]]
+"""
+import argparse
+import logging
+import multiprocessing
+import shutil
+import tempfile
+import time
+
+import storage
+import storage.change_graphs
+import storage.loader
+from benchmarks import utils
+from storage.segments import Codec
+
+
+def _write_store(graphs, copies, storage_dir):
+    encoded_graphs = [storage.encode_change_graph(graph, storage_dir=storage_dir) for graph in graphs]
+    storage.store_encoded_change_graphs([encoded._replace(graph_id=copy_num * len(graphs) + graph_num)
+                                         for copy_num in range(copies)
+                                         for graph_num, encoded in enumerate(encoded_graphs)],
+                                        storage_dir=storage_dir)
+
+
+def _load(storage_dir, processes):
+    """
+    Returns the number of the loaded graphs and the CPU time of the main process in ms
+    """
+    store = storage.ChangeGraphStore(storage_dir)
+    start = time.process_time()
+    graph_cnt = sum(1 for _ in storage.loader.iter_change_graphs(store, processes=processes))
+    cpu_ms = (time.process_time() - start) * 1000
+    store.close()
+    return graph_cnt, cpu_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--graphs', type=int, default=20)
+    parser.add_argument('--blocks', type=int, default=5)
+    parser.add_argument('--copies', type=int, default=10, help='every graph is stored this many times')
+    parser.add_argument('--compression', default='none', help='see change_graphs_compression')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, multiprocessing.cpu_count()],
+                        help='see patterns_loader_processes')
+    args = parser.parse_args()
+
+    multiprocessing.set_start_method('spawn', force=True)  # as in main.py
+    storage.change_graphs.COMPRESSION = Codec.from_name(args.compression)
+    graphs = utils.generate_change_graphs(count=args.graphs, blocks=args.blocks)
+
+    storage_dir = tempfile.mkdtemp(prefix='cg-loading-')
+    try:
+        _write_store(graphs, args.copies, storage_dir)
+        logging.disable(logging.CRITICAL)  # the loader logs its progress
+
+        rows = []
+        for processes in args.processes:
+            graph_cnt, _ = _load(storage_dir, processes)
+            cpu_times = [_load(storage_dir, processes)[1] for _ in range(args.repeat)]
+            best, mean = utils.measure(lambda: _load(storage_dir, processes), repeat=args.repeat)
+            rows.append([processes, f'{best:.1f}', f'{mean:.1f}', f'{min(cpu_times):.1f}',
+                         f'{graph_cnt / best * 1000:.1f}'])
+    finally:
+        shutil.rmtree(storage_dir, ignore_errors=True)
+
+    print(f'{graph_cnt} graphs, {sum(len(graph.nodes) for graph in graphs) * args.copies} nodes, '
+          f'{args.compression} compression, {multiprocessing.cpu_count()} CPUs')
+    utils.print_table(['processes', 'load best, ms', 'load mean, ms', 'main process CPU best, ms', 'graphs/s'], rows)
+
+
+if __name__ == '__main__':
+    main()
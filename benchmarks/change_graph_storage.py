@@ -0,0 +1,41 @@
+"""
+Compares pickling change graphs as linked objects with the flat change graph format, with and without asts
+
+Run: python3 -m benchmarks.change_graph_storage [--repeat N] [--graphs N] [--blocks N]
+"""
+import argparse
+import pickle
+import sys
+from functools import partial
+
+from benchmarks import utils
+from changegraph import serialization
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--graphs', type=int, default=20)
+    parser.add_argument('--blocks', type=int, default=5)
+    args = parser.parse_args()
+
+    sys.setrecursionlimit(2 ** 31 - 1)  # as in main.py, the linked graphs are not picklable otherwise
+    graphs = utils.generate_change_graphs(count=args.graphs, blocks=args.blocks)
+    node_cnt = sum(len(graph.nodes) for graph in graphs)
+
+    rows = []
+    for name, dumps, loads in [('pickle', lambda g: pickle.dumps(g, protocol=5), pickle.loads),
+                               ('flat', serialization.encode, serialization.decode),
+                               ('flat, no ast', partial(serialization.encode, keep_ast=False), serialization.decode)]:
+        dumped = [dumps(graph) for graph in graphs]
+        dump_best, _ = utils.measure(lambda: [dumps(graph) for graph in graphs], repeat=args.repeat)
+        load_best, load_mean = utils.measure(lambda: [loads(data) for data in dumped], repeat=args.repeat)
+        rows.append([name, f'{sum(map(len, dumped)) // len(dumped)}', f'{dump_best:.1f}',
+                     f'{load_best:.1f}', f'{load_mean:.1f}'])
+
+    print(f'{len(graphs)} graphs, {node_cnt} nodes')
+    utils.print_table(['format', 'bytes/graph', 'dump best, ms', 'load best, ms', 'load mean, ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Measures Miner on change graphs of a synthetic module with renamed calls, the graphs are decoded from the flat format
+as in the patterns mode
+
+Run: python3 -m benchmarks.pattern_mining [--repeat N] [--graphs N] [--blocks N] [--processes N]
+"""
+import argparse
+import logging
+import multiprocessing
+import tracemalloc
+
+from benchmarks import utils
+from changegraph import serialization
+from patterns import Miner
+
+
+def _load(encoded_graphs):
+    return [serialization.decode(data) for data in encoded_graphs]
+
+
+def _mine(graphs):
+    miner = Miner()
+    miner.mine_patterns(graphs)
+    return miner
+
+
+def _measure_peak(encoded_graphs):
+    """
+    Returns the memory of the loaded graphs and the peak memory of mining them in KiB
+    """
+    tracemalloc.start()
+    graphs = _load(encoded_graphs)
+    graphs_kib = tracemalloc.get_traced_memory()[0] // 1024
+    tracemalloc.reset_peak()
+    _mine(graphs)
+    mining_peak_kib = tracemalloc.get_traced_memory()[1] // 1024 - graphs_kib
+    tracemalloc.stop()
+    return graphs_kib, mining_peak_kib
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--graphs', type=int, default=30)
+    parser.add_argument('--blocks', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=1, help='see patterns_mining_processes')
+    args = parser.parse_args()
+
+    Miner.PROCESSES = args.processes
+    multiprocessing.set_start_method('spawn', force=True)  # as in main.py
+
+    graphs = utils.generate_edited_change_graphs(count=args.graphs, blocks=args.blocks)
+    for graph_id, graph in enumerate(graphs, start=1):
+        graph.id = graph_id  # stored as the graph id, the decoded node hashes are then the same in every run
+    encoded_graphs = [serialization.encode(graph, keep_ast=False) for graph in graphs]
+    logging.disable(logging.CRITICAL)  # the miner logs every step
+
+    miner = _mine(_load(encoded_graphs))
+    sizes = sorted(pattern.size for patterns in miner._size_to_patterns.values() for pattern in patterns)
+    peaks = [_measure_peak(encoded_graphs) for _ in range(args.repeat)]
+    best, mean = utils.measure(lambda: _mine(_load(encoded_graphs)), repeat=args.repeat)
+
+    print(f'{len(graphs)} graphs, {sum(len(graph.nodes) for graph in graphs)} nodes, pattern sizes {sizes}')
+    mining_peaks = sorted(peak for _, peak in peaks)  # the mining order, so the peak, varies between runs
+    utils.print_table(['graphs, KiB', 'mining peak min, KiB', 'mining peak median, KiB',
+                       'load and mine best, ms', 'load and mine mean, ms'],
+                      [[peaks[0][0], mining_peaks[0], mining_peaks[len(mining_peaks) // 2],
+                        f'{best:.1f}', f'{mean:.1f}']])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Measures pyflowgraph.build_from_source over the test fixtures and a large synthetic module
+
+Run: python3 -m benchmarks.pyflowgraph_build [--repeat N] [--blocks N]
+"""
+import argparse
+
+import pyflowgraph
+from benchmarks import utils
+
+
+def _build_all(sources, strict):
+    for _, src in sources:
+        pyflowgraph.build_from_source(src, strict=strict)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--blocks', type=int, default=40)
+    args = parser.parse_args()
+
+    fixtures = utils.collect_test_fixtures()
+    synthetic = [('synthetic', utils.generate_synthetic_module(blocks=args.blocks))]
+
+    rows = []
+    for name, sources in [(f'fixtures ({len(fixtures)})', fixtures), ('synthetic', synthetic)]:
+        for strict in [False, True]:
+            best, mean = utils.measure(lambda: _build_all(sources, strict), repeat=args.repeat)
+            rows.append([name, 'strict' if strict else 'default', f'{best:.1f}', f'{mean:.1f}'])
+
+    utils.print_table(['corpus', 'mode', 'best, ms', 'mean, ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Measures the parse phase of pyflowgraph building: full asttokens marking vs TokenPositions
+
+Run: python3 -m benchmarks.pyflowgraph_positions [--repeat N] [--blocks N]
+"""
+import argparse
+import ast
+
+from asttokens import asttokens
+
+from benchmarks import utils
+from pyflowgraph.positions import TokenPositions
+from vb_utils import SourceText
+
+
+def _parse_marked(sources):
+    for _, src in sources:
+        asttokens.ASTTokens(src, tree=ast.parse(src, mode='exec'))
+
+
+def _parse_lazy(sources):
+    for _, src in sources:
+        ast.parse(src, mode='exec')
+        TokenPositions(SourceText(src)).tokens  # the build always asks for token boundaries at least once
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--blocks', type=int, default=40)
+    args = parser.parse_args()
+
+    fixtures = utils.collect_test_fixtures()
+    synthetic = [('synthetic', utils.generate_synthetic_module(blocks=args.blocks))]
+
+    rows = []
+    for name, sources in [(f'fixtures ({len(fixtures)})', fixtures), ('synthetic', synthetic)]:
+        for mode, fn in [('asttokens', _parse_marked), ('positions', _parse_lazy)]:
+            best, mean = utils.measure(lambda: fn(sources), repeat=args.repeat)
+            rows.append([name, mode, f'{best:.2f}', f'{mean:.2f}'])
+
+    utils.print_table(['corpus', 'parse phase', 'best, ms', 'mean, ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
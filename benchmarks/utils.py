@@ -0,0 +1,164 @@
+import ast
+import functools
+import os
+import time
+from pathlib import Path
+
+import pyflowgraph
+from changegraph.build import ChangeGraphBuilder
+from pyflowgraph.models import EntryNode, Node
+from tests import utils as test_utils
+from vcs.traverse import GitAnalyzer, RepoInfo
+
+TESTS_DIR = os.path.join(Path(__file__).parent.parent.absolute(), 'tests')
+FIXTURE_FN_NAMES = {'format_src', '_build_fg'}
+
+
+def collect_test_fixtures(tests_dir=TESTS_DIR):
+    """
+    Returns (name, source) for every source literal passed to the test helpers
+    """
+    fixtures = []
+    for file_name in sorted(os.listdir(tests_dir)):
+        if not file_name.startswith('test_') or not file_name.endswith('.py'):
+            continue
+
+        with open(os.path.join(tests_dir, file_name), 'r+') as f:
+            tree = ast.parse(f.read(), mode='exec')
+
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call) or not node.args:
+                continue
+
+            fn = node.func
+            fn_name = fn.attr if isinstance(fn, ast.Attribute) else getattr(fn, 'id', None)
+            arg = node.args[0]
+            if fn_name in FIXTURE_FN_NAMES and isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                fixtures.append((f'{file_name}:{node.lineno}', test_utils.format_src(arg.value)))
+    return fixtures
+
+
+def generate_synthetic_module(blocks=40):
+    """
+    Generates a single large function, which touches most of the supported syntax
+    """
+    lines = ['def synthetic(self, data, items):']
+    for i in range(blocks):
+        lines += [
+            f'    value_{i} = self.load(data, key="k{i}")',
+            f'    if value_{i} is not None and len(items) > {i}:',
+            f'        items.append(value_{i} + {i})',
+            f'    for item in items[:{i}]:',
+            f'        total_{i} = [x * 2 for x in item.values if x]',
+            f'        cache_{i} = {{"id": item.id, "count": total_{i}}}',
+            f'    try:',
+            f'        result_{i} = helper(value_{i}, items)',
+            f'    except ValueError as e:',
+            f'        result_{i} = str(e)',
+            f'    while result_{i}:',
+            f'        result_{i} -= 1',
+        ]
+    lines.append('    return items')
+    return '\n'.join(lines) + '\n'
+
+
+def _mark_all_changed(fg):
+    fg.changed_nodes = {node for node in fg.nodes if not isinstance(node, EntryNode)}
+
+
+def build_change_graph(before_src, after_src):
+    """
+    Builds a change graph where every flow graph node is considered changed, so GumTree is not needed
+    """
+    fg1 = pyflowgraph.build_from_source(before_src)
+    fg2 = pyflowgraph.build_from_source(after_src)
+    for node in fg2.nodes:
+        node.version = Node.Version.AFTER_CHANGES
+
+    for fg in [fg1, fg2]:
+        fg.calc_changed_nodes_by_gumtree = functools.partial(_mark_all_changed, fg)
+
+    old_method, = GitAnalyzer._extract_methods('before.py', before_src)
+    new_method, = GitAnalyzer._extract_methods('after.py', after_src)
+    repo_info = RepoInfo('repo', 'repo', 'https://github.com/user/repo.git', 'hash', None,
+                         'before.py', 'after.py', old_method, new_method)
+    return ChangeGraphBuilder._create_change_graph(fg1, fg2, repo_info=repo_info)
+
+
+def _mark_changed_lines(fg, changed_linenos):
+    changed_nodes = {node for node in fg.nodes
+                     if not isinstance(node, EntryNode) and getattr(node.ast, 'lineno', None) in changed_linenos}
+    fg.changed_nodes = changed_nodes.union(*[node.get_definitions() for node in changed_nodes])
+
+
+def _map_same_locations(fg1, fg2):
+    location_to_node = {(type(node), node.ast.lineno, node.ast.col_offset): node for node in fg2.nodes
+                        if getattr(node.ast, 'lineno', None) is not None}
+    for node in fg1.nodes:
+        if getattr(node.ast, 'lineno', None) is None:
+            continue
+        mapped = location_to_node.get((type(node), node.ast.lineno, node.ast.col_offset))
+        if mapped is not None and mapped.mapped is None:
+            node.mapped, mapped.mapped = mapped, node
+
+
+def build_edited_change_graph(before_src, after_src):
+    """
+    Builds a change graph of the edited lines, the nodes at the same location are mapped like GumTree would do.
+    Unlike build_change_graph, the graph has mining seeds and a realistic size
+    """
+    fg1 = pyflowgraph.build_from_source(before_src)
+    fg2 = pyflowgraph.build_from_source(after_src)
+    for node in fg2.nodes:
+        node.version = Node.Version.AFTER_CHANGES
+
+    changed_linenos = {num for num, (before_line, after_line)
+                       in enumerate(zip(before_src.splitlines(), after_src.splitlines()), start=1)
+                       if before_line != after_line}
+    for fg in [fg1, fg2]:
+        fg.calc_changed_nodes_by_gumtree = functools.partial(_mark_changed_lines, fg, changed_linenos)
+    _map_same_locations(fg1, fg2)
+
+    return ChangeGraphBuilder._create_change_graph(fg1, fg2)
+
+
+def generate_edited_change_graphs(count=50, blocks=5):
+    """
+    Returns change graphs of the synthetic module against the versions with some of the calls renamed
+    """
+    before_src = generate_synthetic_module(blocks=blocks)
+    graphs = []
+    for i in range(count):
+        lines = before_src.splitlines()
+        for num, line in enumerate(lines):
+            if (num + i) % 3 == 0:
+                lines[num] = line.replace('self.load(', 'self.fetch(').replace('helper(', 'helper_v2(')
+        graphs.append(build_edited_change_graph(before_src, '\n'.join(lines) + '\n'))
+    return graphs
+
+
+def generate_change_graphs(count=20, blocks=5):
+    """
+    Returns change graphs of the synthetic module against its slightly changed versions
+    """
+    before_src = generate_synthetic_module(blocks=blocks)
+    return [build_change_graph(before_src, before_src.replace(f'key="k{i % blocks}"', f'key="k{i % blocks}", i={i}'))
+            for i in range(count)]
+
+
+def measure(fn, repeat=5):
+    """
+    Returns the best and the mean wall time of fn in milliseconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings), sum(timings) / len(timings)
+
+
+def print_table(header, rows):
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)))
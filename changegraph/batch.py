@@ -0,0 +1,117 @@
+import ast
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from functools import partial
+
+import changegraph
+import settings
+import storage
+from log import logger
+from vb_utils import SourceText
+from vcs.traverse import Method, RepoInfo
+
+STORE_INTERVAL = settings.get('change_graphs_store_interval', 300)
+
+
+def read_manifest(manifest_path):
+    """
+    Yields (old_path, new_path, metadata) from a JSON Lines manifest, one object per line
+    """
+    with open(manifest_path, 'r') as f:
+        for line_num, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                record = json.loads(line)
+                yield record['old_path'], record['new_path'], record.get('metadata') or {}
+            except (ValueError, KeyError):
+                logger.error(f'Incorrect manifest record at line {line_num}: {line}')
+
+
+def _read_method(path, method_name):
+    with open(path, 'r+') as f:
+        src = f.read()
+
+    root = ast.parse(src, mode='exec').body[0]
+    return Method(path, method_name or getattr(root, 'name', 'module'), root, SourceText(src.strip()))
+
+
+def _parse_dtm(value):
+    if not value:
+        return None
+
+    dtm = datetime.datetime.fromisoformat(value)
+    return dtm if dtm.tzinfo else dtm.replace(tzinfo=datetime.timezone.utc)
+
+
+def _create_repo_info(old_path, new_path, metadata):
+    return RepoInfo(
+        metadata.get('repo_name', ''),
+        metadata.get('repo_path', ''),
+        metadata.get('repo_url', ''),
+        metadata.get('commit_hash', ''),
+        _parse_dtm(metadata.get('commit_dtm')),
+        metadata.get('old_file_path', old_path),
+        metadata.get('new_file_path', new_path),
+        _read_method(old_path, metadata.get('old_method')),
+        _read_method(new_path, metadata.get('new_method')),
+        author_email=metadata.get('author_email'),
+        author_name=metadata.get('author_name')
+    )
+
+
+def _init_worker():
+    sys.setrecursionlimit(2 ** 31 - 1)
+
+
+def _build_encoded_graph(record, storage_dir=None):
+    old_path, new_path, metadata = record
+    try:
+        repo_info = _create_repo_info(old_path, new_path, metadata)
+        cg = changegraph.build_from_files(old_path, new_path, repo_info=repo_info)
+    except Exception:
+        logger.log(logger.ERROR, f'Unable to build a change graph for {old_path} -> {new_path}',
+                   exc_info=True, show_pid=True)
+        return None
+
+    return storage.encode_change_graph(cg, storage_dir=storage_dir)
+
+
+def build_batch(manifest_path, storage_dir=None, processes=None):
+    """
+    Builds change graphs for the manifest pairs in a process pool and stores them in the change graphs storage.
+    The manifest is consumed in windows of change_graphs_store_interval records, each window is appended
+    to the segment of the current process with its seeds and catalog records, so at most one window of graphs
+    is kept in memory
+    """
+    records = read_manifest(manifest_path)
+    if storage_dir:
+        os.makedirs(storage_dir, exist_ok=True)
+
+    build_fn = partial(_build_encoded_graph, storage_dir=storage_dir)
+    built_cnt = processed_cnt = 0
+    start = time.time()
+    with multiprocessing.Pool(processes=processes or multiprocessing.cpu_count(), initializer=_init_worker,
+                              maxtasksperchild=1000) as pool:
+        while True:
+            window = list(itertools.islice(records, STORE_INTERVAL))
+            if not window:
+                break
+
+            encoded_graphs = [encoded for encoded in pool.imap_unordered(build_fn, window)
+                              if encoded is not None]
+            if encoded_graphs:
+                storage.store_encoded_change_graphs(encoded_graphs, storage_dir=storage_dir)
+
+            built_cnt += len(encoded_graphs)
+            processed_cnt += len(window)
+            logger.warning(f'Built {built_cnt} change graphs from {processed_cnt} pairs', start_time=start)
+
+    return built_cnt
@@ -64,14 +64,12 @@ class ChangeGraphBuilder:  # TODO: make gumtree optional
                 continue
 
             node = ChangeNode.create_from_fg_node(fg_node)
-            cg.nodes.add(node)
-            node.set_graph(cg)  # todo: probably better to create method 'add_node'
+            cg.add_node(node)
             fg_node_to_cg_node[fg_node] = node
 
             if fg_node.mapped and fg_node.mapped in fg_changed_nodes:
                 mapped_node = ChangeNode.create_from_fg_node(fg_node.mapped)
-                cg.nodes.add(mapped_node)
-                mapped_node.set_graph(cg)
+                cg.add_node(mapped_node)
                 fg_node_to_cg_node[fg_node.mapped] = mapped_node
 
                 node.mapped = mapped_node
@@ -81,6 +79,8 @@ class ChangeGraphBuilder:  # TODO: make gumtree optional
             for e in fg_node.in_edges:
                 if e.node_from in fg_changed_nodes:
                     ChangeEdge.create(e.label, fg_node_to_cg_node[e.node_from], fg_node_to_cg_node[e.node_to])
+
+        cg.freeze()
         return cg
 
 
@@ -0,0 +1,39 @@
+"""
+Process-wide table of the node labels.
+
+The labels of the loaded change graphs are interned to small integer ids, so the nodes share a single string
+per label and the miner keys its seeds and extensions by tuples of ids instead of concatenated strings.
+The ids are only valid within a process, they are never stored or pickled.
+"""
+
+
+class LabelTable:
+    def __init__(self):
+        self.labels = []
+        self._label_to_id = {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get_id(self, label):
+        label_id = self._label_to_id.get(label)
+        if label_id is None:
+            label_id = len(self.labels)
+            self.labels.append(label)
+            self._label_to_id[label] = label_id
+        return label_id
+
+    def intern(self, label):
+        """
+        Returns the shared instance of the label
+        """
+        return self.labels[self.get_id(label)]
+
+    def get_label(self, label_id):
+        return self.labels[label_id]
+
+    def format(self, label_ids, separator='-'):
+        return separator.join(str(self.labels[label_id]) for label_id in label_ids)
+
+
+LABELS = LabelTable()
@@ -1,23 +1,83 @@
+import itertools
+import uuid
+
+from changegraph.labels import LABELS
 from pyflowgraph.models import DataNode, Node, OperationNode, ControlNode, LinkType
+from vb_utils import NodePosition
+
+
+def generate_graph_id():
+    return uuid.uuid4().int >> 65  # 63 bits, a non-negative signed 64-bit integer
 
 
 class ChangeGraph:
-    def __init__(self, repo_info=None):
+    def __init__(self, repo_info=None, graph_id=None):
+        self.id = graph_id if graph_id is not None else generate_graph_id()
         self.nodes = set()
         self.repo_info = repo_info
+        self.is_frozen = False
+
+    def __setstate__(self, state):
+        if 'id' not in state:  # graphs stored before the graph ids, see renumber_nodes
+            state['id'] = generate_graph_id()
+        state.setdefault('is_frozen', False)
+        self.__dict__.update(state)
+
+    def freeze(self):
+        """
+        Marks the graph as built, the node neighbors are then looked up in adjacency partitioned by edge label
+        instead of filtering the edges on every call. Adding an edge later resets the partitions of its nodes
+        """
+        self.is_frozen = True
+
+    def add_node(self, node):
+        """
+        Numbers the node densely within the graph, it must not be in any set or dict yet
+        """
+        node.bind(self, len(self.nodes))
+        self.nodes.add(node)
+
+    def renumber_nodes(self):
+        """
+        Numbers the nodes of a graph built without add_node densely, keeping their order
+        """
+        nodes = sorted(self.nodes, key=lambda node: node.id)
+        for index, node in enumerate(nodes):
+            node.bind(self, index)
+        self.nodes = set(nodes)
+
+    def get_seed_counts(self):
+        """
+        Returns the number of node pairs per seed key, see ChangeNode.get_seed_key
+        """
+        seed_counts = {}
+        for node in self.nodes:
+            key = node.get_seed_key()
+            if key is not None:
+                seed_counts[key] = seed_counts.get(key, 0) + 1
+        return seed_counts
 
 
 class ChangeNode:  # todo: create base class for pfg and cg
-    _NODE_ID = 0
+    __slots__ = ('id', '_key', '_hash', 'statement_num', 'ast', 'position', 'label', 'label_id', 'original_label',
+                 'in_edges', 'out_edges', 'mapped', 'graph', 'kind', 'sub_kind', 'version', '_data',
+                 '_in_by_label', '_out_by_label', '_neighbors')
+    _TRANSIENT_SLOTS = ('label_id', '_in_by_label', '_out_by_label', '_neighbors')  # valid within a process only
+
+    _unbound_ids = itertools.count(-1, -1)  # ids of the nodes not added to a graph yet
 
     class Property:
         SYNTAX_TOKEN_INTERVALS = Node.Property.SYNTAX_TOKEN_INTERVALS
         ALL = [SYNTAX_TOKEN_INTERVALS]
 
     def set_property(self, prop, value):
+        if self._data is None:
+            self._data = {}
         self._data[prop] = value
 
     def get_property(self, prop, default=None):
+        if self._data is None:
+            return default
         return self._data.get(prop, default)
 
     class CommonLabel:
@@ -46,14 +106,15 @@ class ChangeNode:  # todo: create base class for pfg and cg
         OP_RETURN = OperationNode.Kind.RETURN
 
     def __init__(self, statement_num, ast, label, kind, version, sub_kind=None, original_label=None):
-        ChangeNode._NODE_ID += 1
-        self.id = ChangeNode._NODE_ID
+        self.id = next(ChangeNode._unbound_ids)
+        self._key = (None, self.id)
+        self._hash = hash(self._key)
 
         self.statement_num = statement_num
         self.ast = ast
+        self.position = self._get_ast_position(ast)
 
-        self.label = label
-        self.original_label = original_label
+        self.set_label(label, original_label)
 
         self.in_edges = set()
         self.out_edges = set()
@@ -65,7 +126,54 @@ class ChangeNode:  # todo: create base class for pfg and cg
 
         self.version = version
 
-        self._data = {}
+        self._data = None  # most nodes have no properties
+        self.reset_adjacency()
+
+    def __reduce_ex__(self, protocol):
+        # the identity is restored before the state, a node may be added to a set while its state is unpickled
+        return ChangeNode._create_with_key, (self._key,), self.__getstate__()
+
+    @classmethod
+    def _create_with_key(cls, key):
+        node = cls.__new__(cls)
+        node._key = key
+        node._hash = hash(key)
+        return node
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__
+                if name not in self._TRANSIENT_SLOTS and hasattr(self, name)}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):  # (dict state, slots state) of the default slots pickling
+            state = {**(state[0] or {}), **state[1]}
+        if 'position' not in state:  # graphs stored before positions were introduced
+            state['position'] = self._get_ast_position(state.get('ast'))
+        if '_key' not in state:  # graphs stored before the graph ids, see ChangeGraph.renumber_nodes
+            state['_key'] = (None, state['id'])
+            state['_hash'] = hash(state['_key'])
+        state['_data'] = state.get('_data') or None
+
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.set_label(self.label, self.original_label)
+        self.reset_adjacency()
+
+    def set_label(self, label, original_label=None):
+        """
+        Sets the labels interned in the label table, see changegraph.labels
+        """
+        self.label_id = LABELS.get_id(label)
+        self.label = LABELS.get_label(self.label_id)
+        self.original_label = LABELS.intern(original_label) if original_label is not None else None
+
+    @staticmethod
+    def _get_ast_position(ast):
+        first_token = getattr(ast, 'first_token', None)
+        last_token = getattr(ast, 'last_token', None)
+        if first_token is None or last_token is None:
+            return None
+        return NodePosition(first_token.startpos, last_token.endpos, getattr(ast, 'lineno', None))
 
     @classmethod
     def create_from_fg_node(cls, fg_node):
@@ -103,10 +211,41 @@ class ChangeNode:  # todo: create base class for pfg and cg
     def get_out_nodes(self, /, *, labels=None, excluded_labels=None):
         return self._get_nodes_by_edges(need_out=True, labels=labels, excluded_labels=excluded_labels)
 
+    def reset_adjacency(self):
+        """
+        Drops the adjacency partitions, they are rebuilt from the edges on the next lookup
+        """
+        self._in_by_label = None
+        self._out_by_label = None
+        self._neighbors = None
+
+    def _is_frozen(self):
+        return self.graph is not None and self.graph.is_frozen
+
+    def _get_label_to_nodes(self, need_out):
+        """
+        Returns {edge label: tuple of adjacent nodes}, built on the first lookup after the graph is frozen
+        """
+        label_to_nodes = self._out_by_label if need_out else self._in_by_label
+        if label_to_nodes is None:
+            label_to_nodes = {}
+            for e in self.out_edges if need_out else self.in_edges:
+                label_to_nodes.setdefault(e.label, []).append(e.node_to if need_out else e.node_from)
+            label_to_nodes = {label: tuple(nodes) for label, nodes in label_to_nodes.items()}
+
+            if need_out:
+                self._out_by_label = label_to_nodes
+            else:
+                self._in_by_label = label_to_nodes
+        return label_to_nodes
+
     def _get_nodes_by_edges(self, need_out=False, labels=None, excluded_labels=None):
         if all([labels, excluded_labels]):
             raise ValueError('Unsupported combination of arguments')
 
+        if self._is_frozen():
+            return self._get_frozen_nodes_by_edges(need_out, labels, excluded_labels)
+
         result = set()
         edges = self.out_edges if need_out else self.in_edges
 
@@ -121,38 +260,104 @@ class ChangeNode:  # todo: create base class for pfg and cg
 
         return result
 
+    def _get_frozen_nodes_by_edges(self, need_out, labels, excluded_labels):
+        key = (need_out, tuple(labels) if labels else None, tuple(excluded_labels) if excluded_labels else None)
+        if self._neighbors is None:
+            self._neighbors = {}
+
+        result = self._neighbors.get(key)
+        if result is None:
+            label_to_nodes = self._get_label_to_nodes(need_out)
+            if labels and len(labels) == 1:
+                (label,) = labels
+                result = frozenset(label_to_nodes.get(label, ()))
+            else:
+                result = frozenset(node for label, nodes in label_to_nodes.items()
+                                   if not (excluded_labels and label in excluded_labels
+                                           or labels and label not in labels)
+                                   for node in nodes)
+            self._neighbors[key] = result
+        return result
+
     def get_definitions(self):
+        if self._is_frozen():
+            return self._get_frozen_nodes_by_edges(False, (LinkType.REFERENCE,), None)
+
         defs = set()
         for e in self.in_edges:
             if isinstance(e, ChangeEdge) and e.label == LinkType.REFERENCE:
                 defs.add(e.node_from)
         return defs
 
+    def is_seed(self):
+        """
+        Checks whether the pattern mining starts from the node and its mapped node
+        """
+        if self.version != ChangeNode.Version.BEFORE_CHANGES or not self.mapped:
+            return False
+
+        return self.kind == ChangeNode.Kind.OPERATION_NODE and self.sub_kind == ChangeNode.SubKind.OP_FUNC_CALL
+        # or self.kind == ChangeNode.Kind.CONTROL_NODE
+
+    def get_seed_key(self):
+        """
+        Returns the label of the node pair the pattern mining starts from, None if the node does not start one.
+        Unlike the label ids, the key is stable across processes, so it is stored in the seeds sidecars
+        """
+        if not self.is_seed():
+            return None
+        return f'{self.label}~{self.mapped.label}'
+
+    def get_seed_label_ids(self):
+        return self.label_id, self.mapped.label_id
+
     def set_graph(self, graph):
         self.graph = graph
 
+    def bind(self, graph, index):
+        """
+        Sets the node identity to (graph id, index), the hash changes, so the node must not be in a set or dict
+        """
+        self.graph = graph
+        self.id = index
+        self._key = (graph.id, index)
+        self._hash = hash(self._key)
+
     def __eq__(self, other):
-        return self.id == other.id
+        return self._key == other._key
 
     def __hash__(self):
-        return self.id
+        return self._hash
 
     def __repr__(self):
         return f'#{self.id} v{self.version} {self.label} ({self.original_label}) {self.kind}.{self.sub_kind}'
 
 
 class ChangeEdge:
+    __slots__ = ('node_from', 'node_to', 'label')
+
     def __init__(self, label, node_from, node_to):
         self.node_from = node_from
         self.node_to = node_to
         self.label = label
 
+    def __getstate__(self):
+        return {'node_from': self.node_from, 'node_to': self.node_to, 'label': self.label}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):  # (dict state, slots state) of the default slots pickling
+            state = {**(state[0] or {}), **state[1]}
+        for name, value in state.items():
+            setattr(self, name, value)
+
     @classmethod
     def create(cls, label, node_from, node_to):
         created = ChangeEdge(label, node_from, node_to)
 
         node_from.out_edges.add(created)
         node_to.in_edges.add(created)
+        node_from.reset_adjacency()
+        node_to.reset_adjacency()
 
     def __repr__(self):
         return f'#{self.node_from.id} -{self.label}> #{self.node_to.id}'
@@ -0,0 +1,206 @@
+"""
+Flat binary format for change graphs.
+
+Unlike pickling a ChangeGraph directly, nodes and edges are never linked to each other in the payload:
+the nodes are rows of an integer table, the edges are integer pairs referencing the rows and all the labels
+live in a string table, so neither encoding nor decoding recurses over the graph structure.
+The ast payload and the repo info metadata are kept as separate pickled blocks.
+Node positions are kept in the node table, so the ast payload may be dropped with keep_ast=False.
+"""
+import copy
+import pickle
+import struct
+from array import array
+
+from changegraph.labels import LABELS
+from changegraph.models import ChangeGraph, ChangeNode, ChangeEdge
+from vb_utils import NodePosition
+
+MAGIC = b'CGFLAT'
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct('<6sH')
+_NODE_FIELD_CNTS = {
+    1: 8,  # id, statement_num, label, original_label, kind, sub_kind, version, mapped
+    2: 11  # the same fields followed by start, end, lineno
+}
+_EDGE_FIELD_CNT = 3  # from, to, label
+_NONE = -1
+
+
+class SerializationException(Exception):
+    pass
+
+
+class _StringTable:
+    def __init__(self):
+        self.strings = []
+        self._string_to_index = {}
+
+    def get_index(self, value):
+        if value is None:
+            return _NONE
+
+        index = self._string_to_index.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self._string_to_index[value] = index
+        return index
+
+
+def is_encoded(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def _get_optional(value):
+    return value if value is not None else _NONE
+
+
+def _strip_repo_info_asts(repo_info):
+    if repo_info is None:
+        return None
+
+    repo_info = copy.copy(repo_info)
+    if repo_info.old_method is not None:
+        repo_info.old_method = repo_info.old_method.copy_without_ast()
+    if repo_info.new_method is not None:
+        repo_info.new_method = repo_info.new_method.copy_without_ast()
+    return repo_info
+
+
+def encode(graph: ChangeGraph, keep_ast=True) -> bytes:
+    """
+    With keep_ast=False neither the node asts nor the method asts are stored, only their positions in the source
+    """
+    strings = _StringTable()
+    nodes = sorted(graph.nodes, key=lambda node: node.id)  # the node ids are their rows after decoding
+    node_to_index = {node: index for index, node in enumerate(nodes)}
+
+    node_table = array('q')
+    edge_table = array('q')
+    properties = []
+    asts = []
+    for node in nodes:
+        mapped_index = node_to_index.get(node.mapped, _NONE) if node.mapped is not None else _NONE
+        position = node.position or NodePosition(None, None, None)
+        node_table.extend([
+            node.id,
+            _get_optional(node.statement_num),
+            strings.get_index(node.label),
+            strings.get_index(node.original_label),
+            strings.get_index(node.kind),
+            strings.get_index(node.sub_kind),
+            node.version,
+            mapped_index,
+            _get_optional(position.start),
+            _get_optional(position.end),
+            _get_optional(position.lineno)
+        ])
+        properties.append(node._data or None)
+        asts.append(node.ast if keep_ast else None)
+
+        for e in node.out_edges:
+            to_index = node_to_index.get(e.node_to)
+            if to_index is None:
+                continue
+            edge_table.extend([node_to_index[node], to_index, strings.get_index(e.label)])
+
+    payload = (
+        strings.strings,
+        node_table.tobytes(),
+        edge_table.tobytes(),
+        properties,
+        pickle.dumps(asts, protocol=5),
+        pickle.dumps({'repo_info': graph.repo_info if keep_ast else _strip_repo_info_asts(graph.repo_info),
+                      'graph_id': graph.id}, protocol=5)
+    )
+    return _HEADER.pack(MAGIC, FORMAT_VERSION) + pickle.dumps(payload, protocol=5)
+
+
+def _unpack(data):
+    magic, version = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SerializationException('Not a flat change graph')
+    node_field_cnt = _NODE_FIELD_CNTS.get(version)
+    if node_field_cnt is None:
+        raise SerializationException(f'Unsupported change graph format version {version}')
+    return version, node_field_cnt, pickle.loads(memoryview(data)[_HEADER.size:])
+
+
+def strip_asts(data: bytes) -> bytes:
+    """
+    Returns the payload as encode(graph, keep_ast=False) would, replacing the ast blocks without decoding the graph
+    """
+    version, node_field_cnt, payload = _unpack(data)
+    if version != FORMAT_VERSION:  # the node positions of the older versions are taken from the asts
+        return encode(decode(data), keep_ast=False)
+
+    strings, node_bytes, edge_bytes, properties, _, metadata_block = payload
+    metadata = pickle.loads(metadata_block)
+    metadata['repo_info'] = _strip_repo_info_asts(metadata.get('repo_info'))
+    node_cnt = len(node_bytes) // (node_field_cnt * array('q').itemsize)
+
+    payload = (strings, node_bytes, edge_bytes, properties,
+               pickle.dumps([None] * node_cnt, protocol=5), pickle.dumps(metadata, protocol=5))
+    return _HEADER.pack(MAGIC, FORMAT_VERSION) + pickle.dumps(payload, protocol=5)
+
+
+def decode(data: bytes) -> ChangeGraph:
+    version, node_field_cnt, payload = _unpack(data)
+    strings, node_bytes, edge_bytes, properties, ast_block, metadata_block = payload
+    asts = pickle.loads(ast_block)
+    metadata = pickle.loads(metadata_block)
+
+    node_table = array('q')
+    node_table.frombytes(node_bytes)
+    edge_table = array('q')
+    edge_table.frombytes(edge_bytes)
+
+    def get_string(index):
+        return strings[index] if index != _NONE else None
+
+    def get_optional(value):
+        return value if value != _NONE else None
+
+    graph = ChangeGraph(repo_info=metadata.get('repo_info'), graph_id=metadata.get('graph_id'))
+    nodes = []
+    mapped_indices = []
+    for index in range(len(node_table) // node_field_cnt):
+        fields = node_table[index * node_field_cnt:(index + 1) * node_field_cnt]
+        _, statement_num, label, original_label, kind, sub_kind, node_version, mapped = fields[:8]
+
+        node = ChangeNode.__new__(ChangeNode)
+        node.bind(graph, index)
+        node.statement_num = get_optional(statement_num)
+        node.ast = asts[index]
+        if version == 1:
+            node.position = ChangeNode._get_ast_position(node.ast)
+        else:
+            start, end, lineno = fields[8:]
+            node.position = NodePosition(start, end, get_optional(lineno)) if start != _NONE else None
+        node.set_label(get_string(label), get_string(original_label))
+        node.in_edges = set()
+        node.out_edges = set()
+        node.mapped = None
+        node.kind = get_string(kind)
+        node.sub_kind = get_string(sub_kind)
+        node.version = node_version
+        node._data = properties[index] or None
+
+        nodes.append(node)
+        mapped_indices.append(mapped)
+
+    for node, mapped in zip(nodes, mapped_indices):
+        if mapped != _NONE:
+            node.mapped = nodes[mapped]
+
+    edge_labels = {label: LABELS.intern(strings[label]) for label in set(edge_table[2::_EDGE_FIELD_CNT])}
+
+    for index in range(0, len(edge_table), _EDGE_FIELD_CNT):
+        from_index, to_index, label = edge_table[index:index + _EDGE_FIELD_CNT]
+        ChangeEdge.create(edge_labels[label], nodes[from_index], nodes[to_index])
+
+    graph.nodes.update(nodes)
+    graph.freeze()
+    return graph
@@ -2,10 +2,8 @@ import argparse
 import json
 import multiprocessing
 import os
-import pickle
 import sys
 import tempfile
-import uuid
 from pathlib import Path
 from typing import List
 
@@ -13,6 +11,7 @@ from tqdm import tqdm
 
 import changegraph
 import settings
+import storage
 from changegraph.models import ChangeGraph
 from deployment import set_all_environment_variables
 from log import logger
@@ -29,18 +28,7 @@ def init(finished):
 
 
 def store_change_graphs(change_graphs: List[ChangeGraph]):
-    pickled_graphs = []
-    for graph in change_graphs:
-        try:
-            pickled = pickle.dumps(graph, protocol=5)
-            pickled_graphs.append(pickled)
-        except RecursionError:
-            logger.error(f'Unable to pickle graph {graph}')
-    filename = uuid.uuid4().hex
-    logger.info(f'Trying to store graphs to {filename}', show_pid=True)
-    with open(os.path.join(STORAGE_DIR, f'{filename}.pickle'), 'w+b') as f:
-        pickle.dump(pickled_graphs, f)
-    logger.info(f'Storing graphs to {filename} finished', show_pid=True)
+    storage.store_change_graphs(change_graphs, storage_dir=STORAGE_DIR)
 
 
 def mine_changes(path_to_repo_dir: str):
@@ -110,7 +98,7 @@ def mine_changes(path_to_repo_dir: str):
                         logger.log(logger.ERROR,
                                    f'Unable to build a change graph for '
                                    f'method={old_method.full_name}, '
-                                   f'line={old_method.ast.lineno}', exc_info=True, show_pid=True)
+                                   f'line={old_method.lineno}', exc_info=True, show_pid=True)
                         continue
 
                     change_graphs.append(cg)
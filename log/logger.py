@@ -42,6 +42,9 @@ class CustomLogger:
         self._logger.addHandler(sh)
         self._logger.setLevel(min(self.FILE_LOG_LEVEL, self.STDOUT_LOG_LEVEL))
 
+    def is_enabled_for(self, level):
+        return self._logger.isEnabledFor(level)
+
     def log(self, level, text, exc_info=False, start_time=None, show_pid=False):
         if start_time:
             text = f'{text} {int((time.time() - start_time) * 1000)}ms'
@@ -1,6 +1,4 @@
 import ast
-import os
-import pickle
 import sys
 import stackimpact
 import datetime
@@ -12,18 +10,25 @@ from patterns import Miner
 from patterns.models import Fragment, Pattern
 from vcs.traverse import GitAnalyzer, RepoInfo, Method
 from deployment import set_all_environment_variables
+from vb_utils import SourceText
 
 import pyflowgraph
+import pyflowgraph.batch
 import changegraph
+import changegraph.batch
 import settings
+import storage
+import storage.loader
 
 
 class RunModes:
     BUILD_PY_FLOW_GRAPH = 'pfg'
+    BUILD_PY_FLOW_GRAPHS_BATCH = 'pfg-batch'
     BUILD_CHANGE_GRAPH = 'cg'
+    BUILD_CHANGE_GRAPHS_BATCH = 'cg-batch'
     COLLECT_CHANGE_GRAPHS = 'collect-cgs'
     MINE_PATTERNS = 'patterns'
-    ALL = [BUILD_PY_FLOW_GRAPH, BUILD_CHANGE_GRAPH, COLLECT_CHANGE_GRAPHS, MINE_PATTERNS]
+    ALL = [BUILD_PY_FLOW_GRAPH, BUILD_PY_FLOW_GRAPHS_BATCH, BUILD_CHANGE_GRAPH, BUILD_CHANGE_GRAPHS_BATCH, COLLECT_CHANGE_GRAPHS, MINE_PATTERNS]
 
 
 def main():
@@ -61,6 +66,17 @@ def main():
             args.input, show_dependencies=args.show_deps, build_closure=not args.no_closure)
         pyflowgraph.export_graph_image(
             fg, args.output, show_op_kinds=not args.hide_op_kinds, show_data_keys=args.show_data_keys)
+    elif current_mode == RunModes.BUILD_PY_FLOW_GRAPHS_BATCH:
+        parser.add_argument('-i', '--input', help='Paths to source code files or directories', type=str, nargs='+',
+                            required=True)
+        parser.add_argument('-o', '--output', help='Path to output file', type=str, default='pyflowgraphs.jsonl')
+        parser.add_argument('--processes', help='Number of worker processes', type=int)
+        parser.add_argument('--no-closure', action='store_true')
+        parser.add_argument('--show-deps', action='store_true')
+        args = parser.parse_args()
+
+        pyflowgraph.batch.build_batch(args.input, args.output, processes=args.processes,
+                                      show_dependencies=args.show_deps, build_closure=not args.no_closure)
     elif current_mode == RunModes.BUILD_CHANGE_GRAPH:
         parser.add_argument('-s', '--src', help='Path to source code before changes', type=str, required=True)
         parser.add_argument('-d', '--dest', help='Path to source code after changes', type=str, required=True)
@@ -69,6 +85,15 @@ def main():
 
         fg = changegraph.build_from_files(args.src, args.dest)
         changegraph.export_graph_image(fg, args.output)
+    elif current_mode == RunModes.BUILD_CHANGE_GRAPHS_BATCH:
+        parser.add_argument('-i', '--input', help='Path to JSON Lines manifest with before and after pairs', type=str,
+                            required=True)
+        parser.add_argument('-o', '--output', help='Path to output directory, change_graphs_storage_dir by default',
+                            type=str)
+        parser.add_argument('--processes', help='Number of worker processes', type=int)
+        args = parser.parse_args()
+
+        changegraph.batch.build_batch(args.input, storage_dir=args.output, processes=args.processes)
     elif current_mode == RunModes.COLLECT_CHANGE_GRAPHS:
         parser.add_argument('--only-tests',
                             help='Collect cgs only for the files with "test" substring in the name',
@@ -80,6 +105,8 @@ def main():
         parser.add_argument('-s', '--src', help='Path to source code before changes', type=str, nargs='+')
         parser.add_argument('-d', '--dest', help='Path to source code after changes', type=str, nargs='+')
         parser.add_argument('--fake-mining', action='store_true')
+        parser.add_argument('--filter', help='Catalog filter expression, e.g. repo_name=requests, may be repeated',
+                            type=str, action='append')
         args = parser.parse_args()
 
         if args.src or args.dest or args.fake_mining:
@@ -92,7 +119,8 @@ def main():
                 for n, path in enumerate([old_path, new_path]):
                     with open(path, 'r+') as f:
                         src = f.read()
-                        methods.append(Method(path, 'test_name', ast.parse(src, mode='exec').body[0], src))
+                        methods.append(Method(path, 'test_name', ast.parse(src, mode='exec').body[0],
+                                              SourceText(src.strip())))
 
                 mock_commit_dtm = datetime.datetime.now(tz=datetime.timezone.utc)
                 repo_info = RepoInfo(
@@ -105,39 +133,34 @@ def main():
             miner = Miner()
             if args.fake_mining:
                 for cg in change_graphs:
-                    fragment = Fragment()
-                    fragment.graph = cg
-                    fragment.nodes = cg.nodes
+                    fragment = Fragment.create_from_nodes(cg, cg.nodes)
                     pattern = Pattern([fragment])
                     miner.add_pattern(pattern)
             else:
                 miner.mine_patterns(change_graphs)
             miner.print_patterns()
         else:
-            storage_dir = settings.get('change_graphs_storage_dir')
-            file_names = os.listdir(storage_dir)
+            store = storage.ChangeGraphStore(settings.get('change_graphs_storage_dir'))
+            logger.warning(f'Found {len(store)} change graphs and {len(store.legacy_file_paths)} legacy files '
+                           f'in storage directory')
 
-            logger.warning(f'Found {len(file_names)} files in storage directory')
+            graph_ids = store.select_graph_ids(args.filter, min_date=Miner.MIN_DATE)
+            logger.warning(f'{len(graph_ids)} change graphs match the filters')
 
-            change_graphs = []
-            for file_num, file_name in enumerate(file_names):
-                file_path = os.path.join(storage_dir, file_name)
-                try:
-                    with open(file_path, 'rb') as f:
-                        graphs = pickle.load(f)
-
-                    for graph in graphs:
-                        change_graphs.append(pickle.loads(graph))
-                except:
-                    logger.warning(f'Incorrect file {file_path}')
-
-                if file_num % 1000 == 0:
-                    logger.warning(f'Loaded [{1 + file_num}/{len(file_names)}] files')
+            with_legacy_files = bool(store.legacy_file_paths) and not args.filter
+            if store.legacy_file_paths and args.filter:
+                logger.warning('Legacy files are not in the catalog, they are skipped due to the filters')
+
+            if not with_legacy_files:  # the seeds of the legacy graphs are unknown, every graph is needed with them
+                graph_ids = store.get_seeded_graph_ids(Pattern.MIN_FREQUENCY, min_date=Miner.MIN_DATE,
+                                                       graph_ids=graph_ids)
+                logger.warning(f'{len(graph_ids)} change graphs contain frequent seeds')
             logger.warning('Pattern mining has started')
 
             miner = Miner()
             try:
-                miner.mine_patterns(change_graphs)
+                miner.mine_patterns(storage.loader.iter_change_graphs(store, graph_ids,
+                                                                      with_legacy_files=with_legacy_files))
             except KeyboardInterrupt:
                 logger.warning('KeyboardInterrupt: mined patterns will be stored before exit')
 
@@ -5,52 +5,88 @@ import sys
 HALF_N = sys.maxsize // 2
 N = HALF_N * 2
 
+WEIGHT_MASK = 2 ** 64 - 1
+
 
 def normalize(value):
     return (value + HALF_N) % N - HALF_N
 
 
-class ExasFeature:
+def _get_weight(feature_id):
+    """
+    Spreads the dense feature ids over 64 bits (splitmix64), the weights are summed into the vector hashes
+    """
+    value = (feature_id + 1) * 0x9E3779B97F4A7C15 & WEIGHT_MASK
+    value = (value ^ (value >> 30)) * 0xBF58476D1CE4E5B9 & WEIGHT_MASK
+    value = (value ^ (value >> 27)) * 0x94D049BB133111EB & WEIGHT_MASK
+    return value ^ (value >> 31)
+
+
+class ExasFeatureTable:
     """
     Features characterize code fragments
     Read more: "Accurate and Efficient Structural Characteristic Feature Extraction"
+
+    A feature is a path in a fragment, encoded as a tuple of the node positions and the edge ids alternating.
+    The position of a node is the last position of its label in the fragment, counting from 1.
+    The table is process-wide, the paths are hashed once and the same hash gets the same dense feature id
+    in every fragment, so the vectors are grouped exactly as by the hashes
     """
     MAX_LENGTH = 2 ** 3 - 1
+    EDGE_LABEL_TO_ID = {
+        LinkType.QUALIFIER: 0,
+        LinkType.CONDITION: 1,
+        LinkType.CONTROL: 2,
+        LinkType.DEFINITION: 3,
+        LinkType.MAP: 4,
+        LinkType.PARAMETER: 5,
+        LinkType.RECEIVER: 6,
+        LinkType.REFERENCE: 7
+    }
+
+    def __init__(self):
+        self.sequences = []  # a path per feature id, the ids are only valid within a process
+        self.weights = []
+        self._sequence_to_id = {}
+        self._hash_to_id = {}
 
-    def __init__(self, nodes=None):
-        self.node_label_to_feature_id = {}
-        self.edge_label_to_feature_id = {
-            LinkType.QUALIFIER: 0,
-            LinkType.CONDITION: 1,
-            LinkType.CONTROL: 2,
-            LinkType.DEFINITION: 3,
-            LinkType.MAP: 4,
-            LinkType.PARAMETER: 5,
-            LinkType.RECEIVER: 6,
-            LinkType.REFERENCE: 7
-        }
-
-        if nodes is not None:
-            self._bind_node_feature_ids(nodes)
-
-    def _bind_node_feature_ids(self, nodes):
-        for num, node in enumerate(nodes):
-            self.node_label_to_feature_id[node.label] = num + 1  # some ids can be skipped
-
-    def get_id_by_label(self, label):
-        return self.node_label_to_feature_id.get(label)
-
-    def get_id_by_labels(self, labels):
+    def __len__(self):
+        return len(self.sequences)
+
+    def get_id(self, sequence: tuple):
+        feature_id = self._sequence_to_id.get(sequence)
+        if feature_id is None:
+            sequence_hash = self.get_hash(sequence)
+            feature_id = self._hash_to_id.get(sequence_hash)
+            if feature_id is None:
+                feature_id = len(self.sequences)
+                self.sequences.append(sequence)
+                self.weights.append(_get_weight(feature_id))
+                self._hash_to_id[sequence_hash] = feature_id
+            self._sequence_to_id[sequence] = feature_id
+        return feature_id
+
+    def get_edge_id(self, label):
+        return self.EDGE_LABEL_TO_ID.get(label, 0)
+
+    def get_sequence(self, feature_id):
+        return self.sequences[feature_id]
+
+    def get_weight(self, feature_id):
+        return self.weights[feature_id]
+
+    @staticmethod
+    def get_hash(sequence):
         result = 0
 
-        for num, label in enumerate(labels):
-            if num % 2 == 0:
-                s = self.node_label_to_feature_id.get(label)
-            else:
-                s = self.edge_label_to_feature_id.get(label, 0)
-                s = normalize(s << 5)  # 2^4 types
+        for num, value in enumerate(sequence):
+            if num % 2 == 1:
+                value = normalize(value << 5)  # 2^4 types
                 result = normalize(result << 8)
 
-            result = normalize(result + s)
+            result = normalize(result + value)
 
         return result
+
+
+FEATURES = ExasFeatureTable()
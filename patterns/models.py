@@ -1,45 +1,108 @@
 import copy
 import time
-import multiprocessing
-import functools
 
 from typing import Set, Optional, Dict, FrozenSet, Tuple
 
 from log import logger
 from pyflowgraph.models import LinkType, Node
+from changegraph.labels import LABELS
 from changegraph.models import ChangeNode
-from patterns.exas import ExasFeature, normalize
+from patterns.exas import FEATURES, WEIGHT_MASK, ExasFeatureTable
 import settings
 import vb_utils
 
 
+_MAP_EDGE_ID = FEATURES.get_edge_id(LinkType.MAP)
+
+
 class CharacteristicVector:
     """
-    Characteristic vector is built by exas features' occurrences
+    Characteristic vector is built by exas features' occurrences.
+    The vector of an extended fragment only keeps its delta to the vector of the parent fragment,
+    the counts are merged on access and stored once the fragment is materialized.
+    The hash is a sum of the feature weights, so it is updated with every feature and does not depend on their order
     """
+    __slots__ = ('base', 'delta', '_hash')
 
-    def __init__(self):
-        self.data = {}
+    def __init__(self, base=None):
+        self.base = base
+        self.delta = {}
+        self._hash = base._hash if base is not None else 0
+
+    @property
+    def data(self):
+        if self.base is None:
+            return self.delta
+
+        data = dict(self.base.data)
+        for feature_id, cnt in self.delta.items():
+            data[feature_id] = data.get(feature_id, 0) + cnt
+        return data
 
     def add_feature(self, feature_id):
-        self.data[feature_id] = self.data.get(feature_id, 0) + 1
+        self.delta[feature_id] = self.delta.get(feature_id, 0) + 1
+        self._hash = (self._hash + FEATURES.get_weight(feature_id)) & WEIGHT_MASK
 
-    def get_hash(self):
-        logger.log(logger.DEBUG, f'Getting vector hash, data size = {len(self.data)}')
+    def is_equal(self, vector):
+        if self._hash != vector._hash:
+            return False
+        if self.base is vector.base:  # the vectors of a pattern's fragments are shared, see Pattern
+            return self.delta == vector.delta
+        return self.data == vector.data
+
+    def materialize(self):
+        if self.base is not None:
+            self.delta = self.data
+            self.base = None
 
-        result = 0
-        for key in sorted(self.data.keys()):
-            result = normalize(result * 31 + self.data[key])
+    def get_hash(self):
+        return self._hash
 
-        logger.log(logger.DEBUG, f'Hash calculated, value = {result}')
-        return result
+    def get_key(self, base=None):
+        """
+        Returns a hashable canonical form of the vector, the keys of equal vectors are equal.
+        The vectors extending the given base are keyed by their deltas without merging the base counts,
+        such keys are only comparable to the keys of the vectors with the same base
+        """
+        if base is not None and self.base is base:
+            return _VectorKey(self._hash, frozenset(self.delta.items()), base)
+        return _VectorKey(self._hash, frozenset(self.data.items()))
 
     def __copy__(self):
         cls = self.__class__
         o = cls.__new__(cls)
-        o.data = copy.copy(self.data)
+        o.base = None
+        o.delta = copy.copy(self.data)
+        o._hash = self._hash
         return o
 
+    def __getstate__(self):  # the feature ids are valid within a process only
+        return {'base': self.base,
+                'delta': {FEATURES.get_sequence(feature_id): cnt for feature_id, cnt in self.delta.items()}}
+
+    def __setstate__(self, state):
+        self.base = state['base']
+        self.delta = {FEATURES.get_id(sequence): cnt for sequence, cnt in state['delta'].items()}
+
+        self._hash = self.base._hash if self.base is not None else 0
+        for feature_id, cnt in self.delta.items():
+            self._hash = (self._hash + cnt * FEATURES.get_weight(feature_id)) & WEIGHT_MASK
+
+
+class _VectorKey:
+    __slots__ = ('hash', 'features', 'base')
+
+    def __init__(self, vector_hash, features: frozenset, base=None):
+        self.hash = vector_hash
+        self.features = features
+        self.base = base  # the features are the delta to the base
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return self.hash == other.hash and self.base is other.base and self.features == other.features
+
 
 class Fragment:
     """
@@ -48,6 +111,8 @@ class Fragment:
 
     Read more: "Accurate and Efficient Structural Characteristic Feature Extraction"
     """
+    __slots__ = ('id', 'parent', 'graph', '_nodes', '_ext_nodes', '_size', 'node_mask', 'func_call_mask', 'vector')
+
     LABEL_SEPARATOR = '-'
     _FRAGMENT_ID = 0
 
@@ -55,53 +120,101 @@ class Fragment:
         Fragment._FRAGMENT_ID += 1
         self.id = Fragment._FRAGMENT_ID
 
-        self.id_sum = 0  # boosting fragment comparision todo: int overflow?
-
         self.parent = None
         self.graph = None
-        self.nodes = []
+        self._nodes = []
+        self._ext_nodes = ()  # the nodes added to the parent's ones, while the fragment is not materialized
+        self._size = 0
+        self.node_mask = 0  # bits of the graph-local node indices, see get_node_bit
+        self.func_call_mask = 0  # bits of the function call nodes, only they make fragments overlap
         self.vector = CharacteristicVector()
 
     @property
     def size(self):
-        return len(self.nodes)
+        return self._size
+
+    @property
+    def nodes(self):
+        if self._nodes is None:
+            return self.parent.nodes + list(self._ext_nodes)
+        return self._nodes
+
+    def materialize(self):
+        """
+        Stores the nodes and the vector of an extended fragment instead of their deltas to the parent,
+        only the fragments of patterns are materialized
+        """
+        if self._nodes is None:
+            self._nodes = self.nodes
+            self._ext_nodes = ()
+        self.vector.materialize()
+
+    @staticmethod
+    def get_node_bit(node):
+        """
+        The ids of the nodes added to a graph are their dense indices, see ChangeGraph.add_node.
+        The nodes not added to any graph have negative ids, they are not able to be in fragments
+        """
+        if node.id < 0:
+            raise ValueError(f'Node {node.id} is not added to a graph')
+        return 1 << node.id
+
+    def _add_node(self, node):
+        self._nodes.append(node)
+        self._size += 1
+        self._add_node_bit(node)
+
+    def _add_node_bit(self, node):
+        bit = self.get_node_bit(node)
+        self.node_mask |= bit
+        if node.sub_kind == ChangeNode.SubKind.OP_FUNC_CALL:
+            self.func_call_mask |= bit
+
+    def contains_node(self, node):
+        return self.node_mask & self.get_node_bit(node) != 0
+
+    @classmethod
+    def create_from_nodes(cls, graph, nodes):
+        """
+        Creates a fragment without a characteristic vector, it is not able to be extended
+        """
+        f = Fragment()
+        f.graph = graph
+        for node in nodes:
+            f._add_node(node)
+        return f
 
     @classmethod
     def create_from_node(cls, node):
         f = Fragment()
-        f.nodes.append(node)
+        f._add_node(node)
         f.graph = node.graph
 
-        f.id_sum = node.id
-
         f.__init_vector(node)
 
         return f
 
     def __init_vector(self, node):
-        exas_feature = ExasFeature(nodes=[node])
-        self.vector.add_feature(exas_feature.get_id_by_label(node.label))
+        self.vector.add_feature(FEATURES.get_id((1,)))
 
     @classmethod
     def create_from_node_pair(cls, pair):
         f = Fragment()
-        f.nodes.append(pair[0])
-        f.nodes.append(pair[1])
+        f._add_node(pair[0])
+        f._add_node(pair[1])
         f.graph = pair[0].graph
 
-        f.id_sum = pair[0].id + pair[1].id
-
         f.__init_vector_from_pair(pair)
 
         return f
 
     def __init_vector_from_pair(self, pair):
-        exas_feature = ExasFeature(nodes=[pair[0], pair[1]])
+        first, second = (2 if pair[0].label_id == pair[1].label_id else 1), 2  # the last positions of the labels
 
-        self.vector.add_feature(exas_feature.get_id_by_label(pair[0].label))
-        self.vector.add_feature(exas_feature.get_id_by_label(pair[1].label))
+        self.vector.add_feature(FEATURES.get_id((first,)))
+        self.vector.add_feature(FEATURES.get_id((second,)))
 
-        self.vector.add_feature(exas_feature.get_id_by_labels(labels=[pair[0].label, LinkType.MAP, pair[1].label]))
+        self.vector.add_feature(FEATURES.get_id((first, _MAP_EDGE_ID, second)))
 
     @classmethod
     def create_extended(cls, fragment, ext_nodes: tuple):
@@ -109,50 +222,54 @@ class Fragment:
         f.parent = fragment
         f.graph = fragment.graph
 
-        f.nodes = copy.copy(fragment.nodes)
-        f.vector = copy.copy(fragment.vector)
+        f._nodes = None
+        f._ext_nodes = tuple(ext_nodes)
+        f._size = fragment.size + len(f._ext_nodes)
+        f.node_mask = fragment.node_mask
+        f.func_call_mask = fragment.func_call_mask
+        f.vector = CharacteristicVector(base=fragment.vector)
 
-        f.id_sum = fragment.id_sum
-        for node in ext_nodes:
-            f.id_sum += node.id
-            f.nodes.append(node)
+        label_positions = fragment._get_label_positions()  # the exas features depend on the node positions
+        for position, node in enumerate(ext_nodes, start=fragment.size + 1):
+            f._add_node_bit(node)
+            label_positions[node.label_id] = position
 
             logger.debug(f'Recalc vector for fragment {fragment} with node {node}', show_pid=True)
-            f.__recalc_vector(node, f.nodes)
+            f.__recalc_vector(node, label_positions)
 
         return f
 
-    def __recalc_vector(self, node, ext_by_one_nodes):
-        exas_feature = ExasFeature(nodes=ext_by_one_nodes)
-        sequence = [node.label]
-        self.__exas_backward_dfs(node, node, sequence, exas_feature)
+    def _get_label_positions(self):
+        """
+        Maps the label ids to the last positions of the labels in the fragment, counting from 1
+        """
+        return {node.label_id: num for num, node in enumerate(self.nodes, start=1)}
+
+    def __recalc_vector(self, node, label_positions):
+        sequence = [label_positions[node.label_id]]
+        self.__exas_backward_dfs(node, node, sequence, label_positions)
 
-    def __exas_backward_dfs(self, first_node, last_node, sequence, exas_feature):
-        logger.debug('Entering backward dfs', show_pid=True)
-        self.__exas_forward_dfs(last_node, sequence, exas_feature)
+    def __exas_backward_dfs(self, first_node, last_node, sequence, label_positions):
+        self.__exas_forward_dfs(last_node, sequence, label_positions)
 
-        if len(sequence) < ExasFeature.MAX_LENGTH:
+        if len(sequence) < ExasFeatureTable.MAX_LENGTH:
             for e in first_node.in_edges:
-                if e.node_from in self.nodes:
-                    sequence.insert(0, e.label)
-                    sequence.insert(0, e.node_from.label)
-                    self.__exas_backward_dfs(e.node_from, last_node, sequence, exas_feature)
+                if self.contains_node(e.node_from):
+                    sequence.insert(0, FEATURES.get_edge_id(e.label))
+                    sequence.insert(0, label_positions[e.node_from.label_id])
+                    self.__exas_backward_dfs(e.node_from, last_node, sequence, label_positions)
                     del sequence[0]
                     del sequence[0]
 
-    def __exas_forward_dfs(self, node, sequence, exas_feature):
-        logger.debug('Entering forward dfs', show_pid=True)
-        logger.debug(f'Adding a feature for sequence: {sequence}', show_pid=True)
+    def __exas_forward_dfs(self, node, sequence, label_positions):
+        self.vector.add_feature(FEATURES.get_id(tuple(sequence)))
 
-        feature_id = exas_feature.get_id_by_labels(sequence)
-        self.vector.add_feature(feature_id)
-
-        if len(sequence) < ExasFeature.MAX_LENGTH:
+        if len(sequence) < ExasFeatureTable.MAX_LENGTH:
             for e in node.out_edges:
-                if e.node_to in self.nodes:
-                    sequence.append(e.label)
-                    sequence.append(e.node_to.label)
-                    self.__exas_forward_dfs(e.node_to, sequence, exas_feature)
+                if self.contains_node(e.node_to):
+                    sequence.append(FEATURES.get_edge_id(e.label))
+                    sequence.append(label_positions[e.node_to.label_id])
+                    self.__exas_forward_dfs(e.node_to, sequence, label_positions)
                     del sequence[-1]
                     del sequence[-1]
 
@@ -160,16 +277,16 @@ class Fragment:
         adjacent_nodes = set()
         for node in self.nodes:
             for in_node in node.get_in_nodes(excluded_labels=[LinkType.MAP]):
-                if in_node not in self.nodes:
+                if not self.contains_node(in_node):
                     adjacent_nodes.add(in_node)
 
             for out_node in node.get_out_nodes(excluded_labels=[LinkType.MAP]):
-                if out_node not in self.nodes:
+                if not self.contains_node(out_node):
                     adjacent_nodes.add(out_node)
 
         logger.info(f'Adjacent nodes cnt = {len(adjacent_nodes)}')
 
-        label_to_extensions: Dict[str, Set[Tuple]] = {}
+        label_to_extensions: Dict[Tuple[int, ...], Set[Tuple]] = {}
         for node in adjacent_nodes:
             if node.kind == ChangeNode.Kind.DATA_NODE:
                 if node.sub_kind == ChangeNode.SubKind.DATA_LITERAL:
@@ -178,7 +295,7 @@ class Fragment:
                     defs = node.get_definitions()
                     if not defs:
                         non_refs = node.get_out_nodes(excluded_labels=[LinkType.REFERENCE, LinkType.MAP])
-                        if non_refs.intersection(set(self.nodes)):
+                        if any(self.contains_node(n) for n in non_refs):
                             self._add_extension(label_to_extensions, node)
                         else:
                             for next_node in non_refs:
@@ -194,24 +311,17 @@ class Fragment:
         return label_to_extensions
 
     @staticmethod
-    def _add_extension(label_to_exts, node):
-        label = node.label
-        if node.mapped:
-            label += Fragment.LABEL_SEPARATOR + node.mapped.label
+    def _get_ext_label(node):
+        return (node.label_id, node.mapped.label_id) if node.mapped else (node.label_id,)
 
-        s = label_to_exts.setdefault(label, set())
+    @classmethod
+    def _add_extension(cls, label_to_exts, node):
+        s = label_to_exts.setdefault(cls._get_ext_label(node), set())
         s.add((node, node.mapped) if node.mapped else (node,))
 
-    @staticmethod
-    def _add_extension_chain(label_to_exts, node, next_node):
-        label = node.label
-        if node.mapped:
-            label += Fragment.LABEL_SEPARATOR + node.mapped.label
-
-        label += Fragment.LABEL_SEPARATOR + next_node.label
-        if next_node.mapped:
-            label += Fragment.LABEL_SEPARATOR + next_node.mapped.label
-
+    @classmethod
+    def _add_extension_chain(cls, label_to_exts, node, next_node):
+        label = cls._get_ext_label(node) + cls._get_ext_label(next_node)
         s = label_to_exts.setdefault(label, set())
 
         if node.mapped and next_node.mapped:
@@ -232,14 +342,14 @@ class Fragment:
         if in_nodes and out_nodes:
             found = False
             for n in in_nodes:
-                if n in self.nodes:
+                if self.contains_node(n):
                     found = True
                     break
 
             if found:
                 found = False
                 for n in out_nodes:
-                    if n in self.nodes:
+                    if self.contains_node(n):
                         found = True
                         break
 
@@ -254,36 +364,17 @@ class Fragment:
 
     def _add_out_node(self, label_to_exts, node):
         out_nodes = node.get_out_nodes(excluded_labels=[LinkType.MAP])
-        if out_nodes.intersection(set(self.nodes)):
+        if any(self.contains_node(n) for n in out_nodes):
             self._add_extension(label_to_exts, node)
 
     @classmethod
     def create_groups(cls, fragments: set):
         groups: Set[FrozenSet[Fragment]] = set()
 
-        hash_to_fragments: Dict[int, Set[Fragment]] = cls._get_hash_to_fragments(fragments)
-        logger.info(f'Done hash calculations, buckets={len(hash_to_fragments.keys())}', show_pid=True)
-
-        for key, fragments in hash_to_fragments.items():
-            logger.debug(f'Bucket hash = {key}', show_pid=True)
-            groups = groups.union(cls._group_same_hash_fragments(fragments))  # do grouping within calculated hash
-        return groups
-
-    @classmethod
-    def _group_same_hash_fragments(cls, fragments: set):
-        groups: Set[FrozenSet[Fragment]] = set()
-        while len(fragments) > 0:
-            fragment = next(iter(fragments))
-            fragments.remove(fragment)
-
-            group: Set[Fragment] = set()
-            group.add(fragment)
-
-            for fr in copy.copy(fragments):
-                if fragment.vector.data == fr.vector.data:
-                    group.add(fr)
-                    fragments.remove(fr)
+        key_to_fragments: Dict[_VectorKey, Set[Fragment]] = cls._get_key_to_fragments(fragments)
+        logger.info(f'Done vector key calculations, buckets={len(key_to_fragments.keys())}', show_pid=True)
 
+        for group in key_to_fragments.values():
             # TODO: in the source there are also genesis fragments' groups checks, why?
             if len(group) >= Pattern.MIN_FREQUENCY:
                 group: Set[Fragment] = cls._remove_duplicates(group)
@@ -297,33 +388,38 @@ class Fragment:
         if len(group) < Pattern.MIN_FREQUENCY:
             return group
 
-        lst = list(group)  # todo escape convertions
-        vb_utils.filter_list(lst, condition=lambda i, j: lst[i].is_equal(lst[j]))
-        logger.log(logger.INFO, f'Remove duplicates: affected {len(group) - len(lst)} items', show_pid=True)
+        key_to_fragment = {}
+        for fragment in group:
+            key_to_fragment.setdefault(fragment.get_key(), fragment)
+        logger.log(logger.INFO, f'Remove duplicates: affected {len(group) - len(key_to_fragment)} items', show_pid=True)
 
-        return set(lst)
+        return set(key_to_fragment.values())
 
     @staticmethod
-    def _get_hash_to_fragments(fragments):
-        hash_to_fragments = {}
+    def _get_key_to_fragments(fragments):
+        bases = {id(fragment.vector.base): fragment.vector.base for fragment in fragments}
+        base = next(iter(bases.values())) if len(bases) == 1 else None  # the deltas are keyed if the base is shared
+
+        key_to_fragments = {}
         for fragment in fragments:
-            vector_hash = fragment.vector.get_hash()
-            s = hash_to_fragments.setdefault(vector_hash, set())
+            s = key_to_fragments.setdefault(fragment.vector.get_key(base), set())
             s.add(fragment)
-        return hash_to_fragments
+        return key_to_fragments
 
     def overlap(self, fragment):
-        intersection = set(self.nodes).intersection(set(fragment.nodes))  # todo: performance analysis
-        for node in intersection:
-            if node.sub_kind == ChangeNode.SubKind.OP_FUNC_CALL:
-                return True
-        return False
+        """
+        Checks whether the fragments share a function call node
+        """
+        return self.graph is fragment.graph and self.func_call_mask & fragment.node_mask != 0
 
     def is_equal(self, fragment):
-        if self.id_sum != fragment.id_sum:  # todo: performance analysis
-            return False
+        return self.graph is fragment.graph and self.node_mask == fragment.node_mask
 
-        return set(self.nodes) == set(fragment.nodes)  # todo: performance analysis
+    def get_key(self):
+        """
+        Returns the graph id and the node mask, the keys of equal fragments are equal
+        """
+        return self.graph.id if self.graph is not None else None, self.node_mask
 
     def is_change(self):
         has_old = False
@@ -332,7 +428,7 @@ class Fragment:
         has_unmapped_change = False
         for node in self.nodes:
             if not has_unmapped_change and not \
-                    (node.mapped and node.mapped in self.nodes and node.label == node.mapped.label):
+                    (node.mapped and self.contains_node(node.mapped) and node.label == node.mapped.label):
                 has_unmapped_change = True
 
             if node.version == Node.Version.BEFORE_CHANGES:
@@ -342,10 +438,24 @@ class Fragment:
         return has_unmapped_change and has_old and has_new
 
     def contains(self, fragment):
-        if self.id_sum < fragment.id_sum or self.size < fragment.size or self.graph.nodes != fragment.graph.nodes:
+        if self.graph is not fragment.graph or self.size < fragment.size:
             return False
 
-        return set(fragment.nodes).issubset(set(self.nodes))
+        return fragment.node_mask & ~self.node_mask == 0
+
+    def get_label_path_counts(self):
+        """
+        Counts the node labels and the labeled edges of the fragment, the counts of a fragment dominate the ones
+        of the fragments it contains. The exas features are not comparable, they depend on the node positions
+        """
+        counts = {}
+        for node in self.nodes:
+            counts[node.label_id] = counts.get(node.label_id, 0) + 1
+            for e in node.out_edges:
+                if self.contains_node(e.node_to):
+                    key = (node.label_id, e.label, e.node_to.label_id)
+                    counts[key] = counts.get(key, 0) + 1
+        return counts
 
 
 class Pattern:
@@ -360,18 +470,34 @@ class Pattern:
         self.freq: int = freq
 
         self.repr: Fragment = next(iter(fragments))
+        self._materialize_fragments()
+
+    def _materialize_fragments(self):
+        """
+        The fragments of a pattern usually have equal vectors, they share a single one,
+        so the vectors of their extensions are compared by their deltas
+        """
+        self.repr.materialize()
+        for fragment in self.fragments:
+            fragment.materialize()
+            if fragment.vector is not self.repr.vector and fragment.vector.data == self.repr.vector.data:
+                fragment.vector = self.repr.vector
 
     @property
     def size(self):
         return len(self.repr.nodes)
 
-    def extend(self, iteration=1):
+    def extend(self, iteration=1, extension_pool=None):
+        """
+        The fragments extended by every label are grouped in the workers of extension_pool if it is set,
+        see workers.ExtensionPool
+        """
         logger.warning(f'Extending pattern with fragments cnt = {len(self.fragments)}')
 
         start_time = time.time()
-        label_to_fragment_to_ext_list: Dict[str, Dict[Fragment, Set[Tuple[Fragment]]]] = {}
+        label_to_fragment_to_ext_list: Dict[Tuple[int, ...], Dict[Fragment, Set[Tuple[Fragment]]]] = {}
         for fragment in self.fragments:
-            label_to_ext_list: Dict[str, Set[Tuple]] = fragment.get_label_to_ext_list()
+            label_to_ext_list: Dict[Tuple[int, ...], Set[Tuple]] = fragment.get_label_to_ext_list()
             for label, exts in label_to_ext_list.items():
                 d = label_to_fragment_to_ext_list.setdefault(label, {})
                 d[fragment] = exts
@@ -383,7 +509,7 @@ class Pattern:
         logger.warning(f'Dict label_to_fragment_to_ext_list with '
                        f'{len(label_to_fragment_to_ext_list.items())} items was constructed', start_time=start_time)
 
-        freq_group, freq = self._get_most_freq_group_and_freq(label_to_fragment_to_ext_list)
+        freq_group, freq = self._get_most_freq_group_and_freq(label_to_fragment_to_ext_list, extension_pool)
 
         if freq >= Pattern.MIN_FREQUENCY:
             extended_pattern = Pattern(freq_group, freq)
@@ -401,12 +527,12 @@ class Pattern:
                         f'fragments cnt={len(extended_pattern.fragments)}, '
                         f'iteration = {iteration}')
 
-            return extended_pattern.extend(iteration=iteration + 1)
+            return extended_pattern.extend(iteration=iteration + 1, extension_pool=extension_pool)
         else:
             logger.log(logger.WARNING, f'Done extend() for a pattern')
             return self
 
-    def _get_most_freq_group_and_freq(self, label_to_fragment_to_ext_list):
+    def _get_most_freq_group_and_freq(self, label_to_fragment_to_ext_list, extension_pool=None):
         logger.warning(f'Processing label_to_fragment_to_ext_list to get the most freq group')
         if not label_to_fragment_to_ext_list:
             return None, -1
@@ -417,26 +543,20 @@ class Pattern:
         freq: int = self.MIN_FREQUENCY - 1
 
         has_result = False
-        if self.DO_ASYNC_MINING:
+        if extension_pool is not None:
             try:
-                with multiprocessing.Pool(processes=multiprocessing.cpu_count(), maxtasksperchild=1000) as pool:
-                    fn = functools.partial(self._get_most_freq_group_and_freq_in_label,
-                                           len(label_to_fragment_to_ext_list))
-
-                    for curr_group, curr_freq in pool.imap_unordered(
-                            fn, enumerate(label_to_fragment_to_ext_list.items()), chunksize=1):
-
-                        if curr_freq > freq:  # todo plus lattice, getting most frequent group one more time
-                            freq_group = curr_group
-                            freq = curr_freq
+                # todo plus lattice, getting most frequent group one more time
+                freq_group, freq = extension_pool.get_most_freq_group_and_freq(self, label_to_fragment_to_ext_list)
                 has_result = True
             except:
                 logger.error('Unable to process freq groups in the async mode', exc_info=True)
 
         if not has_result:
-            for label_num, (label, fragment_to_ext_list) in enumerate(label_to_fragment_to_ext_list.items()):
+            label_items = [(LABELS.format(label, Fragment.LABEL_SEPARATOR), fragment_to_ext_list)
+                           for label, fragment_to_ext_list in label_to_fragment_to_ext_list.items()]
+            for label_num, (label, fragment_to_ext_list) in enumerate(label_items):
                 curr_group, curr_freq = self._get_most_freq_group_and_freq_in_label(
-                    len(label_to_fragment_to_ext_list), (label_num, (label, fragment_to_ext_list)))
+                    len(label_items), (label_num, (label, fragment_to_ext_list)))
 
                 if curr_freq > freq:
                     freq_group = curr_group
@@ -457,32 +577,42 @@ class Pattern:
         logger.warning(f'Extending for label #{label}# [{1 + label_index}/{labels_cnt}] '
                        f'ext fragments = {len(ext_fragments)}', show_pid=True)
 
-        is_giant = self._is_giant_extension(ext_fragments)
+        return self.get_most_freq_group_and_freq_in_ext_fragments(ext_fragments, self.size, len(self.fragments))
+
+    @classmethod
+    def get_most_freq_group_and_freq_in_ext_fragments(cls, ext_fragments: set, size, fragments_cnt):
+        """
+        Groups the fragments extended by a label, size and fragments_cnt are the ones of the extended pattern
+        """
+        is_giant = cls._is_giant_extension(ext_fragments, size, fragments_cnt)
 
-        freq_group, freq = self._get_most_freq_group_and_freq_for_fragments(ext_fragments, is_giant)
+        freq_group, freq = cls._get_most_freq_group_and_freq_for_fragments(ext_fragments, is_giant, size,
+                                                                           fragments_cnt)
         logger.info(f'Got freq_group for label, freq={freq}, len={len(freq_group)}', show_pid=True)
         return freq_group, freq
 
-    def _is_giant_extension(self, ext_fragments):
-        return self.size > 1 and \
+    @staticmethod
+    def _is_giant_extension(ext_fragments, size, fragments_cnt):
+        return size > 1 and \
                (len(ext_fragments) > Pattern.MAX_FREQUENCY or
-                len(ext_fragments) > len(self.fragments) * self.size * self.size)
+                len(ext_fragments) > fragments_cnt * size * size)
 
-    def _get_most_freq_group_and_freq_for_fragments(self, ext_fragments: set, is_giant):
+    @classmethod
+    def _get_most_freq_group_and_freq_for_fragments(cls, ext_fragments: set, is_giant, size, fragments_cnt):
         start = time.time()
         groups: Set[FrozenSet[Fragment]] = Fragment.create_groups(ext_fragments)
         logger.log(logger.INFO, f'Groups for {len(ext_fragments)} fragments created', start_time=start, show_pid=True)
 
         freq_group: Set[Fragment] = set()
-        freq = self.MIN_FREQUENCY - 1
+        freq = cls.MIN_FREQUENCY - 1
 
         for curr_group in groups:
-            overlapped_fragments: list = self.get_graph_overlapped_fragments(curr_group)
+            overlapped_fragments: list = cls.get_graph_overlapped_fragments(curr_group)
             curr_freq = len(curr_group) - len(overlapped_fragments)
 
             if curr_freq > freq:
                 curr_group = set(curr_group)
-                if is_giant and self._is_giant_extension(curr_group):
+                if is_giant and cls._is_giant_extension(curr_group, size, fragments_cnt):
                     for fragment in overlapped_fragments:
                         curr_group.remove(fragment)
 
@@ -498,16 +628,41 @@ class Pattern:
         """
         graph_to_fragments = {}
         for fragment in ext_fragments:
-            s = graph_to_fragments.setdefault(fragment.graph, [])
+            graph_id, _ = fragment.get_key()
+            s = graph_to_fragments.setdefault(graph_id, [])
             s.append(fragment)
 
         overlapped_fragments = []
-        for graph, fragments in graph_to_fragments.items():
-            vb_utils.filter_list(
-                fragments,
-                condition=lambda i, j: fragments[i].overlap(fragments[j]),
-                post_condition_fn=lambda i, j: overlapped_fragments.append(fragments[j])
-            )
+        for fragments in graph_to_fragments.values():
+            overlapped_fragments.extend(Pattern._get_overlapped_fragments_in_graph(fragments))
+        return overlapped_fragments
+
+    @staticmethod
+    def _get_overlapped_fragments_in_graph(fragments: list):
+        """
+        Goes through the fragments in order, each fragment left overlaps the later ones sharing a function call node.
+        Only the fragments sharing a function call bit are scanned, see Fragment.overlap
+        """
+        bit_to_positions = {}
+        for position, fragment in enumerate(fragments):
+            for bit in vb_utils.iter_bits(fragment.func_call_mask):
+                bit_to_positions.setdefault(bit, []).append(position)
+
+        overlapped_fragments = []
+        is_overlapped = [False] * len(fragments)
+        for position, fragment in enumerate(fragments):
+            if is_overlapped[position]:
+                continue
+
+            overlapped_positions = set()
+            for bit in vb_utils.iter_bits(fragment.func_call_mask):
+                for other_position in bit_to_positions[bit]:
+                    if other_position > position and not is_overlapped[other_position]:
+                        overlapped_positions.add(other_position)
+
+            for other_position in sorted(overlapped_positions):
+                is_overlapped[other_position] = True
+                overlapped_fragments.append(fragments[other_position])
         return overlapped_fragments
 
     def is_change(self):
@@ -11,10 +11,12 @@ import json
 import datetime
 
 import settings
+import vb_utils
 import changegraph
 from log import logger
 from changegraph.models import ChangeNode
-from patterns.models import Fragment, Pattern
+from patterns import workers
+from patterns.models import Pattern
 
 
 class Miner:
@@ -25,6 +27,7 @@ class Miner:
 
     ID_OFFSET = settings.get('patterns_id_offset', 0)
     MIN_PATTERN_SIZE = settings.get('patterns_min_size', 3)
+    PROCESSES = settings.get('patterns_mining_processes', 1)  # seed groups are extended in parallel with more than 1
 
     MIN_DATE = None
     if settings.get('patterns_min_date', required=False):
@@ -54,40 +57,49 @@ class Miner:
 
         label_to_node_pairs = {}
         for graph in graphs:
-            if self.MIN_DATE and graph.repo_info.commit_dtm < self.MIN_DATE:
-                continue
+            commit_dtm = graph.repo_info.commit_dtm if graph.repo_info is not None else None
+            if self.MIN_DATE and commit_dtm and commit_dtm < self.MIN_DATE:
+                continue  # the graphs without a commit date are kept, as by the catalog and the seeds
 
             for node in graph.nodes:
-                if node.version != ChangeNode.Version.BEFORE_CHANGES or not node.mapped:
-                    continue
-
-                if not (node.kind == ChangeNode.Kind.OPERATION_NODE
-                        and node.sub_kind == ChangeNode.SubKind.OP_FUNC_CALL):
-                    # or node.kind == ChangeNode.Kind.CONTROL_NODE):
+                if not node.is_seed():
                     continue
 
-                label = f'{node.label}~{node.mapped.label}'
-                arr = label_to_node_pairs.setdefault(label, [])
+                arr = label_to_node_pairs.setdefault(node.get_seed_label_ids(), [])
                 arr.append((node, node.mapped))
 
         logger.warning(f'Total pairs after the first step = {len(label_to_node_pairs.values())}')
 
-        for num, pairs in enumerate(label_to_node_pairs.values()):
-            logger.warning(f'Looking at node pair #{num + 1}')
+        if self.PROCESSES > 1:
+            seed_groups = [pairs for pairs in label_to_node_pairs.values() if len(pairs) >= Pattern.MIN_FREQUENCY]
+            for pattern in workers.mine_seed_groups(seed_groups, self.MIN_PATTERN_SIZE, self.PROCESSES):
+                if pattern is not None:
+                    self.add_pattern(pattern)
+                    logger.warning(f'Pattern #{pattern.id} with size {pattern.size} was added')
+        else:
+            extension_pool = None
+            if Pattern.DO_ASYNC_MINING:  # a single pool for all the extensions, its workers keep the seed graphs
+                seed_graphs = {node.graph: None for pairs in label_to_node_pairs.values()
+                               if len(pairs) >= Pattern.MIN_FREQUENCY for node, _ in pairs}
+                extension_pool = workers.ExtensionPool(seed_graphs.keys()) if seed_graphs else None
 
-            if len(pairs) < Pattern.MIN_FREQUENCY:
-                logger.warning('Skipping...')
-                continue
+            try:
+                for num, pairs in enumerate(label_to_node_pairs.values()):
+                    logger.warning(f'Looking at node pair #{num + 1}')
 
-            fragments = set([Fragment.create_from_node_pair(pair) for pair in pairs])
-            pattern = Pattern(fragments, len(fragments))
-            pattern = pattern.extend()
+                    if len(pairs) < Pattern.MIN_FREQUENCY:
+                        logger.warning('Skipping...')
+                        continue
 
-            if pattern.is_change() and pattern.size >= self.MIN_PATTERN_SIZE:
-                self.add_pattern(pattern)
-                logger.warning(f'Pattern #{pattern.id} with size {pattern.size} was added')
+                    pattern = workers.extend_seed_pairs(pairs, self.MIN_PATTERN_SIZE, extension_pool=extension_pool)
+                    if pattern is not None:
+                        self.add_pattern(pattern)
+                        logger.warning(f'Pattern #{pattern.id} with size {pattern.size} was added')
 
-            logger.warning(f'Done looking at node pair #{num + 1}')
+                    logger.warning(f'Done looking at node pair #{num + 1}')
+            finally:
+                if extension_pool is not None:
+                    extension_pool.close()
 
         logger.warning(f'Done patterns\' mining, total count = {self._patterns_cnt}')
 
@@ -104,6 +116,20 @@ class Miner:
             logger.info('Done removing overlapped fragments from patterns')
 
     def _filter_patterns(self):
+        """
+        Removes the patterns contained in other patterns of equal or larger size, see Pattern.contains.
+        The containing candidates are looked up by a node of each fragment, the path counts are compared first
+        """
+        node_to_fragments = {}
+        pattern_to_bounds = {}
+        for patterns in self._size_to_patterns.values():
+            for pattern in patterns:
+                pattern_to_bounds[pattern] = self._get_path_count_bounds(pattern)
+                for fragment in pattern.fragments:
+                    graph_id, node_mask = fragment.get_key()
+                    for bit in vb_utils.iter_bits(node_mask):
+                        node_to_fragments.setdefault((graph_id, bit), []).append((pattern, fragment))
+
         keys = sorted(self._size_to_patterns.keys())
         cleared_keys = set()
 
@@ -111,27 +137,53 @@ class Miner:
             patterns = self._size_to_patterns[size1]
 
             for pattern1 in copy.copy(patterns):
-                for size2 in keys:
-                    if size1 > size2:
-                        continue
+                if self._is_contained(pattern1, node_to_fragments, pattern_to_bounds):
+                    patterns.remove(pattern1)
+                    self._patterns_cnt -= 1
+                    if not patterns:
+                        cleared_keys.add(size1)
 
-                    patterns2 = self._size_to_patterns[size2]
-                    found = False
+        for k in cleared_keys:
+            self._size_to_patterns.pop(k)
 
-                    for pattern2 in patterns2:
-                        if pattern2 != pattern1 and pattern2.contains(pattern1):
-                            patterns.remove(pattern1)
-                            self._patterns_cnt -= 1
-                            if not patterns:
-                                cleared_keys.add(size1)
-                            found = True
-                            break
+    def _is_contained(self, pattern, node_to_fragments, pattern_to_bounds):
+        lower_counts, _ = pattern_to_bounds[pattern]
+        rejected = {pattern}
 
-                    if found:
-                        break
+        for fragment in pattern.fragments:
+            graph_id, node_mask = fragment.get_key()
+            for other, other_fragment in node_to_fragments.get((graph_id, node_mask & -node_mask), []):
+                if other in rejected:
+                    continue
 
-        for k in cleared_keys:
-            self._size_to_patterns.pop(k)
+                _, upper_counts = pattern_to_bounds[other]
+                if other.size < pattern.size or other not in self._size_to_patterns[other.size] \
+                        or any(upper_counts.get(key, 0) < cnt for key, cnt in lower_counts.items()):
+                    rejected.add(other)
+                    continue
+
+                if other_fragment.contains(fragment):
+                    return True
+        return False
+
+    @staticmethod
+    def _get_path_count_bounds(pattern):
+        """
+        Returns the minimal and the maximal label path counts over the fragments of the pattern,
+        a pattern is able to contain another one only if its maximal counts dominate the other's minimal ones
+        """
+        lower_counts, upper_counts = None, {}
+        for fragment in pattern.fragments:
+            counts = fragment.get_label_path_counts()
+            for key, cnt in counts.items():
+                if upper_counts.get(key, 0) < cnt:
+                    upper_counts[key] = cnt
+
+            if lower_counts is None:
+                lower_counts = counts
+            else:
+                lower_counts = {key: min(cnt, counts[key]) for key, cnt in lower_counts.items() if key in counts}
+        return lower_counts or {}, upper_counts
 
     def print_patterns(self):
         if not self._size_to_patterns:
@@ -305,7 +357,7 @@ class Miner:
         repo_url = repo_info.repo_url.strip()[:-4]
         commit_hash = repo_info.commit_hash
 
-        line_number = repo_info.old_method.ast.lineno
+        line_number = repo_info.old_method.lineno
 
         optional_links = ''
         if cls.FULL_PRINT:
@@ -354,10 +406,10 @@ class Miner:
         new_src = repo_info.new_method.get_source()
 
         if not old_src:
-            logger.info(f'Unable to get source from ast {repo_info.old_method.ast}')
+            logger.info(f'Unable to get source of {repo_info.old_method.full_name}')
             return None
         if not new_src:
-            logger.warning(f'Unable to get source from ast {repo_info.new_method.ast}')
+            logger.warning(f'Unable to get source of {repo_info.new_method.full_name}')
             return None
 
         sample = f'<html lang="en">\n' \
@@ -409,7 +461,7 @@ class Miner:
 
         return f'<pre class="code language-python" ' \
                f'data-base-line-url="{cls._get_base_line_url(repo_info, version)}" ' \
-               f'data-line-number="{method.ast.lineno}" ' \
+               f'data-line-number="{method.lineno}" ' \
                f'data-code-version="{version}">\n' \
                f'{cls._get_markup(fragment, src, version)}' \
                f'</pre>\n'
@@ -422,7 +474,7 @@ class Miner:
             for in_node in in_nodes:
                 defs = in_node.get_definitions()
                 for def_node in defs:
-                    if def_node in fragment.nodes:
+                    if fragment.contains_node(def_node):
                         printable_nodes.add(in_node)
                         break
         printable_nodes = printable_nodes.union(fragment.nodes)
@@ -438,9 +490,7 @@ class Miner:
                     pattern_intervals.append(interval)
                 continue
 
-            start = node.ast.first_token.startpos
-            end = node.ast.last_token.endpos
-            pattern_intervals.append([start, end])
+            pattern_intervals.append([node.position.start, node.position.end])
 
         pattern_intervals = cls.merge_intervals(pattern_intervals)
 
@@ -0,0 +1,264 @@
+"""
+Parallel pattern mining.
+
+The graphs of the seeds are written once in the flat format to a temporary segment store, the workers memory-map it
+and decode the graphs by their numbers. The nodes are referred to by (graph number, node row) in the tasks
+and the results, so neither graphs nor fragments are pickled through the pipes, the patterns are rebuilt
+on the graphs of the miner.
+
+Two levels are parallel:
+- seed groups are independent until the patterns are filtered, each one is extended in a worker, see mine_seed_groups
+- the labels of a pattern extension are grouped in the workers of a pool living as long as the mining,
+  see ExtensionPool, that is the patterns_async_mining mode
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+from changegraph import serialization
+from changegraph.labels import LABELS
+from log import logger
+from patterns.models import Fragment, Pattern
+from storage.change_graphs import SEGMENT_MAX_SIZE, decode_change_graph
+from storage.reader import ChangeGraphStore
+from storage.segments import SegmentWriter
+
+_worker_store = None
+_worker_min_pattern_size = None
+_worker_graph_rows = {}  # graph number -> nodes by row
+_worker_graph_to_num = {}
+
+
+def extend_seed_pairs(pairs, min_pattern_size, extension_pool=None):
+    """
+    Extends the pattern of a seed group, returns None unless it is a change of at least min_pattern_size nodes
+    """
+    fragments = set([Fragment.create_from_node_pair(pair) for pair in pairs])
+    pattern = Pattern(fragments, len(fragments))
+    pattern = pattern.extend(extension_pool=extension_pool)
+
+    if pattern.is_change() and pattern.size >= min_pattern_size:
+        return pattern
+    return None
+
+
+def _get_rows(graph):
+    """
+    The nodes in the order of their rows in the flat format, see serialization.encode
+    """
+    return sorted(graph.nodes, key=lambda node: node.id)
+
+
+class _GraphStore:
+    """
+    Numbers the graphs and stores them in a temporary directory, the nodes are referred to by their rows
+    """
+    def __init__(self, graphs):
+        self.graphs = list(graphs)
+        self.graph_rows = [_get_rows(graph) for graph in self.graphs]
+        self._graph_to_num = {graph: graph_num for graph_num, graph in enumerate(self.graphs)}
+        self._node_to_rows = [None if all(node.id == row for row, node in enumerate(rows))
+                              else {node: row for row, node in enumerate(rows)} for rows in self.graph_rows]
+
+        self.storage_dir = tempfile.mkdtemp(prefix='patterns-')
+        try:
+            self.store = ChangeGraphStore(self.storage_dir, index=self._write_graphs())
+        except BaseException:
+            shutil.rmtree(self.storage_dir, ignore_errors=True)
+            raise
+
+    def _write_graphs(self):
+        index = {}
+        with SegmentWriter(self.storage_dir, SEGMENT_MAX_SIZE) as writer:
+            for graph_num, graph in enumerate(self.graphs):
+                file_path, offset, length = writer.append(serialization.encode(graph, keep_ast=False), graph_num)
+                index[graph_num] = (os.path.basename(file_path), offset, length)
+        return index
+
+    def get_graph_num(self, graph):
+        return self._graph_to_num[graph]
+
+    def get_row(self, node):
+        node_to_row = self._node_to_rows[self._graph_to_num[node.graph]]
+        return node.id if node_to_row is None else node_to_row[node]
+
+    def get_rows(self, nodes):
+        return [self.get_row(node) for node in nodes]
+
+    def create_fragment(self, graph_num, rows):
+        graph_rows = self.graph_rows[graph_num]
+        return Fragment.create_from_nodes(self.graphs[graph_num], [graph_rows[row] for row in rows])
+
+    def close(self):
+        self.store.close()
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+
+def _init_worker(store, min_frequency, max_frequency, min_pattern_size=None, preload=False):
+    global _worker_store, _worker_min_pattern_size
+    _worker_store = store
+    _worker_min_pattern_size = min_pattern_size
+
+    Pattern.MIN_FREQUENCY = min_frequency
+    Pattern.MAX_FREQUENCY = max_frequency
+    Pattern.DO_ASYNC_MINING = False  # daemonic workers are not allowed to start pools
+    sys.setrecursionlimit(2 ** 31 - 1)  # patterns are extended recursively
+
+    if preload:
+        for graph_num in store.graph_ids:
+            _get_worker_rows(graph_num)
+
+
+def _get_worker_rows(graph_num):
+    rows = _worker_graph_rows.get(graph_num)
+    if rows is None:
+        graph = decode_change_graph(_worker_store.read_encoded_change_graph(graph_num))
+        rows = _worker_graph_rows[graph_num] = _get_rows(graph)
+        _worker_graph_to_num[graph] = graph_num
+    return rows
+
+
+def _create_worker_fragment(graph_num, rows):
+    graph_rows = _get_worker_rows(graph_num)
+    nodes = [graph_rows[row] for row in rows]
+    return Fragment.create_from_nodes(nodes[0].graph, nodes)
+
+
+def _mine_seed_group(seed_refs):
+    pairs = []
+    for graph_num, row, mapped_row in seed_refs:
+        rows = _get_worker_rows(graph_num)
+        pairs.append((rows[row], rows[mapped_row]))
+
+    pattern = extend_seed_pairs(pairs, _worker_min_pattern_size)
+    if pattern is None:
+        return None
+
+    fragments = [pattern.repr] + [fragment for fragment in pattern.fragments if fragment is not pattern.repr]
+    return pattern.freq, [(_worker_graph_to_num[fragment.graph], [node.id for node in fragment.nodes])
+                          for fragment in fragments]  # the ids of the decoded nodes are their rows
+
+
+def mine_seed_groups(seed_groups, min_pattern_size, processes):
+    """
+    Yields the extended patterns of the seed groups in their order, None for the groups without a pattern.
+    The patterns are built on the nodes of the seeds, like in the serial mode
+    """
+    graph_store = _GraphStore({node.graph: None for pairs in seed_groups for node, _ in pairs}.keys())
+    try:
+        tasks = [[(graph_store.get_graph_num(node.graph), graph_store.get_row(node), graph_store.get_row(mapped))
+                  for node, mapped in pairs] for pairs in seed_groups]
+        logger.warning(f'Mining {len(tasks)} seed groups of {len(graph_store.graphs)} graphs '
+                       f'with {processes} processes')
+
+        with multiprocessing.Pool(processes=processes, initializer=_init_worker,
+                                  initargs=(graph_store.store, Pattern.MIN_FREQUENCY, Pattern.MAX_FREQUENCY,
+                                            min_pattern_size)) as pool:
+            for result in pool.imap(_mine_seed_group, tasks):
+                if result is None:
+                    yield None
+                    continue
+
+                freq, fragment_refs = result
+                fragments = [graph_store.create_fragment(graph_num, rows) for graph_num, rows in fragment_refs]
+                pattern = Pattern(set(fragments), freq)
+                pattern.repr = fragments[0]
+                yield pattern
+    finally:
+        graph_store.close()
+
+
+def _get_most_freq_group_in_label(task):
+    label_num, labels_cnt, label, size, fragments_cnt, vectors, fragment_refs = task
+
+    ext_fragment_to_position = {}
+    for fragment_num, (vector_num, graph_num, rows, ext_list) in enumerate(fragment_refs):
+        fragment = _create_worker_fragment(graph_num, rows)
+        fragment.vector = vectors[vector_num]  # the vectors of the extended fragments are deltas to it
+
+        graph_rows = _worker_graph_rows[graph_num]
+        for ext_num, ext_rows in enumerate(ext_list):
+            ext_fragment = Fragment.create_extended(fragment, tuple(graph_rows[row] for row in ext_rows))
+            ext_fragment_to_position[ext_fragment] = (fragment_num, ext_num)
+
+    logger.warning(f'Extending for label #{label}# [{1 + label_num}/{labels_cnt}] '
+                   f'ext fragments = {len(ext_fragment_to_position)}', show_pid=True)
+
+    freq_group, freq = Pattern.get_most_freq_group_and_freq_in_ext_fragments(
+        set(ext_fragment_to_position.keys()), size, fragments_cnt)
+    return sorted(ext_fragment_to_position[ext_fragment] for ext_fragment in freq_group), freq
+
+
+class ExtensionPool:
+    """
+    Worker processes grouping the fragments extended by the labels of a pattern, see Pattern.extend.
+    The pool lives as long as the mining, its workers decode the graphs once when they start.
+    A task carries the fragments of a label as graph numbers and node rows with their extensions,
+    a result is the most frequent group as the positions of its fragments and extensions in the task
+    """
+    def __init__(self, graphs, processes=None):
+        self._graph_store = _GraphStore(graphs)
+        try:
+            self._pool = multiprocessing.Pool(processes=processes or multiprocessing.cpu_count(),
+                                              initializer=_init_worker,
+                                              initargs=(self._graph_store.store, Pattern.MIN_FREQUENCY,
+                                                        Pattern.MAX_FREQUENCY, None, True))
+        except BaseException:
+            self._graph_store.close()
+            raise
+
+    def get_most_freq_group_and_freq(self, pattern, label_to_fragment_to_ext_list):
+        """
+        Returns the group of the extended fragments with the highest frequency over the labels and the frequency,
+        the first label wins a tie as in the serial mode
+        """
+        label_items = []
+        tasks = []
+        for label_num, (label, fragment_to_ext_list) in enumerate(label_to_fragment_to_ext_list.items()):
+            items = [(fragment, list(ext_list)) for fragment, ext_list in fragment_to_ext_list.items()]
+            label_items.append(items)
+
+            vectors = []
+            vector_nums = {}
+            fragment_refs = []
+            for fragment, ext_list in items:
+                vector_num = vector_nums.get(id(fragment.vector))
+                if vector_num is None:
+                    vector_num = vector_nums[id(fragment.vector)] = len(vectors)
+                    vectors.append(fragment.vector)
+
+                fragment_refs.append((vector_num, self._graph_store.get_graph_num(fragment.graph),
+                                      self._graph_store.get_rows(fragment.nodes),
+                                      [self._graph_store.get_rows(ext) for ext in ext_list]))
+
+            # the label ids are valid within this process only, the workers get the printable labels
+            tasks.append((label_num, len(label_to_fragment_to_ext_list), LABELS.format(label, Fragment.LABEL_SEPARATOR),
+                          pattern.size, len(pattern.fragments), vectors, fragment_refs))
+
+        freq_items, freq_positions = None, []
+        freq = Pattern.MIN_FREQUENCY - 1
+        for items, (positions, curr_freq) in zip(label_items, self._pool.imap(_get_most_freq_group_in_label, tasks)):
+            if curr_freq > freq:
+                freq_items, freq_positions = items, positions
+                freq = curr_freq
+
+        freq_group = set()
+        for fragment_num, ext_num in freq_positions:
+            fragment, ext_list = freq_items[fragment_num]
+            freq_group.add(Fragment.create_extended(fragment, ext_list[ext_num]))
+        return freq_group, freq
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self._graph_store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self._pool.terminate()
+        self.close()
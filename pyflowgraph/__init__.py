@@ -1,4 +1,4 @@
-from . import visual
+from . import visual, export
 from .build import GraphBuilder
 
 
@@ -8,3 +8,4 @@ build_from_source = _builder.build_from_source
 build_from_file = _builder.build_from_file
 
 export_graph_image = visual.export_graph_image
+export_graph_dict = export.convert_to_dict
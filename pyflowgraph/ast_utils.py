@@ -20,7 +20,7 @@ def get_node_key(node):
     elif isinstance(node, ast.Call):
         return get_node_key(node.func)
     else:
-        logger.error(f"ast_utils: get_node_key node = {node}, line = {node.first_token.line}")
+        logger.error(f"ast_utils: get_node_key node = {node}, line = {getattr(node, 'lineno', None)}")
         return "Expr"
 
 
@@ -86,7 +86,7 @@ def get_node_full_name(node):
     elif isinstance(node, ast.Starred):
         return f"*{get_node_full_name(node.value)}"
     else:
-        logger.error(f"get_node_full_name_error, expr written instead: Unable to proceed node = {node}, line = {node.first_token.line}")
+        logger.error(f"get_node_full_name_error, expr written instead: Unable to proceed node = {node}, line = {getattr(node, 'lineno', None)}")
         return "Expr"
 
 def get_node_short_name(node):
@@ -105,5 +105,5 @@ def get_node_short_name(node):
     elif isinstance(node, ast.Call):
         return get_node_short_name(node.func)
     else:
-        logger.error(f"ast_utils: get_node_short_name node = {node}, line = {node.first_token.line}")
+        logger.error(f"ast_utils: get_node_short_name node = {node}, line = {getattr(node, 'lineno', None)}")
         return "Expr"
\ No newline at end of file
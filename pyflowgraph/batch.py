@@ -0,0 +1,72 @@
+import json
+import multiprocessing
+import os
+import sys
+import time
+from functools import partial
+
+import pyflowgraph
+from log import logger
+
+
+def collect_source_files(paths):
+    """
+    Expands directories into the .py files they contain, plain files are kept as is
+    """
+    result = []
+    for path in paths:
+        if not os.path.isdir(path):
+            result.append(path)
+            continue
+
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if file_name.endswith('.py'):
+                    result.append(os.path.join(dir_path, file_name))
+    return result
+
+
+def _init_worker():
+    sys.setrecursionlimit(2 ** 31 - 1)
+
+
+def _build_record(file_path, show_dependencies, build_closure):
+    start = time.time()
+    try:
+        fg = pyflowgraph.build_from_file(file_path, show_dependencies=show_dependencies, build_closure=build_closure)
+        graph = {'path': file_path, **pyflowgraph.export_graph_dict(fg)}
+    except Exception as e:
+        return None, {'path': file_path, 'status': 'error', 'time': time.time() - start,
+                      'error': f'{type(e).__name__}: {e}'}
+
+    stats = {'path': file_path, 'status': 'ok', 'time': time.time() - start,
+             'nodes': len(graph['nodes']), 'edges': len(graph['edges'])}
+    return graph, stats
+
+
+def build_batch(paths, output_path, processes=None, show_dependencies=False, build_closure=True):
+    """
+    Builds flow graphs for every file in paths and streams them to output_path as JSON Lines,
+    one record per successfully built graph. Per-file timing and errors go to {output_path}.stats.jsonl
+    """
+    file_paths = collect_source_files(paths)
+    logger.warning(f'Found {len(file_paths)} files to build flow graphs for')
+
+    build_fn = partial(_build_record, show_dependencies=show_dependencies, build_closure=build_closure)
+    built_cnt = 0
+    start = time.time()
+    with open(output_path, 'w') as output, open(f'{output_path}.stats.jsonl', 'w') as stats_output, \
+            multiprocessing.Pool(processes=processes or multiprocessing.cpu_count(), initializer=_init_worker,
+                                 maxtasksperchild=1000) as pool:
+        for file_num, (graph, stats) in enumerate(pool.imap_unordered(build_fn, file_paths, chunksize=4)):
+            if graph is not None:
+                output.write(json.dumps(graph, separators=(',', ':')) + '\n')
+                built_cnt += 1
+            stats_output.write(json.dumps(stats) + '\n')
+
+            if (1 + file_num) % 1000 == 0:
+                logger.warning(f'Processed [{1 + file_num}/{len(file_paths)}] files')
+
+    logger.warning(f'Built {built_cnt} of {len(file_paths)} flow graphs', start_time=start)
+    return built_cnt
@@ -1,14 +1,15 @@
 import ast
+import functools
 import html
-from typing import Dict, Set
-
-from asttokens import asttokens
+from typing import Callable, Dict, Optional, Set
 
 import settings
 from log import logger
 from pyflowgraph import models, ast_utils
 from pyflowgraph.models import Node, DataNode, OperationNode, ExtControlFlowGraph, ControlNode, DataEdge, LinkType, \
     EntryNode, EmptyNode, ControlEdge, StatementNode
+from pyflowgraph.positions import TokenPositions
+from vb_utils import SourceText
 
 class BuildingContext:
     def __init__(self):
@@ -46,7 +47,9 @@ class BuildingContext:
 
 
 class GraphBuilder:
-    def build_from_source(self, source_code, show_dependencies=False, build_closure=True):
+    LOG_LEVEL = settings.get('logger_file_log_level', 'INFO')
+
+    def build_from_source(self, source_code, show_dependencies=False, build_closure=True, strict=False):
         models._statement_cnt = 0
         try:
             source_code_ast = ast.parse(source_code, mode='exec')
@@ -55,19 +58,18 @@ class GraphBuilder:
             logger.error(f"Error in parsing, code = {source_code}")
             raise GraphBuildingException
 
-        tokenized_ast = asttokens.ASTTokens(source_code, tree=source_code_ast)
+        source = SourceText(source_code)
+        positions = TokenPositions(source)
 
-        if isinstance(tokenized_ast.tree, ast.Module) and isinstance(tokenized_ast.tree.body[0], ast.FunctionDef):
-            root_ast = tokenized_ast.tree.body[0]
+        if isinstance(source_code_ast, ast.Module) and isinstance(source_code_ast.body[0], ast.FunctionDef):
+            root_ast = source_code_ast.body[0]
         else:
-            root_ast = tokenized_ast.tree
+            root_ast = source_code_ast
 
-        log_level = settings.get("logger_file_log_level", 'INFO')
-
-        if log_level != 'DEBUG':
-            ast_visitor = ASTVisitor()
+        if self.LOG_LEVEL != 'DEBUG':
+            ast_visitor = ASTVisitor(positions, strict=strict)
         else:
-            ast_visitor = ASTVisitor_Debug()
+            ast_visitor = ASTVisitorDebug(positions, strict=strict)
 
         fg = ast_visitor.visit(root_ast)
 
@@ -77,12 +79,17 @@ class GraphBuilder:
         if build_closure:
             self.build_closure(fg)
 
+        for node in fg.nodes:
+            if not isinstance(node, EmptyNode):
+                positions.mark(node.ast)
+        fg.source = source
         return fg
 
-    def build_from_file(self, file_path, show_dependencies=False, build_closure=True):
+    def build_from_file(self, file_path, show_dependencies=False, build_closure=True, strict=False):
         with open(file_path, 'r+') as f:
             data = f.read()
-        return self.build_from_source(data, show_dependencies=show_dependencies, build_closure=build_closure)
+        return self.build_from_source(
+            data, show_dependencies=show_dependencies, build_closure=build_closure, strict=strict)
 
     @classmethod
     def _build_data_closure(cls, node, processed_nodes):
@@ -451,8 +458,8 @@ class ASTVisitorHelper:
         g = self.create_graph()
         op_node = OperationNode(OperationNode.Label.ASSIGN, node, self.visitor.control_branch_stack,
                                 kind=OperationNode.Kind.ASSIGN)
-        syntax_left = max([t.last_token.endpos for t in targets])
-        syntax_right = node.value.first_token.startpos
+        syntax_left = max([self.visitor.positions.end(t) for t in targets])
+        syntax_right = self.visitor.positions.start(node.value)
         op_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [[syntax_left, syntax_right]])
 
         fgs = []
@@ -471,8 +478,24 @@ class ASTVisitorHelper:
         return g
 
 
+def _get_ast_node_classes(base=ast.AST):
+    result = []
+    for node_cls in base.__subclasses__():
+        result.append(node_cls)
+        result += _get_ast_node_classes(node_cls)
+    return result
+
+
 class ASTVisitor(ast.NodeVisitor):
-    def __init__(self):
+    """
+    Visits are dispatched through a class-to-method table, which is built once per visitor class
+    In the strict mode unsupported nodes and failed statements raise instead of being skipped
+    """
+    _dispatch_table: Dict[type, Optional[Callable]] = {}
+
+    def __init__(self, positions, strict=False):
+        self.positions = positions
+        self.strict = strict
         self.context_stack = [BuildingContext()]
         self.fg = self.create_graph()
 
@@ -482,8 +505,35 @@ class ASTVisitor(ast.NodeVisitor):
 
         self.visitor_helper = ASTVisitorHelper(self)
 
-        self.log_level = settings.get("logger_file_log_level", 'INFO')
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._dispatch_table = cls._build_dispatch_table()
+
+    @classmethod
+    def _build_dispatch_table(cls):
+        return {node_cls: cls._find_visit_method(node_cls) for node_cls in _get_ast_node_classes()}
+
+    @classmethod
+    def _find_visit_method(cls, node_cls):
+        return getattr(cls, f'visit_{node_cls.__name__}', None)
+
+    def _get_visit_method(self, node):
+        node_cls = node.__class__
+        try:
+            return self._dispatch_table[node_cls]
+        except KeyError:
+            method = self._find_visit_method(node_cls)
+            self._dispatch_table[node_cls] = method
+            return method
+
+    def visit(self, node):
+        method = self._get_visit_method(node)
+        if method is not None:
+            return method(self, node)
 
+        if self.strict:
+            raise GraphBuildingException(f'Unsupported node = {node}')
+        return self.generic_visit(node)
 
     @property
     def context(self):
@@ -515,7 +565,7 @@ class ASTVisitor(ast.NodeVisitor):
         op_node = OperationNode(node.__class__.__name__, node, self.control_branch_stack,
                                 kind=OperationNode.Kind.COLLECTION)
         op_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [
-            [node.first_token.startpos, node.first_token.endpos], [node.last_token.startpos, node.last_token.endpos]
+            self.positions.get_first_token_interval(node), self.positions.get_last_token_interval(node)
         ])
         fg.add_node(op_node, link_type=LinkType.PARAMETER)
         return fg
@@ -523,7 +573,7 @@ class ASTVisitor(ast.NodeVisitor):
     def _visit_op(self, op_name, node, op_kind, params, syntax_tokens=None):
         op_node = OperationNode(op_name, node, self.control_branch_stack, kind=op_kind)
         op_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [
-            [node.first_token.endpos, node.last_token.startpos]
+            self.positions.get_inner_interval(node)
         ])
 
         last_param = None
@@ -536,7 +586,7 @@ class ASTVisitor(ast.NodeVisitor):
             param_fgs.append(param_fg)
 
             if last_param:
-                calc_syntax_tokens.append([last_param.last_token.endpos, param.first_token.startpos])
+                calc_syntax_tokens.append([self.positions.end(last_param), self.positions.start(param)])
             last_param = param
 
         op_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, syntax_tokens or calc_syntax_tokens)
@@ -559,23 +609,35 @@ class ASTVisitor(ast.NodeVisitor):
         self.fg.parallel_merge_graphs(arg_fgs)
 
         for st in node.body:
-            try:
-                fg = self.visit(st)
-                logger.info(f"Successfully proceed expr = {st} line = {st.first_token.line}")
-            except:
-                fg = None
+            fg = self._visit_statement(st)
+            if fg:
+                self.fg.merge_graph(fg)
 
+        self._pop_control_branch()
+        return self.fg
+
+    def _visit_statement(self, st):
+        if self.strict:
+            fg = self.visit(st)
             if not fg:
-                err_msg = f'Unable to build pfg for expr = {st}, line = {st.first_token.line} skipping...'
-                if isinstance(st, ast.Assign):
-                    err_msg += f'Assign error: targets = {st.targets}, values = {st.value}'
-                logger.error(err_msg, exc_info=True)
-                continue
+                raise GraphBuildingException(f'Unable to build pfg for expr = {st}')
+            return fg
 
-            self.fg.merge_graph(fg)
+        try:
+            fg = self.visit(st)
+            if logger.is_enabled_for(logger.INFO):
+                logger.info(f"Successfully proceed expr = {st} line = {self.positions.line(st)}")
+        except:
+            fg = None
 
-        self._pop_control_branch()
-        return self.fg
+        if not fg:
+            err_msg = f'Unable to build pfg for expr = {st}, line = {self.positions.line(st)} skipping...'
+            if isinstance(st, ast.Assign):
+                err_msg += f'Assign error: targets = {st.targets}, values = {st.value}'
+            logger.error(err_msg, exc_info=True)
+            return None
+
+        return fg
 
     # Root visits
     def visit_Module(self, node):
@@ -586,9 +648,10 @@ class ASTVisitor(ast.NodeVisitor):
             return self._visit_entry_node(node)
         fg = self._visit_non_assign_var_decl(node)
         var_node = next(iter(fg.nodes))
+        first_token = self.positions.first_token(node)
         var_node.set_property(
             Node.Property.SYNTAX_TOKEN_INTERVALS,
-            [[node.first_token.startpos, node.first_token.startpos + len(node.first_token.line.strip())]])
+            [[first_token.startpos, first_token.startpos + len(first_token.line.strip())]])
         return fg
 
     def visit_Expr(self, node):
@@ -624,8 +687,8 @@ class ASTVisitor(ast.NodeVisitor):
         fg.parallel_merge_graphs(arg_fgs)
 
         lambda_node = DataNode(OperationNode.Label.LAMBDA, node)
-        lambda_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [[
-            node.first_token.startpos, node.first_token.endpos]])
+        lambda_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [
+            self.positions.get_first_token_interval(node)])
 
         body_fg = self.visit(node.body)
         fg.merge_graph(body_fg)
@@ -656,8 +719,8 @@ class ASTVisitor(ast.NodeVisitor):
         g.parallel_merge_graphs(fg_graphs)
         op_node = OperationNode('Dict', node, self.control_branch_stack, kind=OperationNode.Kind.COLLECTION)
         op_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [
-            [node.first_token.startpos, node.first_token.endpos],
-            [node.last_token.startpos, node.last_token.endpos]])
+            self.positions.get_first_token_interval(node),
+            self.positions.get_last_token_interval(node)])
         g.add_node(op_node, link_type=LinkType.PARAMETER)
         return g
 
@@ -681,7 +744,7 @@ class ASTVisitor(ast.NodeVisitor):
 
         data_node = DataNode(attr_name, node, kind=DataNode.Kind.VARIABLE_USAGE, key=attr_key)
         data_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [
-            [node.last_token.startpos, node.last_token.endpos]])
+            self.positions.get_last_token_interval(node)])
         fg.add_node(data_node, link_type=LinkType.QUALIFIER, clear_sinks=True)
         return fg
 
@@ -726,7 +789,7 @@ class ASTVisitor(ast.NodeVisitor):
         op_node = OperationNode(OperationNode.Label.LISTCOMP, node, self.control_branch_stack,
                                 kind=OperationNode.Kind.LISTCOMP)
         op_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [
-            [node.first_token.endpos, node.last_token.startpos]
+            self.positions.get_inner_interval(node)
         ])
         params_fgs = []
 
@@ -746,7 +809,7 @@ class ASTVisitor(ast.NodeVisitor):
         op_node = OperationNode(OperationNode.Label.DICTCOMP, node, self.control_branch_stack,
                                 kind=OperationNode.Kind.DICTCOMP)
         op_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [
-            [node.first_token.endpos, node.last_token.startpos]
+            self.positions.get_inner_interval(node)
         ])
         params_fgs = []
 
@@ -770,7 +833,7 @@ class ASTVisitor(ast.NodeVisitor):
         op_node = OperationNode(OperationNode.Label.GENERATOREXPR, node, self.control_branch_stack,
                                 kind=OperationNode.Kind.GENERATOREXPR)
         op_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [
-            [node.first_token.endpos, node.last_token.startpos]
+            self.positions.get_inner_interval(node)
         ])
         params_fgs = []
 
@@ -790,7 +853,7 @@ class ASTVisitor(ast.NodeVisitor):
         op_node = OperationNode(OperationNode.Label.COMPREHENSION, node, self.control_branch_stack,
                                 kind=OperationNode.Kind.COMPREHENSION)
         op_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [
-            [node.first_token.endpos, node.last_token.startpos]])
+            self.positions.get_inner_interval(node)])
         iter_fg = self._visit_simple_assign(node.target, node.iter, is_op_unmappable=True)
         iter_fg.add_node(op_node, link_type=LinkType.PARAMETER)
         params_fgs.append(iter_fg)
@@ -892,7 +955,7 @@ class ASTVisitor(ast.NodeVisitor):
             if keyword.arg:
                 arg_node = DataNode(keyword.arg, keyword, kind=DataNode.Kind.KEYWORD)
                 arg_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS,
-                                      [[keyword.first_token.startpos, keyword.first_token.endpos]])
+                                      [self.positions.get_first_token_interval(keyword)])
                 fg.add_node(arg_node)
             arg_fgs.append(fg)
 
@@ -919,12 +982,12 @@ class ASTVisitor(ast.NodeVisitor):
         key = ast_utils.get_node_key(node.func)
 
         if isinstance(node.func, ast.Name):
-            syntax_tokens = [[node.func.first_token.startpos, node.func.last_token.endpos]]
+            syntax_tokens = [[self.positions.start(node.func), self.positions.end(node.func)]]
             return self._visit_func_call(node, name, syntax_tokens, key=key)
         elif isinstance(node.func, ast.Attribute):
             attr_fg = self.visit(node.func)
 
-            syntax_tokens = [[node.func.last_token.startpos, node.func.last_token.endpos]]
+            syntax_tokens = [self.positions.get_last_token_interval(node.func)]
             call_fg = self._visit_func_call(node, name, syntax_tokens)
 
             attr_fg.merge_graph(call_fg, link_node=next(iter(call_fg.sinks)), link_type=LinkType.RECEIVER)
@@ -933,14 +996,14 @@ class ASTVisitor(ast.NodeVisitor):
             return self.visit_Call(node.func)
         else:
             logger.error(
-                f"Fail in visited node = {node}, unsupported func type = {node.func} line = {node.first_token.line}")
+                f"Fail in visited node = {node}, unsupported func type = {node.func} line = {self.positions.line(node)}")
             return None
 
     # Control statement visits
     def visit_If(self, node):
         control_node = ControlNode(ControlNode.Label.IF, node, self.control_branch_stack)
         control_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS,
-                                  [[node.first_token.startpos, node.first_token.endpos]])
+                                  [self.positions.get_first_token_interval(node)])
 
         fg = self.visit(node.test)
         fg.add_node(control_node, link_type=LinkType.CONDITION)
@@ -951,10 +1014,10 @@ class ASTVisitor(ast.NodeVisitor):
         return fg
 
     def visit_IfExp(self, node):
-        line_to_log = node.first_token.line
+        line_to_log = self.positions.line(node)
         if hasattr(node, 'body') and isinstance(node.body, list):
             for expr in node.body:
-                line_to_log += expr.first_token.line
+                line_to_log += self.positions.line(expr)
         logger.error(f"Failed visited node = {node}, line = {line_to_log}")
         return None
 
@@ -962,7 +1025,7 @@ class ASTVisitor(ast.NodeVisitor):
     def visit_For(self, node):
         control_node = ControlNode(ControlNode.Label.FOR, node, self.control_branch_stack)
         control_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS,
-                                  [[node.first_token.startpos, node.first_token.endpos]])
+                                  [self.positions.get_first_token_interval(node)])
         fg = self._visit_simple_assign(node.target, node.iter, is_op_unmappable=True)
         fg.add_node(control_node, link_type=LinkType.CONDITION)
 
@@ -975,7 +1038,7 @@ class ASTVisitor(ast.NodeVisitor):
     def visit_While(self, node):
         control_node = ControlNode(ControlNode.Label.WHILE, node, self.control_branch_stack)
         control_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS,
-                                  [[node.first_token.startpos, node.first_token.endpos]])
+                                  [self.positions.get_first_token_interval(node)])
         fg = self.visit(node.test)
         fg.add_node(control_node, link_type=LinkType.CONDITION)
 
@@ -988,7 +1051,7 @@ class ASTVisitor(ast.NodeVisitor):
     def visit_Try(self, node):
         control_node = ControlNode(ControlNode.Label.TRY, node, self.control_branch_stack)
         control_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS,
-                                  [[node.first_token.startpos, node.first_token.endpos]])
+                                  [self.positions.get_first_token_interval(node)])
 
         fg = self.create_graph()
         fg.add_node(control_node, link_type=LinkType.CONDITION)
@@ -1012,7 +1075,7 @@ class ASTVisitor(ast.NodeVisitor):
     def visit_ExceptHandler(self, node):
         control_node = ControlNode(ControlNode.Label.EXCEPT, node, self.control_branch_stack)
         control_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS,
-                                  [[node.first_token.startpos, node.first_token.endpos]])
+                                  [self.positions.get_first_token_interval(node)])
 
         fg = self.visit(node.type) if node.type else self.create_graph()
         fg.add_node(control_node, link_type=LinkType.PARAMETER)
@@ -1023,7 +1086,7 @@ class ASTVisitor(ast.NodeVisitor):
     def visit_Assert(self, node):
         control_node = ControlNode(ControlNode.Label.ASSERT, node, self.control_branch_stack)
         control_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS,
-                                  [[node.first_token.startpos, node.first_token.endpos]])
+                                  [self.positions.get_first_token_interval(node)])
         fg = self.visit(node.test)
         fg.add_node(control_node, link_type=LinkType.CONDITION)
 
@@ -1040,20 +1103,9 @@ class ASTVisitor(ast.NodeVisitor):
         fg = self.create_graph()
         fg.add_node(EmptyNode(self.control_branch_stack))
         for st in statements:
-            try:
-                st_fg = self.visit(st)
-                logger.info(f"Successfully proceed expr = {st} line = {st.first_token.line}")
-            except:
-                st_fg = None
-
-            if not st_fg:
-                err_msg = f'Unable to build pfg for expr = {st}, line = {st.first_token.line} skipping...'
-                if isinstance(st, ast.Assign):
-                    err_msg += f'Assign error: targets = {st.targets}, values = {st.value}'
-                logger.error(err_msg, exc_info=True)
-                continue
-
-            fg.merge_graph(st_fg)
+            st_fg = self._visit_statement(st)
+            if st_fg:
+                fg.merge_graph(st_fg)
         self._pop_control_branch()
         return fg
 
@@ -1082,7 +1134,7 @@ class ASTVisitor(ast.NodeVisitor):
 
         op_node = OperationNode(label, node, self.control_branch_stack, kind=kind)
         op_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [
-            [node.first_token.startpos, node.first_token.endpos]])
+            self.positions.get_first_token_interval(node)])
 
         g.add_node(op_node, link_type=LinkType.PARAMETER)
 
@@ -1128,8 +1180,8 @@ class ASTVisitor(ast.NodeVisitor):
         for i, cmp in enumerate(node.comparators):
             op_node = OperationNode(node.ops[i].__class__.__name__, node, self.control_branch_stack,
                                     kind=OperationNode.Kind.COMPARE)
-            syntax_left = last_ast.last_token.endpos
-            syntax_right = cmp.first_token.startpos
+            syntax_left = self.positions.end(last_ast)
+            syntax_right = self.positions.start(cmp)
             op_node.set_property(Node.Property.SYNTAX_TOKEN_INTERVALS, [[syntax_left, syntax_right]])
             right_fg = self.visit(cmp)
 
@@ -1145,22 +1197,29 @@ class ASTVisitor(ast.NodeVisitor):
         return g
 
 
+ASTVisitor._dispatch_table = ASTVisitor._build_dispatch_table()
+
+
 class ASTVisitorDebug(ASTVisitor):
 
     def visit(self, node):
         """Visit a node."""
-        method = 'visit_' + node.__class__.__name__
-        visitor = getattr(self, method, self.generic_visit)
-        line_to_log = node.first_token.line
+        method = self._get_visit_method(node)
+        if method is None and self.strict:
+            raise GraphBuildingException(f'Unsupported node = {node}')
+        visitor = functools.partial(method, self) if method is not None else self.generic_visit
+        line_to_log = self.positions.line(node)
         if hasattr(node, 'body') and isinstance(node.body, list):
             for expr in node.body:
-                line_to_log += expr.first_token.line
+                line_to_log += self.positions.line(expr)
         try:
             result = visitor(node)
             logger.debug(f"Successfully visited node = {node}, line = {line_to_log}")
             return result
         except:
             logger.error(f"Failed visited node = {node}, line = {line_to_log}")
+            if self.strict:
+                raise
             return None
 
 
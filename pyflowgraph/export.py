@@ -0,0 +1,39 @@
+from pyflowgraph.models import ExtControlFlowGraph, DataNode, OperationNode, ControlNode, ControlEdge, EntryNode
+
+
+def _get_node_type(node):
+    if isinstance(node, EntryNode):
+        return 'entry'
+    elif isinstance(node, ControlNode):
+        return 'control'
+    elif isinstance(node, OperationNode):
+        return 'operation'
+    elif isinstance(node, DataNode):
+        return 'data'
+    return 'empty'
+
+
+def convert_to_dict(graph: ExtControlFlowGraph, show_data_keys=False):
+    """
+    Headless counterpart of export_graph_image, the result is JSON-serializable.
+    Nodes are referenced by their statement_num, edges are [from, to, label] or
+    [from, to, 'control', branch_kind] for control edges
+    """
+    nodes = []
+    edges = []
+    for node in sorted(graph.nodes, key=lambda n: n.statement_num):
+        item = {'id': node.statement_num, 'label': node.label, 'type': _get_node_type(node)}
+        kind = getattr(node, 'kind', None)
+        if kind is not None:
+            item['kind'] = kind
+        if show_data_keys and isinstance(node, DataNode):
+            item['key'] = node.key
+        nodes.append(item)
+
+        for e in sorted(node.out_edges, key=lambda e: (e.node_to.statement_num, e.label)):
+            edge = [e.node_from.statement_num, e.node_to.statement_num, e.label]
+            if isinstance(e, ControlEdge):
+                edge.append(e.branch_kind)
+            edges.append(edge)
+
+    return {'nodes': nodes, 'edges': edges}
@@ -266,6 +266,7 @@ class LinkType:
 class ExtControlFlowGraph:
     def __init__(self, visitor, /, *, node=None):
         self.visitor = visitor
+        self.source = None
 
         self.entry_node = None
         self.nodes: Set[Node] = set()
@@ -412,8 +413,10 @@ class ExtControlFlowGraph:
         from changegraph.gumtree import GumTree
         logger.info('Trying to stick pfg to gumtree')
         self.gumtree = gt
-        with open(gt.source_path, 'r+') as f:
-            lr = vb_utils.LineReader(''.join(f.readlines()))
+        if self.source is None:
+            with open(gt.source_path, 'r+') as f:
+                self.source = vb_utils.SourceText(f.read())
+        lr = self.source
 
         for node in self.nodes:
             if node.get_property(Node.Property.UNMAPPABLE):
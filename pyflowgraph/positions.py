@@ -0,0 +1,111 @@
+import ast
+
+from asttokens import asttokens
+
+from vb_utils import SourceText
+
+_DECORATED_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+
+class TokenPositions:
+    """
+    Provides source positions of ast nodes without marking the whole tree with asttokens.
+
+    Node boundaries come from the native ast offsets (lineno/col_offset/end_lineno/end_col_offset),
+    the source is tokenized only when a token-level boundary is requested for the first time.
+    Positions are character offsets into the source, the same as asttokens' startpos/endpos.
+    """
+
+    def __init__(self, source: SourceText):
+        self.source = source
+        self._tokens = None
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = asttokens.ASTTokens(self.source.text)
+        return self._tokens
+
+    def start(self, node):
+        first_token = getattr(node, 'first_token', None)
+        if first_token is not None:
+            return first_token.startpos
+
+        if isinstance(node, ast.Module):
+            return self.tokens.tokens[0].startpos if self.tokens.tokens else 0
+        if isinstance(node, _DECORATED_NODES) and node.decorator_list:
+            return self._get_prev_token(node.decorator_list[0]).startpos  # @
+        if isinstance(node, ast.comprehension):
+            return self._get_prev_token(node.target).startpos  # for
+        if getattr(node, 'col_offset', None) is None:
+            return min(self.start(child) for child in self._get_positioned_children(node))
+        return self.source.get_offset(node.lineno, node.col_offset)
+
+    def end(self, node):
+        last_token = getattr(node, 'last_token', None)
+        if last_token is not None:
+            return last_token.endpos
+
+        if isinstance(node, ast.Slice):  # the trailing colon of a slice does not belong to it
+            start_token = self.tokens.get_token_from_offset(self.start(node))
+            return max([start_token.endpos] + [self.end(child) for child in ast.iter_child_nodes(node)])
+        if getattr(node, 'end_col_offset', None) is None:
+            return max(self.end(child) for child in self._get_positioned_children(node))
+        return self.source.get_offset(node.end_lineno, node.end_col_offset)
+
+    def _get_prev_token(self, node):
+        return self.tokens.prev_token(self.tokens.get_token_from_offset(self.start(node)))
+
+    @staticmethod
+    def _get_positioned_children(node):
+        children = list(_iter_positioned_children(node))
+        if not children:
+            raise ValueError(f'Unable to find position of node = {node}')
+        return children
+
+    def first_token(self, node):
+        first_token = getattr(node, 'first_token', None)
+        if first_token is not None:
+            return first_token
+        return self.tokens.get_token_from_offset(self.start(node))
+
+    def last_token(self, node):
+        last_token = getattr(node, 'last_token', None)
+        if last_token is not None:
+            return last_token
+        return self.tokens.get_token_from_offset(self.end(node) - 1)
+
+    def get_first_token_interval(self, node):
+        first_token = self.first_token(node)
+        return [first_token.startpos, first_token.endpos]
+
+    def get_last_token_interval(self, node):
+        last_token = self.last_token(node)
+        return [last_token.startpos, last_token.endpos]
+
+    def get_inner_interval(self, node):
+        return [self.first_token(node).endpos, self.last_token(node).startpos]
+
+    def line(self, node):
+        lineno = getattr(node, 'lineno', None)
+        if lineno is None:
+            return self.first_token(node).line
+        return self.source.get_line(lineno)
+
+    def mark(self, node):
+        """
+        Sets asttokens' first_token and last_token attributes on a single node,
+        the attributes are kept in pickled graphs and used to map the node to GumTree and markup.
+        """
+        if getattr(node, 'first_token', None) is None:
+            node.first_token = self.first_token(node)
+        if getattr(node, 'last_token', None) is None:
+            node.last_token = self.last_token(node)
+
+
+def _iter_positioned_children(node):
+    for child in ast.iter_child_nodes(node):
+        if getattr(child, 'col_offset', None) is not None or isinstance(child, ast.comprehension):
+            yield child
+        else:
+            yield from _iter_positioned_children(child)
@@ -0,0 +1,7 @@
+from .change_graphs import encode_change_graph, decode_change_graph, store_change_graphs, \
+    store_encoded_change_graphs, load_change_graphs
+from .blobs import BlobStore
+from .index import load_index
+from .reader import ChangeGraphStore
+from .seeds import load_seeds
+from .catalog import Catalog
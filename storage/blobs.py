@@ -0,0 +1,64 @@
+import hashlib
+import os
+import tempfile
+import weakref
+
+from vb_utils import SourceText
+
+BLOBS_DIR_NAME = 'blobs'
+
+
+class BlobStore:
+    """
+    Content-addressed store of file sources, every source is written once under the hash of its text.
+    Loaded sources are shared while anything references them
+    """
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self._sources = weakref.WeakValueDictionary()
+
+    def __getstate__(self):
+        return {'root_dir': self.root_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['root_dir'])
+
+    @classmethod
+    def for_storage_dir(cls, storage_dir):
+        return cls(os.path.join(storage_dir, BLOBS_DIR_NAME))
+
+    @staticmethod
+    def get_key(text):
+        return hashlib.sha1(text.encode('utf8', errors='surrogatepass')).hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.root_dir, key[:2], key)
+
+    def put(self, text):
+        key = self.get_key(text)
+        path = self._get_path(key)
+        if os.path.exists(path):
+            return key
+
+        dir_path = os.path.dirname(path)
+        os.makedirs(dir_path, exist_ok=True)
+
+        # other processes may write the same blob, the content is the same so the last rename wins
+        fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(text.encode('utf8', errors='surrogatepass'))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return key
+
+    def get_source(self, key):
+        source = self._sources.get(key)
+        if source is None:
+            with open(self._get_path(key), 'rb') as f:
+                source = SourceText(f.read().decode('utf8', errors='surrogatepass'))
+            self._sources[key] = source
+        return source
@@ -0,0 +1,141 @@
+"""
+SQLite catalog of the change graphs storage, a row of metadata per stored graph.
+
+The patterns mode evaluates the filter expressions against the catalog and decodes only the selected graphs.
+A filter expression is `<column><operator><value>`, the operators are =, !=, <, <=, >, >= and ~ for glob matching,
+e.g. `repo_name=requests`, `commit_dtm>=2020-01-01` or `new_file_path~*tests/*`.
+"""
+import datetime
+import os
+import re
+import sqlite3
+
+from log import logger
+
+CATALOG_FILE_NAME = 'catalog.sqlite'
+
+COLUMNS = [
+    'repo_name', 'repo_url', 'commit_hash', 'commit_dtm', 'author_name', 'author_email',
+    'old_file_path', 'new_file_path', 'old_method', 'new_method', 'node_count', 'segment', 'offset', 'length'
+]
+_INTEGER_COLUMNS = {'node_count', 'offset', 'length'}
+_COLUMN_LIST = ', '.join(f'"{column}"' for column in COLUMNS)
+
+_FILTER_RE = re.compile(r'^\s*(\w+)\s*(<=|>=|!=|=|<|>|~)\s*(.*?)\s*$')
+_FILTER_OPERATORS = {'=': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>=', '~': 'GLOB'}
+
+
+class CatalogFilterException(Exception):
+    pass
+
+
+def _format_dtm(dtm):
+    if dtm is None:
+        return None
+    if dtm.tzinfo is not None:
+        dtm = dtm.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dtm.isoformat(sep=' ')  # comparable as a string with the dates in the filters
+
+
+def create_catalog_record(graph):
+    repo_info = graph.repo_info
+    record = {'node_count': len(graph.nodes)}
+    if repo_info is None:
+        return record
+
+    record.update({
+        'repo_name': repo_info.repo_name,
+        'repo_url': repo_info.repo_url,
+        'commit_hash': repo_info.commit_hash,
+        'commit_dtm': _format_dtm(repo_info.commit_dtm),
+        'author_name': repo_info.author_name,
+        'author_email': repo_info.author_email,
+        'old_file_path': repo_info.old_file_path,
+        'new_file_path': repo_info.new_file_path,
+        'old_method': repo_info.old_method.full_name if repo_info.old_method else None,
+        'new_method': repo_info.new_method.full_name if repo_info.new_method else None
+    })
+    return record
+
+
+def parse_filter(expression):
+    """
+    Converts a filter expression to an SQL condition and its parameter
+    """
+    match = _FILTER_RE.match(expression)
+    if not match:
+        raise CatalogFilterException(f'Incorrect filter {expression}, expected <column><operator><value>')
+
+    column, operator, value = match.groups()
+    if column not in COLUMNS:
+        raise CatalogFilterException(f'Unknown column {column} in filter {expression}, expected one of {COLUMNS}')
+
+    if column in _INTEGER_COLUMNS:
+        try:
+            value = int(value)
+        except ValueError:
+            raise CatalogFilterException(f'Column {column} expects an integer in filter {expression}')
+    return f'"{column}" {_FILTER_OPERATORS[operator]} ?', value
+
+
+class Catalog:
+    def __init__(self, storage_dir):
+        self.file_path = os.path.join(storage_dir, CATALOG_FILE_NAME)
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.file_path, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL')  # the workers write concurrently
+            columns = ', '.join(f'"{column}" {"INTEGER" if column in _INTEGER_COLUMNS else "TEXT"}'
+                                for column in COLUMNS)
+            self._connection.execute(f'CREATE TABLE IF NOT EXISTS change_graphs '
+                                     f'(graph_id INTEGER PRIMARY KEY, {columns})')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS change_graphs_commit_dtm '
+                                     'ON change_graphs (commit_dtm)')
+        return self._connection
+
+    def exists(self):
+        return os.path.exists(self.file_path)
+
+    def add(self, graph_id_to_record):
+        """
+        Adds the rows of [(graph id, record)], the record is a dict of the column values
+        """
+        rows = [[graph_id] + [record.get(column) for column in COLUMNS] for graph_id, record in graph_id_to_record]
+        if not rows:
+            return
+
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                f'INSERT OR REPLACE INTO change_graphs (graph_id, {_COLUMN_LIST}) '
+                f'VALUES ({", ".join(["?"] * (len(COLUMNS) + 1))})', rows)
+
+    def select_graph_ids(self, filters=None, min_date=None):
+        """
+        Returns the set of ids of the graphs matching all the filter expressions and committed since min_date,
+        the graphs without a commit date are kept by min_date
+        """
+        conditions, params = [], []
+        for expression in filters or []:
+            condition, param = parse_filter(expression)
+            conditions.append(condition)
+            params.append(param)
+        if min_date:
+            conditions.append('("commit_dtm" IS NULL OR "commit_dtm" >= ?)')
+            params.append(_format_dtm(min_date))
+
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        cursor = self._connect().execute(f'SELECT graph_id FROM change_graphs{where}', params)
+        graph_ids = {row[0] for row in cursor}
+        logger.info(f'Selected {len(graph_ids)} graphs from the catalog{where}')
+        return graph_ids
+
+    def get_graph_ids(self):
+        return {row[0] for row in self._connect().execute('SELECT graph_id FROM change_graphs')}
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,146 @@
+import collections
+import os
+import pickle
+
+import settings
+from changegraph import serialization
+from log import logger
+from storage.blobs import BlobStore
+from storage.catalog import Catalog, create_catalog_record
+from storage.seeds import append_seeds, create_seeds_record
+from storage.segments import Codec, SegmentWriter, is_segment, read_records
+
+STORAGE_DIR = settings.get('change_graphs_storage_dir')
+STORE_AST = settings.get('change_graphs_store_ast', True)
+SEGMENT_MAX_SIZE = settings.get('change_graphs_segment_max_size', 256 * 1024 * 1024)
+COMPRESSION = Codec.from_name(settings.get('change_graphs_compression', 'none'))
+
+_segment_writers = {}  # (pid, storage dir) -> SegmentWriter, forked workers never share a parent's writer
+
+EncodedChangeGraph = collections.namedtuple('EncodedChangeGraph',
+                                            ['graph_id', 'data', 'seeds_record', 'catalog_record'])
+
+
+def _store_sources(graph, blob_store):
+    repo_info = graph.repo_info
+    if repo_info is None:
+        return
+
+    for method in [repo_info.old_method, repo_info.new_method]:
+        if method is not None and method.source is not None:
+            method.store_source(blob_store)
+
+
+def encode_change_graph(graph, storage_dir=None):
+    """
+    Encodes a graph for the storage, the file sources of its methods go to the blob store of the storage directory
+    """
+    try:
+        _store_sources(graph, BlobStore.for_storage_dir(storage_dir or STORAGE_DIR))
+        return EncodedChangeGraph(graph.id, serialization.encode(graph, keep_ast=STORE_AST),
+                                  create_seeds_record(graph), create_catalog_record(graph))
+    except RecursionError:
+        repo_info = graph.repo_info
+        if repo_info is not None and repo_info.old_method is not None:
+            logger.error(f'Unable to encode graph, file_path={repo_info.old_method.file_path}, '
+                         f'method={repo_info.old_method.full_name}', exc_info=True)
+        else:
+            logger.error(f'Unable to encode graph {graph}', exc_info=True)
+        return None
+
+
+def _get_segment_writer(storage_dir):
+    key = (os.getpid(), storage_dir)
+    writer = _segment_writers.get(key)
+    if writer is None:
+        writer = SegmentWriter(storage_dir, SEGMENT_MAX_SIZE, codec=COMPRESSION)
+        _segment_writers[key] = writer
+    return writer
+
+
+def store_encoded_change_graphs(encoded_graphs, storage_dir=None):
+    """
+    Appends already encoded graphs to the segment of the current process in the storage directory
+    and their seeds to the seed sidecar of the segment, then adds them to the catalog of the storage directory.
+    Returns the path of the segment the last graph was written to
+    """
+    storage_dir = storage_dir or STORAGE_DIR
+    writer = _get_segment_writer(storage_dir)
+
+    file_path = None
+    file_path_to_seeds = {}
+    catalog_records = []
+    for encoded in encoded_graphs:
+        graph_id = encoded.graph_id
+        file_path, offset, length = writer.append(encoded.data, graph_id)
+        file_path_to_seeds.setdefault(file_path, []).append((graph_id, encoded.seeds_record))
+        catalog_records.append((graph_id, {**encoded.catalog_record, 'segment': os.path.basename(file_path),
+                                           'offset': offset, 'length': length}))
+    writer.flush()
+
+    for segment_path, seeds in file_path_to_seeds.items():
+        append_seeds(segment_path, seeds)
+
+    catalog = Catalog(storage_dir)
+    try:
+        catalog.add(catalog_records)
+    finally:
+        catalog.close()
+
+    logger.info(f'Stored {len(encoded_graphs)} graphs to {file_path}', show_pid=True)
+    return file_path
+
+
+def store_change_graphs(graphs, storage_dir=None):
+    encoded_graphs = []
+    for graph in graphs:
+        encoded = encode_change_graph(graph, storage_dir=storage_dir)
+        if encoded is not None:
+            encoded_graphs.append(encoded)
+    return store_encoded_change_graphs(encoded_graphs, storage_dir=storage_dir)
+
+
+def decode_change_graph(data):
+    if serialization.is_encoded(data):
+        return serialization.decode(data)
+    graph = pickle.loads(data)  # graphs stored before the flat format
+    graph.renumber_nodes()
+    graph.freeze()
+    return graph
+
+
+def attach_blob_store(graph, blob_store):
+    repo_info = graph.repo_info
+    if repo_info is None:
+        return
+
+    for method in [repo_info.old_method, repo_info.new_method]:
+        if method is not None:
+            method.set_blob_store(blob_store)
+
+
+def _read_encoded_change_graphs(file_path):
+    if is_segment(file_path):
+        yield from read_records(file_path)
+        return
+
+    with open(file_path, 'rb') as f:  # files stored before the segments, a pickled list of graphs
+        yield from pickle.load(f)
+
+
+def load_change_graphs(file_path):
+    """
+    Loads the graphs of a storage file, the graphs that are unable to be decoded are skipped one by one
+    """
+    blob_store = BlobStore.for_storage_dir(os.path.dirname(file_path))
+
+    graphs = []
+    for data in _read_encoded_change_graphs(file_path):
+        try:
+            graph = decode_change_graph(data)
+        except Exception:
+            logger.warning(f'Unable to decode a graph from {file_path}', exc_info=True)
+            continue
+        attach_blob_store(graph, blob_store)
+        graphs.append(graph)
+    return graphs
@@ -0,0 +1,62 @@
+"""
+Index of the change graphs storage directory: graph id -> (segment file name, record offset, record length).
+
+The index is made of the sidecars the segment writers keep next to their segments. A sidecar may lag behind
+its segment after a crash or be missing for segments written without one, the records past the last indexed one
+are then found by scanning the segment and get ids derived from their position.
+"""
+import hashlib
+import os
+
+from log import logger
+from storage.segments import INDEX_ENTRY, SEGMENT_EXTENSION, get_index_path, scan_records
+
+
+def get_derived_graph_id(file_name, offset):
+    digest = hashlib.blake2b(f'{file_name}:{offset}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') >> 1
+
+
+def _read_index_entries(index_path):
+    if not os.path.exists(index_path):
+        return []
+
+    with open(index_path, 'rb') as f:
+        data = f.read()
+
+    entry_cnt = len(data) // INDEX_ENTRY.size  # a partially written trailing entry is ignored
+    return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(entry_cnt)]
+
+
+def load_segment_index(segment_path):
+    """
+    Returns [(graph id, offset, record length)] of the segment records
+    """
+    segment_size = os.path.getsize(segment_path)
+    entries = [entry for entry in _read_index_entries(get_index_path(segment_path))
+               if entry[1] + entry[2] <= segment_size]
+
+    indexed_end = max((offset + length for _, offset, length in entries), default=0)
+    if indexed_end < segment_size:
+        logger.warning(f'Scanning the records of {segment_path} past the indexed offset {indexed_end}')
+        file_name = os.path.basename(segment_path)
+        with open(segment_path, 'rb') as f:
+            data = f.read()
+
+        for offset, length, _ in scan_records(data, segment_path, start=indexed_end):
+            entries.append((get_derived_graph_id(file_name, offset), offset, length))
+    return entries
+
+
+def load_index(storage_dir):
+    """
+    Returns {graph id: (segment file name, offset, record length)} of all the segments in the directory
+    """
+    index = {}
+    for file_name in sorted(os.listdir(storage_dir)):
+        if not file_name.endswith(SEGMENT_EXTENSION):
+            continue
+
+        for graph_id, offset, length in load_segment_index(os.path.join(storage_dir, file_name)):
+            index[graph_id] = (file_name, offset, length)
+    return index
@@ -0,0 +1,192 @@
+"""
+Parallel loading of the change graphs store for the miner.
+
+Worker processes read the records of graph id chunks from the memory-mapped segments, verify and decompress them,
+and strip the node and method asts the miner does not use, so only the flat tables and the positions are left.
+The graphs of the legacy files are converted to the same format. The main process only decodes these payloads,
+which takes about half the time of decoding the stored ones with asts, and the graphs are never pickled
+through the pipes. At most two chunks per worker are in flight, which bounds the memory used by the loaded
+but not yet consumed graphs.
+
+With a single process the stored payloads are decoded in the main process as they are, stripping them there
+would only add to the decoding.
+"""
+import collections
+import multiprocessing
+import pickle
+import sys
+import time
+
+import settings
+from changegraph import serialization
+from log import logger
+from storage.change_graphs import attach_blob_store, decode_change_graph
+from storage.segments import CorruptRecordException
+
+PROCESSES = settings.get('patterns_loader_processes', 0) or multiprocessing.cpu_count()
+CHUNK_SIZE = settings.get('patterns_loader_chunk_size', 256)
+PROGRESS_INTERVAL = 10  # seconds
+
+_worker_store = None
+
+
+class LoadStats:
+    def __init__(self, total_cnt):
+        self.total_cnt = total_cnt
+        self.loaded_cnt = 0
+        self.reason_to_skipped_cnt = collections.Counter()
+
+        self._start = time.time()
+        self._last_report = self._start
+
+    @property
+    def skipped_cnt(self):
+        return sum(self.reason_to_skipped_cnt.values())
+
+    def skip(self, reason, cnt=1):
+        self.reason_to_skipped_cnt[reason] += cnt
+
+    def _get_summary(self):
+        elapsed = max(time.time() - self._start, 1e-9)
+        return f'{self.loaded_cnt} graphs loaded, {self.skipped_cnt} skipped, ' \
+               f'{self.loaded_cnt / elapsed:.1f} graphs/s'
+
+    def report_progress(self):
+        if time.time() - self._last_report < PROGRESS_INTERVAL:
+            return
+        self._last_report = time.time()
+        logger.warning(f'Loading [{self.loaded_cnt + self.skipped_cnt}/{self.total_cnt}]: {self._get_summary()}')
+
+    def report_summary(self):
+        logger.warning(f'Done loading: {self._get_summary()}', start_time=self._start)
+        for reason, cnt in self.reason_to_skipped_cnt.most_common():
+            logger.warning(f'Skipped {cnt} graphs: {reason}')
+
+
+def _get_error_reason(prefix, e):
+    return f'{prefix} ({type(e).__name__})'
+
+
+def _strip_asts(data):
+    if serialization.is_encoded(data):
+        return serialization.strip_asts(data)
+    return serialization.encode(decode_change_graph(data), keep_ast=False)  # graphs stored before the flat format
+
+
+def _get_payload(data, strip_asts, reason):
+    if not strip_asts:
+        return data, None
+
+    try:
+        return _strip_asts(data), None
+    except Exception as e:
+        return None, _get_error_reason(reason, e)
+
+
+def _read_payloads(store, graph_ids, strip_asts):
+    """
+    Returns [(payload, skip reason)] of the graphs, the payload is None for the skipped ones
+    """
+    results = []
+    for graph_id in graph_ids:
+        try:
+            data = store.read_encoded_change_graph(graph_id)
+        except CorruptRecordException as e:
+            results.append((None, _get_error_reason('corrupt record', e)))
+        except OSError as e:
+            results.append((None, _get_error_reason('unreadable segment', e)))
+        except KeyError as e:
+            results.append((None, _get_error_reason('unknown graph id', e)))
+        else:
+            results.append(_get_payload(data, strip_asts, 'undecodable graph'))
+    return results
+
+
+def _read_legacy_payloads(file_path, strip_asts):
+    try:
+        with open(file_path, 'rb') as f:
+            encoded_graphs = pickle.load(f)
+    except Exception as e:
+        return [(None, _get_error_reason(f'unreadable legacy file {file_path}', e))]
+
+    return [_get_payload(data, strip_asts, 'undecodable legacy graph') for data in encoded_graphs]
+
+
+def _init_worker(store):
+    global _worker_store
+    _worker_store = store
+    sys.setrecursionlimit(2 ** 31 - 1)  # legacy graphs are unpickled recursively
+
+
+def _read_chunk(graph_ids):
+    return _read_payloads(_worker_store, graph_ids, strip_asts=True)
+
+
+def _read_legacy_file(file_path):
+    return _read_legacy_payloads(file_path, strip_asts=True)
+
+
+def _collect(results, stats, blob_store):
+    for payload, reason in results:
+        if payload is None:
+            stats.skip(reason)
+            continue
+
+        try:
+            graph = decode_change_graph(payload)
+        except Exception as e:
+            stats.skip(_get_error_reason('undecodable graph', e))
+            continue
+
+        attach_blob_store(graph, blob_store)
+        stats.loaded_cnt += 1
+        yield graph
+    stats.report_progress()
+
+
+def _collect_async(task, stats, blob_store):
+    fn, arg, async_result = task
+    try:
+        results = async_result.get()
+    except Exception as e:
+        stats.skip(_get_error_reason('worker failure', e), len(arg) if fn is _read_chunk else 1)
+        return
+
+    yield from _collect(results, stats, blob_store)
+
+
+def iter_change_graphs(store, graph_ids=None, with_legacy_files=True, processes=None, chunk_size=None):
+    """
+    Streams the graphs of the store in the order of graph_ids followed by the graphs of the legacy files.
+    The graphs are loaded without the asts with more than one process, see the module docstring.
+    Progress with the throughput and the number of skipped graphs by reason are logged
+    """
+    graph_ids = store.graph_ids if graph_ids is None else graph_ids
+    legacy_file_paths = store.legacy_file_paths if with_legacy_files else []
+    processes = processes or PROCESSES
+    chunk_size = chunk_size or CHUNK_SIZE
+    chunks = [graph_ids[i:i + chunk_size] for i in range(0, len(graph_ids), chunk_size)]
+    logger.warning(f'Loading {len(graph_ids)} graphs and {len(legacy_file_paths)} legacy files '
+                   f'with {processes} processes')
+
+    stats = LoadStats(len(graph_ids))
+    if processes == 1:
+        for chunk in chunks:
+            yield from _collect(_read_payloads(store, chunk, strip_asts=False), stats, store.blob_store)
+        for file_path in legacy_file_paths:
+            yield from _collect(_read_legacy_payloads(file_path, strip_asts=False), stats, store.blob_store)
+        stats.report_summary()
+        return
+
+    tasks = [(_read_chunk, chunk) for chunk in chunks] + [(_read_legacy_file, path) for path in legacy_file_paths]
+    pending = collections.deque()
+    with multiprocessing.Pool(processes=processes, initializer=_init_worker, initargs=(store,)) as pool:
+        for fn, arg in tasks:
+            pending.append((fn, arg, pool.apply_async(fn, (arg,))))
+            if len(pending) >= 2 * processes:
+                yield from _collect_async(pending.popleft(), stats, store.blob_store)
+
+        while pending:
+            yield from _collect_async(pending.popleft(), stats, store.blob_store)
+
+    stats.report_summary()
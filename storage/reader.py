@@ -0,0 +1,139 @@
+import mmap
+import os
+
+from log import logger
+from storage.blobs import BlobStore
+from storage.catalog import Catalog, CatalogFilterException
+from storage.change_graphs import STORAGE_DIR, attach_blob_store, decode_change_graph, load_change_graphs
+from storage.index import load_index
+from storage.seeds import load_seeds
+from storage.segments import read_record
+
+
+class ChangeGraphStore:
+    """
+    Random access to the change graphs of a storage directory by graph id.
+    The segments are memory-mapped and a graph is decoded only when it is requested. The store is pickled
+    as its directory and index, so worker processes map the same files and share their pages
+    instead of receiving the graphs through pipes
+    """
+    def __init__(self, storage_dir=None, index=None):
+        self.storage_dir = storage_dir or STORAGE_DIR
+        self.index = index if index is not None else load_index(self.storage_dir)
+        self.blob_store = BlobStore.for_storage_dir(self.storage_dir)
+
+        self._mmaps = {}
+
+    def __getstate__(self):
+        return {'storage_dir': self.storage_dir, 'index': self.index}
+
+    def __setstate__(self, state):
+        self.__init__(state['storage_dir'], index=state['index'])
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def graph_ids(self):
+        return list(self.index.keys())
+
+    @property
+    def legacy_file_paths(self):
+        """
+        Files stored before the segments, they are not indexed and are only read as a whole
+        """
+        return [os.path.join(self.storage_dir, file_name) for file_name in sorted(os.listdir(self.storage_dir))
+                if file_name.endswith('.pickle')]
+
+    def _get_buffer(self, file_name):
+        buffer = self._mmaps.get(file_name)
+        if buffer is None:
+            with open(os.path.join(self.storage_dir, file_name), 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmaps[file_name] = buffer
+        return buffer
+
+    def read_encoded_change_graph(self, graph_id):
+        file_name, offset, _ = self.index[graph_id]
+        return read_record(self._get_buffer(file_name), offset)
+
+    def get_change_graph(self, graph_id):
+        graph = decode_change_graph(self.read_encoded_change_graph(graph_id))
+        attach_blob_store(graph, self.blob_store)
+        return graph
+
+    def select_graph_ids(self, filters=None, min_date=None):
+        """
+        Returns the ids of the graphs matching the catalog filter expressions and committed since min_date.
+        Only min_date applies to the graphs missing from the catalog, the miner checks it again after loading
+        """
+        catalog = Catalog(self.storage_dir)
+        if not catalog.exists():
+            if filters:
+                raise CatalogFilterException(f'No catalog was found in {self.storage_dir}, unable to apply filters')
+            return self.graph_ids
+
+        try:
+            selected_ids = catalog.select_graph_ids(filters, min_date=min_date)
+            uncataloged_ids = self.index.keys() - catalog.get_graph_ids()
+        finally:
+            catalog.close()
+
+        if uncataloged_ids:
+            logger.warning(f'Found {len(uncataloged_ids)} graphs missing from the catalog'
+                           + (', they are skipped' if filters else ''))
+        return [graph_id for graph_id in self.index.keys()
+                if graph_id in selected_ids or (not filters and graph_id in uncataloged_ids)]
+
+    def get_seeded_graph_ids(self, min_frequency, min_date=None, graph_ids=None):
+        """
+        Returns the ids of the graphs containing a seed key with at least min_frequency node pairs in all the graphs
+        committed since min_date or without a commit date, out of graph_ids or all the graphs. The seeds are counted
+        from the seed sidecars only, without decoding any graph. If some graphs have no seeds record,
+        their seeds are unknown and all the given graph ids are returned
+        """
+        graph_ids = self.graph_ids if graph_ids is None else graph_ids
+        graph_seeds = load_seeds(self.storage_dir)
+        unseeded_cnt = sum(1 for graph_id in graph_ids if graph_id not in graph_seeds)
+        if unseeded_cnt:
+            logger.warning(f'Found {unseeded_cnt} graphs without seeds records, all the graphs will be loaded')
+            return graph_ids
+
+        recent_seeds = {graph_id: counts for graph_id, (dtm, counts) in
+                        ((graph_id, graph_seeds[graph_id]) for graph_id in graph_ids)
+                        if not (min_date and dtm and dtm < min_date)}
+
+        seed_counts = {}
+        for counts in recent_seeds.values():
+            for key, cnt in counts.items():
+                seed_counts[key] = seed_counts.get(key, 0) + cnt
+        frequent_seeds = {key for key, cnt in seed_counts.items() if cnt >= min_frequency}
+
+        return [graph_id for graph_id in graph_ids
+                if any(key in frequent_seeds for key in recent_seeds.get(graph_id, ()))]
+
+    def iter_change_graphs(self, graph_ids=None, with_legacy_files=True):
+        """
+        Decodes the graphs one by one, all the indexed graphs if graph_ids is None.
+        The graphs that are unable to be read are logged and skipped
+        """
+        for graph_num, graph_id in enumerate(self.index.keys() if graph_ids is None else graph_ids):
+            try:
+                yield self.get_change_graph(graph_id)
+            except Exception:
+                logger.warning(f'Unable to load graph {graph_id}', exc_info=True)
+
+            if (1 + graph_num) % 10000 == 0:
+                logger.warning(f'Loaded {1 + graph_num} graphs')
+
+        if with_legacy_files:
+            for file_path in self.legacy_file_paths:
+                try:
+                    yield from load_change_graphs(file_path)
+                except Exception:
+                    logger.warning(f'Incorrect file {file_path}')
+
+    def close(self):
+        for buffer in self._mmaps.values():
+            buffer.close()
+        self._mmaps.clear()
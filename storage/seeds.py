@@ -0,0 +1,54 @@
+"""
+Seed sidecars of the change graphs storage.
+
+Next to every segment there is a JSON Lines file with a record per stored graph: its id, commit date
+and the number of node pairs per seed key (see ChangeNode.get_seed_key). The patterns mode counts the seeds
+from the sidecars alone and loads only the graphs that contain a frequent seed.
+"""
+import datetime
+import json
+import os
+
+from log import logger
+from storage.segments import SEGMENT_EXTENSION
+
+SEEDS_EXTENSION = '.cgseeds'
+
+
+def get_seeds_path(segment_path):
+    return segment_path[:-len(SEGMENT_EXTENSION)] + SEEDS_EXTENSION
+
+
+def create_seeds_record(graph):
+    commit_dtm = graph.repo_info.commit_dtm if graph.repo_info is not None else None
+    return {
+        'dtm': commit_dtm.isoformat() if commit_dtm else None,
+        'seeds': graph.get_seed_counts()
+    }
+
+
+def append_seeds(segment_path, graph_id_to_record):
+    with open(get_seeds_path(segment_path), 'a') as f:
+        for graph_id, record in graph_id_to_record:
+            f.write(json.dumps({'id': graph_id, **record}, separators=(',', ':')) + '\n')
+
+
+def load_seeds(storage_dir):
+    """
+    Returns {graph id: (commit date, {seed key: count})} of all the seed sidecars in the directory
+    """
+    result = {}
+    for file_name in sorted(os.listdir(storage_dir)):
+        if not file_name.endswith(SEEDS_EXTENSION):
+            continue
+
+        file_path = os.path.join(storage_dir, file_name)
+        with open(file_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    dtm = datetime.datetime.fromisoformat(record['dtm']) if record['dtm'] else None
+                    result[record['id']] = dtm, record['seeds']
+                except (ValueError, KeyError):
+                    logger.warning(f'Incorrect seeds record in {file_path}: {line.strip()}')
+    return result
@@ -0,0 +1,192 @@
+"""
+Append-only segment files of the change graphs storage.
+
+A segment is a sequence of records, each record is a header followed by its payload:
+magic, payload length, CRC32 of the payload and the codec the payload is compressed with.
+A worker appends to its own segment until it grows over the size limit and then starts a new one.
+A corrupt record is skipped on its own, the reader resynchronizes on the next record magic.
+Every segment has an index sidecar with a (graph id, offset, record length) entry per record, see storage.index.
+"""
+import lzma
+import mmap
+import os
+import struct
+import uuid
+import zlib
+
+from log import logger
+
+SEGMENT_EXTENSION = '.cgseg'
+INDEX_EXTENSION = '.cgidx'
+
+RECORD_MAGIC = b'CGRC'
+_RECORD_HEADER = struct.Struct('<4sIIB')  # magic, payload length, crc32, codec
+INDEX_ENTRY = struct.Struct('<qQI')  # graph id, record offset, record length
+
+
+class Codec:
+    NONE = 0
+    ZLIB = 1
+    LZMA = 2
+
+    _NAME_TO_CODEC = {'none': NONE, 'zlib': ZLIB, 'lzma': LZMA}
+
+    @classmethod
+    def from_name(cls, name):
+        codec = cls._NAME_TO_CODEC.get((name or 'none').lower())
+        if codec is None:
+            raise ValueError(f'Unknown compression {name}, expected one of {list(cls._NAME_TO_CODEC)}')
+        return codec
+
+    @classmethod
+    def compress(cls, codec, data):
+        if codec == cls.ZLIB:
+            return zlib.compress(data)
+        if codec == cls.LZMA:
+            return lzma.compress(data)
+        return data
+
+    @classmethod
+    def decompress(cls, codec, data):
+        if codec == cls.ZLIB:
+            return zlib.decompress(data)
+        if codec == cls.LZMA:
+            return lzma.decompress(data)
+        if codec == cls.NONE:
+            return data
+        raise ValueError(f'Unknown codec {codec}')
+
+
+def is_segment(file_path):
+    return file_path.endswith(SEGMENT_EXTENSION)
+
+
+def get_index_path(segment_path):
+    return segment_path[:-len(SEGMENT_EXTENSION)] + INDEX_EXTENSION
+
+
+class SegmentWriter:
+    def __init__(self, storage_dir, max_size, codec=Codec.NONE):
+        self.storage_dir = storage_dir
+        self.max_size = max_size
+        self.codec = codec
+
+        self.file_path = None
+        self._file = None
+        self._index_file = None
+
+    def _open_segment(self):
+        self.file_path = os.path.join(self.storage_dir, f'{uuid.uuid4().hex}{SEGMENT_EXTENSION}')
+        self._file = open(self.file_path, 'ab')
+        self._index_file = open(get_index_path(self.file_path), 'ab')
+        logger.info(f'Started segment {self.file_path}', show_pid=True)
+
+    def append(self, data, graph_id):
+        """
+        Appends a record and returns the path of the segment it was written to, the record offset and length
+        """
+        if self._file is None:
+            self._open_segment()
+
+        offset = self._file.tell()
+        payload = Codec.compress(self.codec, data)
+        self._file.write(_RECORD_HEADER.pack(RECORD_MAGIC, len(payload), zlib.crc32(payload), self.codec))
+        self._file.write(payload)
+        length = _RECORD_HEADER.size + len(payload)
+        self._index_file.write(INDEX_ENTRY.pack(graph_id, offset, length))
+
+        file_path = self.file_path
+        if self._file.tell() >= self.max_size:
+            self.close()
+        return file_path, offset, length
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+            self._index_file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._index_file.close()
+            self._file = None
+            self._index_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CorruptRecordException(Exception):
+    pass
+
+
+def read_record(buffer, offset):
+    """
+    Returns the payload of the record at the offset of a segment buffer, bytes or a memory map.
+    Uncompressed payloads are returned as memoryviews of the buffer, without copying
+    """
+    if len(buffer) - offset < _RECORD_HEADER.size:
+        raise CorruptRecordException(f'Truncated record header at offset {offset}')
+
+    magic, length, crc, codec = _RECORD_HEADER.unpack_from(buffer, offset)
+    if magic != RECORD_MAGIC:
+        raise CorruptRecordException(f'No record at offset {offset}')
+
+    payload_start = offset + _RECORD_HEADER.size
+    payload = memoryview(buffer)[payload_start:payload_start + length]
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        raise CorruptRecordException(f'Corrupt record at offset {offset}')
+
+    try:
+        return Codec.decompress(codec, payload)
+    except Exception as e:
+        raise CorruptRecordException(f'Unable to decompress record at offset {offset}') from e
+
+
+def scan_records(buffer, file_path, start=0):
+    """
+    Streams (offset, record length, payload) of the segment records from the start offset,
+    corrupt or truncated records are logged and skipped
+    """
+    pos = start
+    while pos < len(buffer):
+        if buffer[pos:pos + len(RECORD_MAGIC)] != RECORD_MAGIC:
+            next_pos = buffer.find(RECORD_MAGIC, pos + 1)
+            logger.warning(f'Skipped {(next_pos if next_pos != -1 else len(buffer)) - pos} unreadable bytes '
+                           f'at offset {pos} of {file_path}')
+            if next_pos == -1:
+                break
+            pos = next_pos
+
+        try:
+            payload = read_record(buffer, pos)
+        except CorruptRecordException as e:
+            logger.warning(f'{e} of {file_path}')
+            pos += 1  # the length may be corrupt as well, look for the next record magic
+            continue
+
+        length = _RECORD_HEADER.size + _RECORD_HEADER.unpack_from(buffer, pos)[1]
+        yield pos, length, payload
+        pos += length
+
+
+def read_records(file_path):
+    """
+    Streams the payloads of the segment records, corrupt or truncated records are logged and skipped.
+    The segment is memory-mapped, a payload is copied out of the map when it is yielded
+    """
+    if os.path.getsize(file_path) == 0:
+        return  # empty files can't be mapped
+
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        records = scan_records(buffer, file_path)
+        try:
+            for _, _, payload in records:
+                data = bytes(payload)  # the uncompressed payloads are views of the map
+                del payload
+                yield data
+        finally:
+            records.close()  # releases the views, the map can't be closed while they are exported
@@ -0,0 +1,194 @@
+import ast
+import os
+import pickle
+
+import pytest
+
+import storage
+from changegraph import serialization
+from changegraph.labels import LABELS
+from changegraph.models import ChangeGraph, ChangeNode, ChangeEdge
+from pyflowgraph.models import LinkType
+from vb_utils import NodePosition, SourceText
+from vcs.traverse import Method, RepoInfo
+
+
+def _build_graph():
+    cg = ChangeGraph()
+    cn1 = ChangeNode(1, ast.parse('fn()').body[0], 'fn', ChangeNode.Kind.OPERATION_NODE, 0,
+                     sub_kind=ChangeNode.SubKind.OP_FUNC_CALL, original_label='fn')
+    cn2 = ChangeNode(2, None, '=', ChangeNode.Kind.OPERATION_NODE, 0, sub_kind=ChangeNode.SubKind.OP_ASSIGNMENT)
+    cn3 = ChangeNode(None, None, 'new_fn', ChangeNode.Kind.OPERATION_NODE, 1,
+                     sub_kind=ChangeNode.SubKind.OP_FUNC_CALL, original_label='new_fn')
+    cn4 = ChangeNode(3, None, 'var', ChangeNode.Kind.DATA_NODE, 1)
+    cn1.position = NodePosition(0, 4, 1)
+    cn1.set_property(ChangeNode.Property.SYNTAX_TOKEN_INTERVALS, [[0, 2], [2, 4]])
+
+    ChangeEdge.create(LinkType.MAP, cn1, cn3)
+    ChangeEdge.create(LinkType.PARAMETER, cn1, cn2)
+    ChangeEdge.create(LinkType.PARAMETER, cn3, cn4)
+    ChangeEdge.create(LinkType.DEFINITION, cn4, cn3)
+    cn1.mapped, cn3.mapped = cn3, cn1
+
+    for node in [cn1, cn2, cn3, cn4]:
+        cg.add_node(node)
+    return cg
+
+
+def _get_node_info(node):
+    return (node.statement_num, node.label, node.original_label, node.kind, node.sub_kind, node.version,
+            node.mapped.id if node.mapped else None, node._data)
+
+
+def _get_edge_infos(graph):
+    return sorted((e.node_from.id, e.node_to.id, e.label) for node in graph.nodes for e in node.out_edges)
+
+
+def test_round_trip():
+    graph = _build_graph()
+    data = serialization.encode(graph)
+    assert serialization.is_encoded(data)
+
+    decoded = serialization.decode(data)
+    assert {n.id: _get_node_info(n) for n in decoded.nodes} == {n.id: _get_node_info(n) for n in graph.nodes}
+    assert _get_edge_infos(decoded) == _get_edge_infos(graph)
+    assert all(n.graph is decoded for n in decoded.nodes)
+
+    for node in decoded.nodes:
+        assert all(e in e.node_to.in_edges for e in node.out_edges)
+        if node.label == 'fn':
+            assert ast.dump(node.ast) == ast.dump(ast.parse('fn()').body[0])
+
+
+def test_node_identity():
+    graph = _build_graph()
+    other_graph = _build_graph()
+    assert graph.id != other_graph.id
+    assert sorted(node.id for node in graph.nodes) == [0, 1, 2, 3]
+
+    decoded = serialization.decode(serialization.encode(graph))
+    assert decoded.id == graph.id
+    assert {n.id: _get_node_info(n) for n in decoded.nodes} == {n.id: _get_node_info(n) for n in graph.nodes}
+    assert decoded.nodes == graph.nodes
+    assert not graph.nodes & other_graph.nodes
+
+
+def test_round_trip_without_ast():
+    graph = _build_graph()
+    decoded = serialization.decode(serialization.encode(graph, keep_ast=False))
+
+    assert {n.id: _get_node_info(n) for n in decoded.nodes} == {n.id: _get_node_info(n) for n in graph.nodes}
+    assert all(n.ast is None for n in decoded.nodes)
+    assert {n.id: n.position for n in decoded.nodes} == {n.id: n.position for n in graph.nodes}
+
+    graph.repo_info = RepoInfo('repo', 'path', 'url', 'hash', None, 'a.py', 'a.py', None, None)
+    decoded = serialization.decode(serialization.encode(graph, keep_ast=False))
+    assert decoded.repo_info.repo_name == 'repo'
+    assert decoded.repo_info.old_method is None and decoded.repo_info.new_method is None
+
+
+def test_strip_asts():
+    src = 'def fn():\n    return 1\n\n\ndef other_fn():\n    return 2'
+    methods = [Method('a.py', fn.name, fn, SourceText(src)) for fn in ast.parse(src).body]
+    graph = _build_graph()
+    graph.repo_info = RepoInfo('repo', 'path', 'url', 'hash', None, 'a.py', 'a.py', methods[0], methods[1])
+
+    decoded = serialization.decode(serialization.strip_asts(serialization.encode(graph)))
+    assert {n.id: _get_node_info(n) for n in decoded.nodes} == {n.id: _get_node_info(n) for n in graph.nodes}
+    assert all(n.ast is None for n in decoded.nodes)
+    assert {n.id: n.position for n in decoded.nodes} == {n.id: n.position for n in graph.nodes}
+    assert _get_edge_infos(decoded) == _get_edge_infos(graph)
+    assert decoded.id == graph.id
+
+    old_method, new_method = decoded.repo_info.old_method, decoded.repo_info.new_method
+    assert old_method.ast is None and new_method.ast is None
+    assert old_method.get_source() == 'def fn():\n    return 1'
+    assert new_method.get_source() == 'def other_fn():\n    return 2'
+    assert graph.repo_info.old_method.ast is not None  # the graph itself is not changed
+
+
+def test_sources_stored_once(tmp_path):
+    src = 'def fn():\n    return 1\n\n\ndef other_fn():\n    return 2'
+    source = SourceText(src)
+    methods = [Method('a.py', fn.name, fn, source) for fn in ast.parse(src).body]
+
+    graphs = []
+    for _ in range(3):
+        graph = _build_graph()
+        graph.repo_info = RepoInfo('repo', 'path', 'url', 'hash', None, 'a.py', 'a.py', methods[0], methods[1])
+        graphs.append(graph)
+
+    file_path = storage.store_change_graphs(graphs, storage_dir=str(tmp_path))
+    blob_paths = [os.path.join(dir_path, name) for dir_path, _, names in os.walk(tmp_path / 'blobs') for name in names]
+    assert len(blob_paths) == 1
+    with open(file_path, 'rb') as f:
+        assert b'other_fn():' not in f.read()
+
+    loaded = storage.load_change_graphs(file_path)
+    assert len(loaded) == 3
+    for graph in loaded:
+        assert graph.repo_info.old_method.get_source() == 'def fn():\n    return 1'
+        assert graph.repo_info.new_method.get_source() == 'def other_fn():\n    return 2'
+        assert graph.repo_info.old_method.source is loaded[0].repo_info.old_method.source
+
+
+def test_frozen_adjacency():
+    graph = _build_graph()
+    decoded = serialization.decode(serialization.encode(graph))
+
+    for node, decoded_node in zip(sorted(graph.nodes, key=lambda n: n.id), sorted(decoded.nodes, key=lambda n: n.id)):
+        for kwargs in [{}, {'excluded_labels': [LinkType.MAP]}, {'labels': [LinkType.PARAMETER]}]:
+            assert decoded_node.get_in_nodes(**kwargs) == node.get_in_nodes(**kwargs)
+            assert decoded_node.get_out_nodes(**kwargs) == node.get_out_nodes(**kwargs)
+        assert decoded_node.get_definitions() == node.get_definitions()
+
+    fn = next(n for n in decoded.nodes if n.label == 'fn')
+    var = next(n for n in decoded.nodes if n.label == 'var')
+    assert not fn.get_in_nodes(excluded_labels=[LinkType.MAP])
+    ChangeEdge.create(LinkType.REFERENCE, var, fn)
+    assert fn.get_in_nodes(excluded_labels=[LinkType.MAP]) == {var}
+    assert fn.get_definitions() == {var}
+
+    unpickled = pickle.loads(pickle.dumps(decoded, protocol=5))
+    assert {n.id: _get_node_info(n) for n in unpickled.nodes} == {n.id: _get_node_info(n) for n in decoded.nodes}
+    assert _get_edge_infos(unpickled) == _get_edge_infos(decoded)
+
+
+def test_interned_labels():
+    first, second = [serialization.decode(serialization.encode(_build_graph())) for _ in range(2)]
+
+    first_fn = next(n for n in first.nodes if n.label == 'fn')
+    second_fn = next(n for n in second.nodes if n.label == 'fn')
+    assert first_fn.label is second_fn.label
+    assert first_fn.label_id == second_fn.label_id == LABELS.get_id('fn')
+    assert first_fn.get_seed_label_ids() == (LABELS.get_id('fn'), LABELS.get_id('new_fn'))
+
+    unpickled = pickle.loads(pickle.dumps(first_fn, protocol=5))
+    assert unpickled.label is first_fn.label and unpickled.label_id == first_fn.label_id
+
+
+def test_long_chain_round_trip():
+    cg = ChangeGraph()
+    prev = None
+    for i in range(20000):
+        node = ChangeNode(i, None, f'fn{i}', ChangeNode.Kind.OPERATION_NODE, 0)
+        cg.add_node(node)
+        if prev:
+            ChangeEdge.create(LinkType.PARAMETER, prev, node)
+        prev = node
+
+    with pytest.raises(RecursionError):
+        pickle.dumps(cg, protocol=5)
+
+    decoded = serialization.decode(serialization.encode(cg))
+    assert len(decoded.nodes) == 20000
+    assert _get_edge_infos(decoded) == _get_edge_infos(cg)
+
+
+if __name__ == '__main__':
+    test_round_trip()
+    test_node_identity()
+    test_round_trip_without_ast()
+    test_frozen_adjacency()
+    test_interned_labels()
+    test_long_chain_round_trip()
@@ -1,14 +1,17 @@
+import itertools
+import random
+
 from changegraph.models import ChangeGraph, ChangeNode, ChangeEdge
 from patterns.models import Fragment
-from patterns.exas import normalize
+from patterns.exas import FEATURES, WEIGHT_MASK, normalize
 from pyflowgraph.models import LinkType
 
 
-def test_vector_hash():
+def _build_graph(old_label='M1', new_label='M2'):
     cg = ChangeGraph()
-    cn1 = ChangeNode(None, None, 'M1', ChangeNode.Kind.OPERATION_NODE, 0, sub_kind=ChangeNode.SubKind.OP_FUNC_CALL)
+    cn1 = ChangeNode(None, None, old_label, ChangeNode.Kind.OPERATION_NODE, 0, sub_kind=ChangeNode.SubKind.OP_FUNC_CALL)
     cn2 = ChangeNode(None, None, '=', ChangeNode.Kind.OPERATION_NODE, 0, sub_kind=ChangeNode.SubKind.OP_ASSIGNMENT)
-    cn3 = ChangeNode(None, None, 'M2', ChangeNode.Kind.OPERATION_NODE, 1, sub_kind=ChangeNode.SubKind.OP_FUNC_CALL)
+    cn3 = ChangeNode(None, None, new_label, ChangeNode.Kind.OPERATION_NODE, 1, sub_kind=ChangeNode.SubKind.OP_FUNC_CALL)
     cn4 = ChangeNode(None, None, '=', ChangeNode.Kind.OPERATION_NODE, 1, sub_kind=ChangeNode.SubKind.OP_ASSIGNMENT)
 
     ChangeEdge.create(LinkType.MAP, cn1, cn3)
@@ -16,14 +19,188 @@ def test_vector_hash():
     ChangeEdge.create(LinkType.PARAMETER, cn1, cn2)
     ChangeEdge.create(LinkType.PARAMETER, cn3, cn4)
 
-    cg.nodes.update([cn1, cn2, cn3, cn4])
+    for node in [cn1, cn2, cn3, cn4]:
+        cg.add_node(node)
+    return cn1, cn2, cn3, cn4
+
 
+def test_vector_hash():
+    cn1, cn2, cn3, cn4 = _build_graph()
     fr = Fragment.create_from_node_pair([cn1, cn3])
     ext_fr = Fragment.create_extended(fr, ext_nodes=(cn2, cn4))
 
-    vector_hash = ext_fr.vector.get_hash()
-    assert vector_hash == normalize(27320942899360)
+    features = {FEATURES.get_sequence(feature_id): cnt for feature_id, cnt in ext_fr.vector.data.items()}
+    m, p = FEATURES.get_edge_id(LinkType.MAP), FEATURES.get_edge_id(LinkType.PARAMETER)
+    assert features == {  # the nodes are M1, M2, then the first '=' at 3, the last one at 4
+        (1,): 1,
+        (2,): 1,
+        (1, m, 2): 1,
+        (3,): 1,
+        (1, p, 3): 1,
+        (4,): 1,
+        (4, m, 4): 1,
+        (1, p, 4, m, 4): 1,
+        (2, p, 4): 1,
+        (1, m, 2, p, 4): 1
+    }
+    assert {FEATURES.get_hash(sequence): cnt for sequence, cnt in features.items()} == _get_legacy_vector(ext_fr)
+
+    other_cn1, other_cn2, other_cn3, other_cn4 = _build_graph()
+    other_fr = Fragment.create_from_node_pair([other_cn1, other_cn3])
+    other_ext_fr = Fragment.create_extended(other_fr, ext_nodes=(other_cn2, other_cn4))
+    assert other_ext_fr.vector.data == ext_fr.vector.data
+    assert other_ext_fr.vector.get_hash() == ext_fr.vector.get_hash()
+
+
+class _LegacyExasFeature:
+    """
+    The feature ids before the feature table, a hash of the node positions in the fragment and the edge types
+    """
+    EDGE_LABEL_TO_FEATURE_ID = {
+        LinkType.QUALIFIER: 0, LinkType.CONDITION: 1, LinkType.CONTROL: 2, LinkType.DEFINITION: 3,
+        LinkType.MAP: 4, LinkType.PARAMETER: 5, LinkType.RECEIVER: 6, LinkType.REFERENCE: 7
+    }
+
+    def __init__(self, nodes):
+        self.node_label_to_feature_id = {node.label: num + 1 for num, node in enumerate(nodes)}
+
+    def get_id_by_labels(self, labels):
+        result = 0
+        for num, label in enumerate(labels):
+            if num % 2 == 0:
+                s = self.node_label_to_feature_id.get(label)
+            else:
+                s = normalize(self.EDGE_LABEL_TO_FEATURE_ID.get(label, 0) << 5)
+                result = normalize(result << 8)
+            result = normalize(result + s)
+        return result
+
+
+def _get_legacy_vector(fragment):
+    nodes = fragment.nodes
+    vector = {}
+
+    def add_path(exas_feature, labels):
+        feature_id = exas_feature.get_id_by_labels(labels)
+        vector[feature_id] = vector.get(feature_id, 0) + 1
+
+    exas_feature = _LegacyExasFeature(nodes[:2])
+    for labels in [[nodes[0].label], [nodes[1].label], [nodes[0].label, LinkType.MAP, nodes[1].label]]:
+        add_path(exas_feature, labels)
+
+    for cnt in range(3, len(nodes) + 1):
+        members = set(nodes[:cnt])
+        exas_feature = _LegacyExasFeature(nodes[:cnt])
+
+        def forward(node, sequence):
+            add_path(exas_feature, sequence)
+            if len(sequence) < 7:
+                for e in node.out_edges:
+                    if e.node_to in members:
+                        forward(e.node_to, sequence + [e.label, e.node_to.label])
+
+        def backward(first_node, sequence):
+            forward(nodes[cnt - 1], sequence)
+            if len(sequence) < 7:
+                for e in first_node.in_edges:
+                    if e.node_from in members:
+                        backward(e.node_from, [e.node_from.label, e.label] + sequence)
+
+        backward(nodes[cnt - 1], [nodes[cnt - 1].label])
+    return vector
+
+
+def _build_random_graph(rnd):
+    cg = ChangeGraph()
+    nodes = []
+    for version in [0, 1]:
+        for num in range(8):
+            if num < 3:
+                node = ChangeNode(None, None, rnd.choice(['get', 'put', 'load']), ChangeNode.Kind.OPERATION_NODE,
+                                  version, sub_kind=ChangeNode.SubKind.OP_FUNC_CALL)
+            elif num < 6:
+                node = ChangeNode(None, None, 'var', ChangeNode.Kind.DATA_NODE, version,
+                                  sub_kind=ChangeNode.SubKind.DATA_VARIABLE_USAGE)
+            else:
+                node = ChangeNode(None, None, rnd.choice(['=', '+']), ChangeNode.Kind.OPERATION_NODE, version)
+            nodes.append(node)
+            cg.add_node(node)
+
+    for old_node, new_node in zip(nodes[:8], nodes[8:]):
+        if rnd.random() < 0.7:
+            ChangeEdge.create(LinkType.MAP, old_node, new_node)
+            old_node.mapped, new_node.mapped = new_node, old_node
+
+    for version_nodes in [nodes[:8], nodes[8:]]:
+        for node_from, node_to in itertools.permutations(version_nodes, 2):
+            if rnd.random() < 0.2:
+                ChangeEdge.create(rnd.choice([LinkType.PARAMETER, LinkType.DEFINITION, LinkType.REFERENCE]),
+                                  node_from, node_to)
+    cg.freeze()
+    return cg
+
+
+def test_grouping_matches_legacy_features():
+    rnd = random.Random(7)
+    graphs = [_build_random_graph(rnd) for _ in range(15)]
+    fragments = [Fragment.create_from_node_pair((node, node.mapped)) for graph in graphs for node in graph.nodes
+                 if node.is_seed()]
+
+    compared_cnt = 0
+    for _ in range(3):
+        label_to_fragments = {}
+        for fragment in fragments:
+            for label, exts in fragment.get_label_to_ext_list().items():
+                label_to_fragments.setdefault(label, []).extend(
+                    Fragment.create_extended(fragment, ext) for ext in exts)
+
+        for ext_fragments in label_to_fragments.values():
+            legacy_vectors = [_get_legacy_vector(fragment) for fragment in ext_fragments]
+            for (fr1, legacy1), (fr2, legacy2) in itertools.combinations(zip(ext_fragments, legacy_vectors), 2):
+                assert (fr1.vector.data == fr2.vector.data) == (legacy1 == legacy2)
+                compared_cnt += 1
+
+        fragments = [fragment for ext_fragments in label_to_fragments.values() for fragment in ext_fragments[:20]]
+    assert compared_cnt > 1000
+
+
+def test_vector_keys():
+    rnd = random.Random(11)
+    graphs = [_build_random_graph(rnd) for _ in range(20)]
+    fragments = [Fragment.create_from_node_pair((node, node.mapped)) for graph in graphs for node in graph.nodes
+                 if node.is_seed()]
+    ext_fragments = set()
+    shared_cnt = 0
+    for fragment in fragments:
+        fragment_ext_fragments = [Fragment.create_extended(fragment, ext)
+                                  for exts in fragment.get_label_to_ext_list().values() for ext in exts]
+        ext_fragments.update(fragment_ext_fragments)
+
+        for fr1, fr2 in itertools.combinations(fragment_ext_fragments, 2):  # keyed by the deltas to a shared base
+            key1, key2 = fr1.vector.get_key(fragment.vector), fr2.vector.get_key(fragment.vector)
+            assert key1.features == frozenset(fr1.vector.delta.items())
+            assert (key1 == key2) == (fr1.vector.data == fr2.vector.data)
+            shared_cnt += 1
+    assert shared_cnt > 100
+
+    for fragment in ext_fragments:  # the incremental hash is the one of the merged counts
+        data = fragment.vector.data
+        assert fragment.vector.get_hash() == sum(FEATURES.get_weight(f) * cnt for f, cnt in data.items()) & WEIGHT_MASK
+
+    for fr1, fr2 in itertools.combinations(ext_fragments, 2):
+        is_equal = fr1.vector.data == fr2.vector.data
+        assert fr1.vector.is_equal(fr2.vector) == is_equal
+        assert (fr1.vector.get_key() == fr2.vector.get_key()) == is_equal
+
+    groups = Fragment.create_groups(set(ext_fragments))
+    assert groups
+    for group in groups:
+        assert len({fragment.vector.get_key() for fragment in group}) == 1
+    for group1, group2 in itertools.combinations(groups, 2):
+        assert not next(iter(group1)).vector.is_equal(next(iter(group2)).vector)
 
 
 if __name__ == '__main__':
     test_vector_hash()
+    test_grouping_matches_legacy_features()
+    test_vector_keys()
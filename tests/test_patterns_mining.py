@@ -1,8 +1,17 @@
+import copy
+import datetime
+import random
+
+import pytest
+
 from changegraph.models import ChangeGraph, ChangeNode, ChangeEdge
+from patterns import Miner, workers
 from patterns.models import Fragment, Pattern
 from pyflowgraph.models import LinkType
+from vcs.traverse import RepoInfo
 
 from log import logger
+import vb_utils
 
 
 def test_fragment_label_to_ext_list():
@@ -57,8 +66,8 @@ def test_fragment_label_to_ext_list():
     cn7.mapped = c2n6
     c2n6.mapped = cn7
 
-    cg.nodes.update([cn1, cn2, cn3, cn4, cn5, cn6, cn7])
-    cg.nodes.update([c2n1, c2n2, c2n3, c2n4, c2n5, c2n6])
+    for node in [cn1, cn2, cn3, cn4, cn5, cn6, cn7, c2n1, c2n2, c2n3, c2n4, c2n5, c2n6]:
+        cg.add_node(node)
 
     # 4 v1 get_fw_zone_settings operation.method-call
     # 5 v0 getZoneByName operation.method-call
@@ -88,6 +97,191 @@ def test_fragment_label_to_ext_list():
     assert p.size > 0
 
 
+def test_fragment_node_masks():
+    cg = ChangeGraph()
+    call = ChangeNode(None, None, 'fn', ChangeNode.Kind.OPERATION_NODE, 0, sub_kind=ChangeNode.SubKind.OP_FUNC_CALL)
+    new_call = ChangeNode(None, None, 'new_fn', ChangeNode.Kind.OPERATION_NODE, 1,
+                          sub_kind=ChangeNode.SubKind.OP_FUNC_CALL)
+    assign = ChangeNode(None, None, '=', ChangeNode.Kind.OPERATION_NODE, 0, sub_kind=ChangeNode.SubKind.OP_ASSIGNMENT)
+    var = ChangeNode(None, None, 'var', ChangeNode.Kind.DATA_NODE, 0, sub_kind=ChangeNode.SubKind.DATA_VARIABLE_DECL)
+    for node in [call, new_call, assign, var]:
+        cg.add_node(node)
+
+    pair = Fragment.create_from_node_pair((call, new_call))
+    extended = Fragment.create_extended(pair, (assign,))
+    reordered = Fragment.create_from_nodes(cg, [assign, new_call, call])
+    other = Fragment.create_from_nodes(cg, [assign, var])
+
+    assert extended.contains_node(assign) and not pair.contains_node(assign)
+    assert extended.is_equal(reordered) and not extended.is_equal(pair)
+    assert extended.get_key() == reordered.get_key() and extended.get_key() != pair.get_key()
+    assert Fragment._remove_duplicates({pair, extended, reordered, other}) in [{pair, extended, other},
+                                                                               {pair, reordered, other}]
+    assert extended.contains(pair) and not pair.contains(extended)
+    assert pair.overlap(extended)
+    assert not extended.overlap(other) and not other.overlap(extended)  # only a shared call is an overlap
+    assert not pair.overlap(Fragment.create_from_nodes(ChangeGraph(), [call]))  # another graph
+
+    unbound = ChangeNode(None, None, 'var', ChangeNode.Kind.DATA_NODE, 0)
+    with pytest.raises(ValueError):  # an unbound node would share the bit of a bound one
+        Fragment.create_extended(pair, (unbound,))
+
+
+def test_graph_overlapped_fragments():
+    rnd = random.Random(5)
+    fragments = []
+    for _ in range(3):
+        cg = ChangeGraph()
+        nodes = []
+        for num in range(10):
+            sub_kind = ChangeNode.SubKind.OP_FUNC_CALL if num % 2 == 0 else ChangeNode.SubKind.OP_ASSIGNMENT
+            nodes.append(ChangeNode(None, None, f'n{num}', ChangeNode.Kind.OPERATION_NODE, 0, sub_kind=sub_kind))
+            cg.add_node(nodes[-1])
+        fragments.extend(Fragment.create_from_nodes(cg, rnd.sample(nodes, 3)) for _ in range(15))
+
+    overlapped_fragments = Pattern.get_graph_overlapped_fragments(fragments)
+
+    expected = []  # the fragments left greedily in order, as filtered pairwise
+    for graph in {fragment.graph for fragment in fragments}:
+        graph_fragments = [fragment for fragment in fragments if fragment.graph is graph]
+        vb_utils.filter_list(graph_fragments, condition=lambda i, j: graph_fragments[i].overlap(graph_fragments[j]),
+                             post_condition_fn=lambda i, j: expected.append(graph_fragments[j]))
+    assert overlapped_fragments and len(overlapped_fragments) == len(expected)
+    for graph in {fragment.graph for fragment in fragments}:
+        graph_overlapped = [fragment for fragment in overlapped_fragments if fragment.graph is graph]
+        assert graph_overlapped == [fragment for fragment in expected if fragment.graph is graph]
+
+
+def _filter_patterns_pairwise(size_to_patterns):
+    for size1 in sorted(size_to_patterns.keys()):
+        for pattern1 in copy.copy(size_to_patterns[size1]):
+            if any(pattern2 != pattern1 and pattern2.contains(pattern1)
+                   for size2, patterns2 in size_to_patterns.items() if size2 >= size1 for pattern2 in patterns2):
+                size_to_patterns[size1].remove(pattern1)
+    return {size: patterns for size, patterns in size_to_patterns.items() if patterns}
+
+
+def test_filter_patterns():
+    rnd = random.Random(3)
+    graph_nodes = []
+    for _ in range(2):
+        cg = ChangeGraph()
+        nodes = [ChangeNode(None, None, rnd.choice(['a', 'b', 'c']), ChangeNode.Kind.OPERATION_NODE, 0,
+                            sub_kind=ChangeNode.SubKind.OP_FUNC_CALL) for _ in range(8)]
+        for node in nodes:
+            cg.add_node(node)
+        for node_from, node_to in zip(nodes, nodes[1:]):
+            ChangeEdge.create(rnd.choice([LinkType.PARAMETER, LinkType.DEFINITION]), node_from, node_to)
+        graph_nodes.append((cg, nodes))
+
+    miner = Miner()
+    for _ in range(40):
+        size = rnd.randint(2, 5)
+        fragments = set()
+        for _ in range(rnd.randint(1, 3)):
+            cg, nodes = rnd.choice(graph_nodes)
+            start = rnd.randint(0, len(nodes) - size)
+            fragments.add(Fragment.create_from_nodes(cg, nodes[start:start + size]))
+        miner.add_pattern(Pattern(fragments, len(fragments)))
+
+    expected = _filter_patterns_pairwise({size: set(patterns) for size, patterns in miner._size_to_patterns.items()})
+    miner._filter_patterns()
+    assert miner._size_to_patterns == expected
+    assert 0 < miner._patterns_cnt == sum(len(patterns) for patterns in expected.values()) < 40
+
+
+def _build_renamed_call_graph(old_label, new_label):
+    cg = ChangeGraph()
+    old_call = ChangeNode(None, None, old_label, ChangeNode.Kind.OPERATION_NODE, 0,
+                          sub_kind=ChangeNode.SubKind.OP_FUNC_CALL)
+    old_arg = ChangeNode(None, None, '1', ChangeNode.Kind.DATA_NODE, 0, sub_kind=ChangeNode.SubKind.DATA_LITERAL)
+    new_call = ChangeNode(None, None, new_label, ChangeNode.Kind.OPERATION_NODE, 1,
+                          sub_kind=ChangeNode.SubKind.OP_FUNC_CALL)
+    new_arg = ChangeNode(None, None, '1', ChangeNode.Kind.DATA_NODE, 1, sub_kind=ChangeNode.SubKind.DATA_LITERAL)
+    for node in [old_call, old_arg, new_call, new_arg]:
+        cg.add_node(node)
+
+    for node, mapped in [(old_call, new_call), (old_arg, new_arg)]:
+        ChangeEdge.create(LinkType.MAP, node, mapped)
+        node.mapped, mapped.mapped = mapped, node
+    ChangeEdge.create(LinkType.PARAMETER, old_arg, old_call)
+    ChangeEdge.create(LinkType.PARAMETER, new_arg, new_call)
+    cg.freeze()
+    return cg
+
+
+def test_min_date():
+    graphs = [_build_renamed_call_graph('load', 'fetch') for _ in range(4)]
+    for graph, year in zip(graphs, [2019, None, None, None]):
+        commit_dtm = datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc) if year else None
+        graph.repo_info = RepoInfo('repo', '', '', 'hash', commit_dtm, 'a.py', 'a.py', None, None)
+
+    miner = Miner()
+    miner.MIN_DATE = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)  # the graphs without a date are kept
+    miner.mine_patterns(graphs)
+
+    patterns = [pattern for patterns in miner._size_to_patterns.values() for pattern in patterns]
+    assert [len(pattern.fragments) for pattern in patterns] == [3]
+    assert all(fragment.graph.repo_info.commit_dtm is None for fragment in patterns[0].fragments)
+
+
+def _get_mined_fragments(miner):
+    return {(size, frozenset(frozenset(fragment.get_key() for fragment in pattern.fragments) for pattern in patterns))
+            for size, patterns in miner._size_to_patterns.items()}
+
+
+def test_mine_seed_groups_in_processes():
+    graphs = [_build_renamed_call_graph('load', 'fetch') for _ in range(4)]
+    graphs += [_build_renamed_call_graph('get', 'put') for _ in range(3)]
+
+    serial_miner = Miner()
+    serial_miner.PROCESSES = 1
+    serial_miner.mine_patterns(graphs)
+
+    miner = Miner()
+    miner.PROCESSES = 2
+    miner.mine_patterns(graphs)
+
+    assert miner._patterns_cnt == serial_miner._patterns_cnt == 2
+    assert _get_mined_fragments(miner) == _get_mined_fragments(serial_miner)
+    for patterns in miner._size_to_patterns.values():
+        for pattern in patterns:
+            assert all(fragment.graph in graphs for fragment in pattern.fragments)
+
+
+def test_extension_pool():
+    graphs = [_build_renamed_call_graph('load', 'fetch') for _ in range(4)]
+    graphs += [_build_renamed_call_graph('get', 'put') for _ in range(3)]
+
+    serial_miner = Miner()
+    serial_miner.PROCESSES = 1
+    serial_miner.mine_patterns(graphs)
+
+    Pattern.DO_ASYNC_MINING = True
+    try:
+        miner = Miner()
+        miner.PROCESSES = 1
+        miner.mine_patterns(graphs)
+    finally:
+        Pattern.DO_ASYNC_MINING = False
+
+    assert miner._patterns_cnt == serial_miner._patterns_cnt == 2
+    assert _get_mined_fragments(miner) == _get_mined_fragments(serial_miner)
+
+    with workers.ExtensionPool(graphs, processes=2) as pool:
+        pairs = [(node, node.mapped) for graph in graphs[:4] for node in graph.nodes if node.is_seed()]
+        pattern = Pattern(set(Fragment.create_from_node_pair(pair) for pair in pairs))
+        label_to_fragment_to_ext_list = {}
+        for fragment in pattern.fragments:
+            for label, exts in fragment.get_label_to_ext_list().items():
+                label_to_fragment_to_ext_list.setdefault(label, {})[fragment] = exts
+
+        group, freq = pool.get_most_freq_group_and_freq(pattern, label_to_fragment_to_ext_list)
+        serial_group, serial_freq = pattern._get_most_freq_group_and_freq(label_to_fragment_to_ext_list)
+        assert freq == serial_freq == 4
+        assert {fragment.get_key() for fragment in group} == {fragment.get_key() for fragment in serial_group}
+
+
 def _get_freq_group(fr):
     max_freq = 0
     freq_group = None
@@ -117,6 +311,11 @@ def init():
 
     if __name__ == '__main__':
         test_fragment_label_to_ext_list()
+        test_fragment_node_masks()
+        test_graph_overlapped_fragments()
+        test_filter_patterns()
+        test_mine_seed_groups_in_processes()
+        test_extension_pool()
 
 
 init()
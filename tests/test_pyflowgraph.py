@@ -1,4 +1,11 @@
+import json
+import os
+
+import pytest
+
 import pyflowgraph
+from pyflowgraph.batch import build_batch
+from pyflowgraph.build import GraphBuilder, GraphBuildingException
 from tests import utils
 
 
@@ -256,7 +263,65 @@ def _test_return_in_ifs_closure():
     assert kind_to_cnt[True] == 6 and kind_to_cnt[False] == 2
 
 
+def test_dict_export():
+    fg = _build_fg("""
+        a = 10
+        if a > 10:
+            print(a)
+    """)
+    graph = pyflowgraph.export_graph_dict(fg)
+
+    assert [n['id'] for n in graph['nodes']] == sorted(n.statement_num for n in fg.nodes)
+    assert len(graph['edges']) == sum(len(n.out_edges) for n in fg.nodes)
+    assert {n['label'] for n in graph['nodes'] if n['type'] == 'control'} == {'if'}
+    assert all(len(e) == 4 for e in graph['edges'] if e[2] == 'control')
+
+
+def test_build_batch(tmp_path):
+    src_dir = tmp_path / 'src'
+    os.makedirs(src_dir / 'pkg')
+    (src_dir / 'a.py').write_text('a = 1\nprint(a)\n')
+    (src_dir / 'pkg' / 'b.py').write_text('b = 2\n')
+    (src_dir / 'pkg' / 'broken.py').write_text('def f(:\n')
+    (src_dir / 'notes.txt').write_text('b = 3\n')
+
+    output_path = str(tmp_path / 'graphs.jsonl')
+    assert build_batch([str(src_dir)], output_path, processes=1) == 2
+
+    with open(output_path) as f:
+        graphs = [json.loads(line) for line in f]
+    assert sorted(os.path.relpath(graph['path'], src_dir) for graph in graphs) == ['a.py', os.path.join('pkg', 'b.py')]
+    assert all(graph['nodes'] and 'edges' in graph for graph in graphs)
+
+    with open(f'{output_path}.stats.jsonl') as f:
+        path_to_stats = {os.path.relpath(stats['path'], src_dir): stats for stats in map(json.loads, f)}
+    assert len(path_to_stats) == 3
+    assert sum(1 for stats in path_to_stats.values() if stats['status'] == 'error') == 1
+
+    broken_stats = path_to_stats[os.path.join('pkg', 'broken.py')]
+    assert broken_stats['status'] == 'error' and broken_stats['error']
+    for graph in graphs:
+        stats = path_to_stats[os.path.relpath(graph['path'], src_dir)]
+        assert stats['status'] == 'ok' and stats['time'] >= 0
+        assert (stats['nodes'], stats['edges']) == (len(graph['nodes']), len(graph['edges']))
+
+
+def test_strict_debug_building():
+    log_level = GraphBuilder.LOG_LEVEL
+    GraphBuilder.LOG_LEVEL = 'DEBUG'
+    try:
+        with pytest.raises(GraphBuildingException):
+            pyflowgraph.build_from_source(utils.format_src("""
+                def f():
+                    global a
+                    a = 1
+            """), strict=True)
+    finally:
+        GraphBuilder.LOG_LEVEL = log_level
+
+
 if __name__ == '__main__':
     test_graph_building()
     test_controls_switching()
-    test_closure()
\ No newline at end of file
+    test_closure()
+    test_strict_debug_building()
@@ -0,0 +1,149 @@
+import ast
+import datetime
+import os
+import pickle
+
+import pytest
+
+import storage
+from changegraph import serialization
+from changegraph.models import ChangeGraph, ChangeNode
+from storage import ChangeGraphStore, load_index
+from storage.catalog import CatalogFilterException
+from storage.loader import iter_change_graphs
+from storage.segments import Codec, SegmentWriter, get_index_path, read_record, read_records
+from vb_utils import NodePosition
+from vcs.traverse import RepoInfo
+
+
+def _write_records(storage_dir, records, max_size=1024 * 1024, codec=Codec.NONE):
+    file_paths = []
+    with SegmentWriter(str(storage_dir), max_size, codec=codec) as writer:
+        for graph_id, record in enumerate(records):
+            file_path, _, _ = writer.append(record, graph_id)
+            if file_path not in file_paths:
+                file_paths.append(file_path)
+    return file_paths
+
+
+def test_round_trip_and_rollover(tmp_path):
+    records = [f'record {i} '.encode() * 50 for i in range(30)]
+    for codec in [Codec.NONE, Codec.ZLIB, Codec.LZMA]:
+        storage_dir = tmp_path / str(codec)
+        os.makedirs(storage_dir)
+
+        file_paths = _write_records(storage_dir, records, max_size=2000, codec=codec)
+        if codec == Codec.NONE:
+            assert len(file_paths) > 1
+        assert [record for file_path in file_paths for record in read_records(file_path)] == records
+
+
+def test_corrupt_records_skipped(tmp_path):
+    records = [bytes([i]) * 100 for i in range(5)]
+    file_path, = _write_records(tmp_path, records)
+
+    with open(file_path, 'r+b') as f:
+        data = bytearray(f.read())
+        data[150] ^= 0xff  # payload of the second record
+        data[2 * 113 + 5] ^= 0xff  # length of the third record
+        f.seek(0)
+        f.write(data[:-10])  # the last record is truncated
+        f.truncate()
+
+    assert list(read_records(file_path)) == [records[0], records[3]]
+
+    payloads = read_records(file_path)
+    assert next(payloads) == records[0]
+    payloads.close()  # the segment is unmapped with the first record streamed
+
+    open(tmp_path / 'empty.cgseg', 'wb').close()
+    assert list(read_records(str(tmp_path / 'empty.cgseg'))) == []
+
+
+def test_index_and_store(tmp_path):
+    records = [f'record {i}'.encode() for i in range(10)]
+    file_path, = _write_records(tmp_path, records)
+    index = load_index(str(tmp_path))
+    assert sorted(index) == list(range(10))
+
+    store = pickle.loads(pickle.dumps(ChangeGraphStore(str(tmp_path))))
+    file_name, offset, _ = store.index[3]
+    assert bytes(read_record(store._get_buffer(file_name), offset)) == records[3]
+    store.close()
+
+    os.remove(get_index_path(file_path))  # the records are found by scanning the segment
+    offsets = sorted(offset for _, offset, _ in load_index(str(tmp_path)).values())
+    assert offsets == sorted(offset for _, offset, _ in index.values())
+
+
+def _build_seeded_graph(label):
+    graph = ChangeGraph()
+    old_node = ChangeNode(1, None, label, ChangeNode.Kind.OPERATION_NODE, ChangeNode.Version.BEFORE_CHANGES,
+                          sub_kind=ChangeNode.SubKind.OP_FUNC_CALL)
+    new_node = ChangeNode(1, None, f'new_{label}', ChangeNode.Kind.OPERATION_NODE, ChangeNode.Version.AFTER_CHANGES,
+                          sub_kind=ChangeNode.SubKind.OP_FUNC_CALL)
+    old_node.mapped, new_node.mapped = new_node, old_node
+    graph.add_node(old_node)
+    graph.add_node(new_node)
+    return graph
+
+
+def test_seeded_graph_ids(tmp_path):
+    graphs = [_build_seeded_graph('fn') for _ in range(3)] + [_build_seeded_graph('other_fn')]
+    storage.store_change_graphs(graphs, storage_dir=str(tmp_path))
+
+    store = ChangeGraphStore(str(tmp_path))
+    graph_ids = store.get_seeded_graph_ids(3)
+    assert len(graph_ids) == 3
+    assert all(graph.get_seed_counts() == {'fn~new_fn': 1} for graph in store.iter_change_graphs(graph_ids))
+    assert len(store.get_seeded_graph_ids(1)) == 4
+
+
+def test_catalog_filters(tmp_path):
+    graphs = []
+    for repo_name, year in [('repo', 2019), ('repo', 2021), ('other_repo', 2021), ('repo', None)]:
+        graph = _build_seeded_graph('fn')
+        commit_dtm = datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc) if year else None
+        graph.repo_info = RepoInfo(repo_name, '', '', 'hash', commit_dtm, 'a.py', 'tests/a.py', None, None)
+        graphs.append(graph)
+    storage.store_change_graphs(graphs, storage_dir=str(tmp_path))
+
+    store = ChangeGraphStore(str(tmp_path))
+    assert len(store.select_graph_ids()) == 4
+    assert len(store.select_graph_ids(['repo_name=repo'])) == 3
+    assert len(store.select_graph_ids(['repo_name=repo', 'commit_dtm>=2020-01-01'])) == 1
+    assert len(store.select_graph_ids(['new_file_path~tests/*', 'node_count>1'])) == 4
+
+    min_date = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)  # the graph without a date is kept
+    assert len(store.select_graph_ids(min_date=min_date)) == 3
+    assert store.get_seeded_graph_ids(3, min_date=min_date) == store.select_graph_ids(min_date=min_date)
+
+    with pytest.raises(CatalogFilterException):
+        store.select_graph_ids(['repo_name; DROP TABLE change_graphs'])
+
+
+def test_loader(tmp_path):
+    graphs = [_build_seeded_graph(f'fn{i}') for i in range(6)]
+    for graph in graphs:
+        for node in graph.nodes:
+            node.ast = ast.parse(f'{node.label}()').body[0]
+            node.position = NodePosition(0, len(node.label) + 2, 1)
+
+    file_path = storage.store_change_graphs(graphs[:5], storage_dir=str(tmp_path))
+    with open(tmp_path / 'legacy.pickle', 'wb') as f:  # files stored before the segments
+        pickle.dump([serialization.encode(graphs[5]), b'undecodable'], f)
+
+    store = ChangeGraphStore(str(tmp_path))
+    graph_ids = store.graph_ids
+    _, offset, length = store.index[graph_ids[2]]
+    with open(file_path, 'r+b') as f:
+        f.seek(offset + length // 2)
+        f.write(b'corrupt')
+
+    for processes in [1, 2]:  # the workers strip the asts
+        loaded = list(iter_change_graphs(ChangeGraphStore(str(tmp_path)), graph_ids, processes=processes,
+                                         chunk_size=2))
+        assert [list(graph.get_seed_counts()) for graph in loaded] == \
+               [[f'fn{i}~new_fn{i}'] for i in [0, 1, 3, 4, 5]]
+        assert all((node.ast is None) == (processes > 1) for graph in loaded for node in graph.nodes)
+        assert all(node.position is not None for graph in loaded for node in graph.nodes)
@@ -1,3 +1,6 @@
+import re
+
+
 def merge_dict(d1, d2):
     for k, v in d2.items():
         d1[k] = v
@@ -40,22 +43,141 @@ def filter_list(lst, condition, post_condition_fn=None):
         i += 1
 
 
-class LineReader:
-    def __init__(self, content):
-        self.line_pos_arr = []
-        self.content = content
+def iter_bits(mask):
+    """
+    Yields the set bits of a mask from the lowest one
+    """
+    while mask:
+        bit = mask & -mask
+        yield bit
+        mask ^= bit
+
+
+class NodePosition:
+    """
+    Character offsets of a node in its source and the line it starts at, a lightweight replacement of ast nodes
+    """
+    __slots__ = ('start', 'end', 'lineno')
+
+    def __init__(self, start, end, lineno):
+        self.start = start
+        self.end = end
+        self.lineno = lineno
+
+    def __eq__(self, other):
+        return isinstance(other, NodePosition) \
+            and (self.start, self.end, self.lineno) == (other.start, other.end, other.lineno)
+
+    def __repr__(self):
+        return f'[{self.start}:{self.end}] line {self.lineno}'
+
+
+class SourceText:
+    """
+    Source text with line offsets computed once and memoized ast node segments,
+    one object is meant to be shared by everything that maps positions into the same source
+    """
+    _LINE_END_RE = re.compile(r'\r\n|\r|\n')  # the same line ends as in ast.get_source_segment
+
+    def __init__(self, text):
+        self.text = text
+
+        self._line_offsets = None
+        self._newline_positions = None
+        self._utf8_offsets = {}
+        self._segments = {}
+
+    def __getstate__(self):
+        return {'text': self.text}
 
-        self._parse(content)
+    def __setstate__(self, state):
+        self.__init__(state['text'])
 
-    def _parse(self, content):
-        self.line_pos_arr.append(0)
-        for ch_num in range(len(content)):
-            if content[ch_num] == '\n':
-                self.line_pos_arr.append(ch_num)
+    @property
+    def line_offsets(self):
+        if self._line_offsets is None:
+            offsets = [0] + [m.end() for m in self._LINE_END_RE.finditer(self.text)]
+            if offsets[-1] == len(self.text):
+                offsets.pop()
+            self._line_offsets = offsets
+        return self._line_offsets
+
+    @property
+    def newline_positions(self):
+        if self._newline_positions is None:
+            self._newline_positions = [0] + [m.start() for m in re.finditer('\n', self.text)]
+        return self._newline_positions
 
     # consider both start with 1
     def get_pos(self, line, col):
-        return self.line_pos_arr[line - 1] + col - 1
+        return self.newline_positions[line - 1] + col - 1
+
+    def get_line(self, line):
+        offsets = self.line_offsets
+        end = offsets[line] if line < len(offsets) else len(self.text)
+        return self.text[offsets[line - 1]:end]
+
+    def get_offset(self, line, utf8_col):
+        """
+        Converts 1-based line and 0-based utf8 column, as stored in ast nodes, to a character offset
+        """
+        offsets = self.line_offsets
+        if line > len(offsets):
+            return len(self.text)
+
+        col_offsets = self._utf8_offsets.get(line)
+        if col_offsets is None:
+            line_text = self.get_line(line)
+            if line_text.isascii():
+                col_offsets = len(line_text)
+            else:
+                col_offsets = [i for i, c in enumerate(line_text) for _ in c.encode('utf8')]
+                col_offsets.append(len(line_text))
+            self._utf8_offsets[line] = col_offsets
+
+        if isinstance(col_offsets, int):
+            return offsets[line - 1] + max(0, min(col_offsets, utf8_col))
+
+        utf8_col = max(0, min(len(col_offsets) - 1, utf8_col))
+        if 0 < utf8_col and col_offsets[utf8_col] == col_offsets[utf8_col - 1]:
+            raise ValueError(f'Column {utf8_col} splits a character at line {line}')
+        return offsets[line - 1] + col_offsets[utf8_col]
+
+    def get_position(self, node):
+        """
+        Returns the NodePosition of an ast node or None if the node has no end position,
+        raises like ast.get_source_segment when the node does not fit the source
+        """
+        try:
+            lineno, col_offset, end_lineno, end_col_offset = \
+                node.lineno, node.col_offset, node.end_lineno, node.end_col_offset
+        except AttributeError:
+            return None
+        if end_lineno is None or end_col_offset is None:
+            return None
+
+        if lineno > len(self.line_offsets) or end_lineno > len(self.line_offsets):
+            raise IndexError(f'Node {node} is out of the source bounds')
+        return NodePosition(self.get_offset(lineno, col_offset), self.get_offset(end_lineno, end_col_offset), lineno)
+
+    def get_segment(self, node):
+        """
+        Memoized equivalent of ast.get_source_segment(self.text, node)
+        """
+        try:
+            key = (node.lineno, node.col_offset, node.end_lineno, node.end_col_offset)
+        except AttributeError:
+            return None
+
+        segment = self._segments.get(key)
+        if segment is None:
+            position = self.get_position(node)
+            if position is None:
+                return None
+
+            segment = self.text[position.start:position.end]
+            self._segments[key] = segment
+        return segment
 
 
 def split_list(lst, chunk_size):
@@ -1,8 +1,7 @@
 import os
 import tempfile
 import ast
-import uuid
-import pickle
+import copy
 import multiprocessing
 import time
 import json
@@ -16,6 +15,8 @@ from pydriller.domain.commit import ModificationType
 
 import settings
 import changegraph
+import storage
+from vb_utils import NodePosition, SourceText
 
 
 class GitAnalyzer:
@@ -148,20 +149,7 @@ class GitAnalyzer:
 
     @staticmethod
     def _store_change_graphs(graphs):
-        pickled_graphs = []
-        for graph in graphs:
-            try:
-                pickled = pickle.dumps(graph, protocol=5)
-                pickled_graphs.append(pickled)
-            except RecursionError:
-                logger.error(f'Unable to pickle graph, file_path={graph.repo_info.old_method.file_path}, '
-                             f'method={graph.repo_info.old_method.full_name}', exc_info=True)
-
-        filename = uuid.uuid4().hex
-        logger.info(f'Trying to store graphs to {filename}', show_pid=True)
-        with open(os.path.join(GitAnalyzer.STORAGE_DIR, f'{filename}.pickle'), 'w+b') as f:
-            pickle.dump(pickled_graphs, f)
-        logger.info(f'Storing graphs to {filename} finished', show_pid=True)
+        storage.store_change_graphs(graphs, storage_dir=GitAnalyzer.STORAGE_DIR)
 
     @staticmethod
     def _build_and_store_change_graphs(commit, parse_only_tests=False):
@@ -228,7 +216,7 @@ class GitAnalyzer:
                                    f'repo={commit["repo"]["path"]}, '
                                    f'commit=#{commit["hash"]}, '
                                    f'method={old_method.full_name}, '
-                                   f'line={old_method.ast.lineno}', exc_info=True, show_pid=True)
+                                   f'line={old_method.lineno}', exc_info=True, show_pid=True)
                         continue
 
                     change_graphs.append(cg)
@@ -277,7 +265,7 @@ class GitAnalyzer:
 class ASTMethodExtractor(ast.NodeVisitor):
     def __init__(self, path, src):
         self.file_path = path
-        self.src = src
+        self.source = SourceText(src.strip())
 
     def visit_Module(self, node):
         methods = []
@@ -300,25 +288,88 @@ class ASTMethodExtractor(ast.NodeVisitor):
         return methods
 
     def visit_FunctionDef(self, node):
-        return [Method(self.file_path, node.name, node, self.src)]
+        return [Method(self.file_path, node.name, node, self.source)]
 
 
 class Method:
-    def __init__(self, path, name, ast, src):
+    def __init__(self, path, name, ast, source):
         self.file_path = path
         self.ast = ast
-        self.src = src.strip()
+        self.position = None  # replaces ast in the stored graphs, see copy_without_ast
+        self._source = source  # SourceText shared by all the methods of a file
+        self.source_key = None  # key of the source in a blob store, see store_source
+        self._blob_store = None
 
         self.name = name
         self.full_name = name
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if state['source_key'] is not None:
+            state['_source'] = None  # loaded back from the blob store on demand
+        return state
+
+    def __setstate__(self, state):
+        if 'src' in state:  # graphs stored before the source was shared
+            state['source'] = SourceText(state.pop('src'))
+        if 'source' in state:  # graphs stored before the blob store
+            state['_source'] = state.pop('source')
+        state.setdefault('position', None)
+        state.setdefault('source_key', None)
+        state.setdefault('_blob_store', None)
+        self.__dict__.update(state)
+
+    @property
+    def source(self):
+        if self._source is None and self.source_key is not None:
+            self._source = self._blob_store.get_source(self.source_key)
+        return self._source
+
+    @property
+    def src(self):
+        return self.source.text
+
+    @property
+    def lineno(self):
+        return self.ast.lineno if self.ast is not None else self.position.lineno
+
     def extend_path(self, prefix, separator='.'):
         self.full_name = f'{prefix}{separator}{self.full_name}'
 
+    def store_source(self, blob_store):
+        """
+        Writes the file source to the blob store, after that only its key and the method span are pickled
+        """
+        if self.position is None:
+            self.position = self._get_position()
+        self.source_key = blob_store.put(self.source.text)
+
+    def set_blob_store(self, blob_store):
+        self._blob_store = blob_store
+
+    def _get_position(self):
+        try:
+            position = self.source.get_position(self.ast)
+        except:
+            position = None
+        return position or NodePosition(None, None, self.ast.lineno)
+
+    def copy_without_ast(self):
+        result = copy.copy(self)
+        result.position = self.position or self._get_position()
+        result.ast = None
+        return result
+
     # TODO:  last = lines[end_lineno].encode()[:end_col_offset].decode(), IndexError: list index out of range
     def get_source(self):
+        if self.ast is None:
+            if self.position.start is None:
+                logger.info(f'Unable to extract source segment of {self.full_name}', show_pid=True)
+                return None
+            return self.source.text[self.position.start:self.position.end]
+
         try:
-            return ast.get_source_segment(self.src, self.ast)
+            return self.source.get_segment(self.ast)
         except:
             logger.info(f'Unable to extract source segment from {self.ast}', show_pid=True)
             return None